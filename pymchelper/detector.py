@@ -1,17 +1,21 @@
 import os
+import copy
 import logging
+import pickle
 from collections import namedtuple, defaultdict
 
 import numpy as np
 from enum import IntEnum
 
+from pymchelper.readers.binary import NpzReader, HdfReader
 from pymchelper.readers.fluka import FlukaBinaryReader
 from pymchelper.readers.shieldhit import SHTextReader, SHBinaryReader
 from pymchelper.shieldhit.detector.detector_type import SHDetType
 from pymchelper.shieldhit.detector.estimator_type import SHGeoType
+from pymchelper.writers.binary import NpzWriter, HdfWriter
 from pymchelper.writers.excel import ExcelWriter
 from pymchelper.writers.plots import ImageWriter, GnuplotDataWriter, PlotDataWriter
-from pymchelper.writers.shieldhit import TxtWriter
+from pymchelper.writers.shieldhit import TxtWriter, SHBinaryWriter
 from pymchelper.writers.trip98 import TripCubeWriter, TripDddWriter
 
 logger = logging.getLogger(__name__)
@@ -28,6 +32,9 @@ class Converters(IntEnum):
     tripcube = 4
     tripddd = 5
     excel = 6
+    npz = 7
+    hdf = 8
+    bdo = 9
 
 
 class ErrorEstimate(IntEnum):
@@ -52,10 +59,71 @@ _converter_mapping = {
     Converters.image: ImageWriter,
     Converters.tripcube: TripCubeWriter,
     Converters.tripddd: TripDddWriter,
-    Converters.excel: ExcelWriter
+    Converters.excel: ExcelWriter,
+    Converters.npz: NpzWriter,
+    Converters.hdf: HdfWriter,
+    Converters.bdo: SHBinaryWriter
 }
 
 
+class IncompatibleFilesError(ValueError):
+    """
+    Raised when input files which are to be merged don't come from the same estimator.
+    """
+    pass
+
+
+HeaderInfo = namedtuple('HeaderInfo', ['geotyp', 'dettyp', 'nstat',
+                                       'nx', 'ny', 'nz',
+                                       'xmin', 'xmax', 'ymin', 'ymax', 'zmin', 'zmax'])
+
+
+def read_header(filename):
+    """
+    Reads only header of binary file, data block is skipped without being read.
+    :param filename: binary file name
+    :return: HeaderInfo record
+    """
+    detector = Detector()
+    detector.read_header(filename)
+    return detector.header
+
+
+def read_page_headers(filename):
+    """
+    Reads only headers of all pages stored in binary file, data block is skipped without being read.
+    :param filename: binary file name
+    :return: tuple of HeaderInfo records, one for each page
+    """
+    detector = Detector()
+    detector.read_header(filename)
+    return detector.page_headers
+
+
+def check_compatibility(input_file_list, headers):
+    """
+    Checks if all input files contain data from the same estimator (same number of pages and, for each page,
+    same geometry and detector type, binning and ranges). Raises IncompatibleFilesError if that is not the case.
+    :param input_file_list: list of input files
+    :param headers: list of tuples of HeaderInfo records (one for each page, see @read_page_headers),
+                    one tuple for each input file
+    :return: none
+    """
+    ref_file, ref_pages = input_file_list[0], headers[0]
+    for filename, pages in zip(input_file_list[1:], headers[1:]):
+        if len(pages) != len(ref_pages):
+            raise IncompatibleFilesError("File {:s} is not compatible with {:s}: {:d} pages instead of {:d}".format(
+                filename, ref_file, len(pages), len(ref_pages)))
+        for page_no, (header, ref) in enumerate(zip(pages, ref_pages)):
+            ranges = (header.xmin, header.xmax, header.ymin, header.ymax, header.zmin, header.zmax)
+            ref_ranges = (ref.xmin, ref.xmax, ref.ymin, ref.ymax, ref.zmin, ref.zmax)
+            if (header.geotyp, header.dettyp) != (ref.geotyp, ref.dettyp) or \
+                    (header.nx, header.ny, header.nz) != (ref.nx, ref.ny, ref.nz) or \
+                    not np.allclose(ranges, ref_ranges, equal_nan=True):
+                raise IncompatibleFilesError("File {:s} is not compatible with {:s} (page {:d}): {} differs from {}"
+                                             .format(filename, ref_file, page_no + 1, header, ref))
+
+
 class Detector:
     """
     Holds data read from single estimator
@@ -83,40 +151,127 @@ class Detector:
 
     # number of files
     counter = -1
+    # number of files merged into the file which was read (saved by npz and hdf writers), used by weighted merging
+    merged_files = 1
+
+    _M2 = None  # accumulator needed by average_with_other and average_with_nan methods
+    _bin_counter = None  # number of valid (not NaN) samples in each bin, needed by average_with_nan method
+
+    _axis_cache = None  # bin coordinates arrays, filled on demand by bin_centers and axis_values methods
 
-    _M2 = None  # accumulator needed by average_with_other method
+    # multi-page estimators (i.e. SPC) hold many detectors (pages), data of all pages is kept in single array
+    pages = 1
+    _page_headers = None  # detectors without data, holding header information of each page
+    _page_offsets = None  # position of each page in data array
+    _page_shapes = None  # shape of data array of each page
 
-    def read(self, filename, nscale=1):
+    def __getstate__(self):
         """
-        Reads binary file with. Automatically discovers which reader should be used.
-        :param filename: binary file name
-        :return: none
+        Transient caches are not pickled (i.e. when saving checkpoint or sending detector to worker process).
+        """
+        state = self.__dict__.copy()
+        state.pop('_axis_cache', None)
+        return state
+
+    @staticmethod
+    def _reader(filename, mmap=False):
+        """
+        Automatically discovers which reader should be used.
         """
         reader = SHTextReader(filename)
         if filename.endswith(".bdo") or filename.endswith(".bdox"):
-            reader = SHBinaryReader(filename)
+            reader = SHBinaryReader(filename, mmap)
+        elif filename.endswith(".npz"):
+            reader = NpzReader(filename)
+        elif filename.endswith(".h5"):
+            reader = HdfReader(filename)
         # find better way to discover if file comes from Fluka
         elif "_fort" in filename:
             reader = FlukaBinaryReader(filename)
-        reader.read(self, nscale)
+        return reader
+
+    def read(self, filename, nscale=1, mmap=False):
+        """
+        Reads binary file with. Automatically discovers which reader should be used.
+        :param filename: binary file name
+        :param mmap: if True, data block of SHIELD-HIT12A binary file is memory-mapped as read-only array
+        :return: none
+        """
+        self.merged_files = 1
+        self._reader(filename, mmap).read(self, nscale)
         self.counter = 1
 
-    def average_with_nan(self, other_detectors, error_estimate=ErrorEstimate.stderr):
+    def read_header(self, filename):
+        """
+        Reads only header of binary file (estimator and detector type, binning, ranges, nstat).
+        Data block is not read.
+        :param filename: binary file name
+        :return: none
+        """
+        self._reader(filename).read_header(self)
+
+    @property
+    def header(self):
+        return HeaderInfo(geotyp=self.geotyp, dettyp=self.dettyp, nstat=self.nstat,
+                          nx=self.nx, ny=self.ny, nz=self.nz,
+                          xmin=self.xmin, xmax=self.xmax,
+                          ymin=self.ymin, ymax=self.ymax,
+                          zmin=self.zmin, zmax=self.zmax)
+
+    @property
+    def page_headers(self):
+        """
+        Header information of each page, as tuple of HeaderInfo records (with single record for one-page detector).
+        """
+        if self._page_headers is None:
+            return (self.header,)
+        return tuple(page.header for page in self._page_headers)
+
+    def average_with_nan(self, other_detector, error_estimate=ErrorEstimate.stderr):
         """
         Average (not add) data with other detector, excluding malformed data (NaN) from averaging.
-        :param other_detectors:
+        Works as average_with_other method, but number of valid (not NaN) samples is counted separately
+        for each bin. Bins in which no valid sample was seen so far are kept as NaN.
+        :param other_detector:
         :return:
         """
-        # TODO add compatibility check
-        _l = [det.data for det in other_detectors]
-        _l.append(self.data)
-        self.counter += len(other_detectors)
-        self.nstat += sum(det.nstat for det in other_detectors)
-        self.data = np.nanmean(_l, axis=0)
+        if self._bin_counter is None:
+            self._bin_counter = np.logical_not(np.isnan(self.data)).astype(np.int64)
+        if error_estimate != ErrorEstimate.none and self._M2 is None:
+            self._M2 = np.zeros_like(self.data)
+
+        self.counter += 1
+        self.nstat += other_detector.nstat
+
+        valid = np.logical_not(np.isnan(other_detector.data))
+        self._bin_counter += valid
+
+        # first valid sample in given bin becomes its mean value, M2 accumulator stays zero
+        first_valid = valid & (self._bin_counter == 1)
+        self.data[first_valid] = other_detector.data[first_valid]
+
+        # next samples are folded in using Welford algorithm, as in average_with_other
+        next_valid = valid & (self._bin_counter > 1)
+        x = other_detector.data[next_valid]
+        delta = x - self.data[next_valid]                                       # delta = x - mean
+        self.data[next_valid] += delta / self._bin_counter[next_valid]          # mean += delta / n
         if error_estimate != ErrorEstimate.none:
-            # s = stddev = sqrt(1/(n-1)sum(x-<x>)**2)
-            # s : corrected sample standard deviation
-            self.error = np.nanstd(_l, axis=0, ddof=1)
+            self._M2[next_valid] += delta * (x - self.data[next_valid])        # M2 += delta * (x - mean)
+
+            self.error = self._stddev_from_M2()
+
+    def _stddev_from_M2(self):
+        """
+        Unbiased sample standard deviation calculated from M2 accumulator.
+        If number of valid samples is counted separately for each bin (averaging ignoring NaNs),
+        standard deviation is undefined (NaN) for bins with less than two valid samples.
+        """
+        if self._bin_counter is None:
+            return np.sqrt(self._M2 / (self.counter - 1))
+        result = np.full_like(self.data, np.nan)
+        enough_samples = self._bin_counter > 1
+        result[enough_samples] = np.sqrt(self._M2[enough_samples] / (self._bin_counter[enough_samples] - 1))
+        return result
 
     def average_with_other(self, other_detector, error_estimate=ErrorEstimate.stderr):
         """
@@ -141,15 +296,149 @@ class Detector:
             # here it is calculated as square root of unbiased sample variance:
             self.error = np.sqrt(self._M2 / (self.counter - 1))
 
+    def combine_with_other(self, other_detector, error_estimate=ErrorEstimate.stderr):
+        """
+        Combine partial average stored in this detector with partial average stored in other detector.
+        Both detectors hold partial state of running average: mean (data), M2 accumulator and number of samples
+        (counter or, when averaging ignoring NaNs, per-bin _bin_counter).
+        :param other_detector:
+        :return:
+        """
+
+        # Pairwise variance algorithm by T. F. Chan, G. H. Golub and R. J. LeVeque,
+        # "Updating Formulae and a Pairwise Algorithm for Computing Sample Variances", STAN-CS-79-773 (1979).
+        # See https://en.wikipedia.org/wiki/Algorithms_for_calculating_variance#Parallel_algorithm
+        if self._bin_counter is not None:
+            n_a, n_b = self._bin_counter, other_detector._bin_counter
+        else:
+            n_a, n_b = self.counter, other_detector.counter
+        n = n_a + n_b
+
+        self.counter += other_detector.counter
+        self.nstat += other_detector.nstat
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            delta = other_detector.data - self.data                             # delta = mean_b - mean_a
+            mean = self.data + delta * np.true_divide(n_b, n)                   # mean = mean_a + delta * n_b / n
+            if error_estimate != ErrorEstimate.none:
+                M2_a = self._M2 if self._M2 is not None else np.zeros_like(self.data)
+                M2_b = other_detector._M2 if other_detector._M2 is not None else np.zeros_like(self.data)
+                M2 = M2_a + M2_b + delta ** 2 * np.true_divide(n_a * n_b, n)    # M2 += delta^2 * n_a * n_b / n
+
+        if self._bin_counter is not None:
+            # bins without valid samples in one of the parts take mean and M2 from the other part
+            mean = np.where(n_a == 0, other_detector.data, np.where(n_b == 0, self.data, mean))
+            if error_estimate != ErrorEstimate.none:
+                M2 = np.where(n_a == 0, M2_b, np.where(n_b == 0, M2_a, M2))
+            self._bin_counter = n
+
+        self.data = mean
+        if error_estimate != ErrorEstimate.none:
+            self._M2 = M2
+            self.error = self._stddev_from_M2()
+
+    def combine_weighted(self, other_detector):
+        """
+        Combine results of independent simulations, weighting them by number of primaries.
+        Data of both detectors is normalized per primary and errors are standard errors of the mean,
+        as stored by the MC code itself (i.e. FLUKA usbsuw output with STATISTICS records).
+        Errors are propagated if both detectors hold them, otherwise they are discarded.
+        :param other_detector:
+        :return:
+        """
+        nstat = self.nstat + other_detector.nstat
+        w_a = np.float64(self.nstat) / nstat
+        w_b = np.float64(other_detector.nstat) / nstat
+        self.data = w_a * self.data + w_b * other_detector.data
+        if self.error is not None and other_detector.error is not None:
+            self.error = np.hypot(w_a * self.error, w_b * other_detector.error)
+        else:
+            self.error = None
+        self.nstat = nstat
+        self.counter += other_detector.counter
+
+    def set_pages(self, pages):
+        """
+        Makes this detector a container of many pages (detectors scored by the same estimator).
+        Header information is taken from first page, data of all pages is stored in single contiguous array.
+        :param pages: list of detectors, one for each page
+        """
+        for name, value in vars(pages[0]).items():
+            if name not in ('data', 'error'):
+                setattr(self, name, value)
+
+        self._page_headers = []
+        self._page_shapes = []
+        for page in pages:
+            header = copy.copy(page)
+            header.data = None
+            header.error = None
+            self._page_headers.append(header)
+            if page.data is not None:
+                self._page_shapes.append(np.shape(page.data))
+            else:
+                self._page_shapes.append((page.nx * page.ny * page.nz,))
+        self._page_offsets = np.cumsum([0] + [int(np.prod(shape)) for shape in self._page_shapes])
+        self.pages = len(pages)
+
+        if all(page.data is not None for page in pages):
+            self.data = np.concatenate([np.ravel(page.data) for page in pages])
+        if all(page.error is not None for page in pages):
+            self.error = np.concatenate([np.ravel(page.error) for page in pages])
+
+    def page(self, page_no):
+        """
+        Single page of multi-page detector. Data and error of the page are views of the arrays
+        holding all pages, number of files and primaries is taken from the container.
+        :param page_no: page number, starting from 0
+        :return: detector holding single page
+        """
+        if self._page_headers is None:
+            if page_no != 0:
+                raise IndexError("Detector has single page, page {:d} requested".format(page_no))
+            return self
+        page = copy.copy(self._page_headers[page_no])
+        start, stop = self._page_offsets[page_no], self._page_offsets[page_no + 1]
+        shape = self._page_shapes[page_no]
+        if self.data is not None:
+            page.data = self.data.ravel()[start:stop].reshape(shape)
+        if self.error is not None:
+            page.error = self.error.ravel()[start:stop].reshape(shape)
+        page.nstat = self.nstat
+        page.counter = self.counter
+        return page
+
     def save(self, filename, options):
         """
-        Save data to the file, using list of converters
+        Save data to the file, using list of converters (options.formats, or single converter options.command).
+        Each page of multi-page detector is saved to separate file, with _p1, _p2, ... suffix,
+        unless converter is able to save all pages in single file.
+        If options.write_jobs is larger than 1, writers are run in parallel processes.
         :param filename:
         :param options:
         :return:
         """
-        writer = _converter_mapping[Converters[options.command]](filename, options)
-        writer.write(self)
+        tasks = []
+        for name in getattr(options, 'formats', None) or [options.command]:
+            writer_class = _converter_mapping[Converters[name]]
+            if self._page_headers is not None and not getattr(writer_class, 'pages_supported', False):
+                tasks.extend((writer_class, self.page(page_no), "{:s}_p{:d}".format(filename, page_no + 1))
+                             for page_no in range(self.pages))
+            else:
+                tasks.append((writer_class, self, filename))
+
+        write_jobs = getattr(options, 'write_jobs', 1)
+        if write_jobs != 1 and len(tasks) > 1:
+            try:
+                from joblib import Parallel, delayed
+                Parallel(n_jobs=write_jobs)(delayed(_write)(writer_class, detector, output_file, options)
+                                            for writer_class, detector, output_file in tasks)
+                return
+            except (ImportError, SyntaxError):
+                # single-cpu implementation, in case joblib library fails (i.e. Python 3.2)
+                pass
+        for writer_class, detector, output_file in tasks:
+            _write(writer_class, detector, output_file, options)
 
     def __str__(self):
         result = ""
@@ -173,38 +462,97 @@ class Detector:
         return result
 
     @staticmethod
-    def _running_index_i(p, _, k_max):
-        return p % k_max
-
-    @staticmethod
-    def _running_index_j(p, j_max, k_max):
-        return (p // k_max) % j_max
+    def _linspace(tmin, tmax, tn):
+        """
+        Middle points of `tn` equal bins spanning from `tmin` to `tmax`
+        """
+        dt = (tmax - tmin) / tn
+        return tmin + (np.arange(tn) + 0.5) * dt
 
-    @staticmethod
-    def _running_index_k(p, j_max, k_max):
-        return p // (j_max * k_max)
-
-    def _running_indices(self, axis_no):
-        if axis_no == 0:
-            return self._running_index_i
-        elif axis_no == 1:
-            return self._running_index_j
-        elif axis_no == 2:
-            return self._running_index_k
-        return None
+    def bin_centers(self, axis_no, plotting_order=False):
+        """
+        Coordinates of bin middle points along single axis (1-D array of length `n` for that axis).
+        Array is computed once and cached on the detector, it should be treated as read-only.
+        :param axis_no: axis number
+        :param plotting_order: if True, axis number is interpreted in plotting order
+        :return: numpy array with bin centers
+        """
+        a = self.axis_data(axis_no, plotting_order)
+        key = ('centers',) + tuple(a)
+        if self._axis_cache is None:
+            self._axis_cache = {}
+        if key not in self._axis_cache:
+            centers = self._linspace(a.min, a.max, a.n)
+            centers.setflags(write=False)
+            self._axis_cache[key] = centers
+        return self._axis_cache[key]
+
+    def bin_edges(self, axis_no, plotting_order=False):
+        """
+        Coordinates of bin edges along single axis (1-D array of length `n` + 1 for that axis).
+        Array is computed once and cached on the detector, it should be treated as read-only.
+        :param axis_no: axis number
+        :param plotting_order: if True, axis number is interpreted in plotting order
+        :return: numpy array with bin edges
+        """
+        a = self.axis_data(axis_no, plotting_order)
+        key = ('edges',) + tuple(a)
+        if self._axis_cache is None:
+            self._axis_cache = {}
+        if key not in self._axis_cache:
+            edges = np.linspace(a.min, a.max, a.n + 1)
+            edges.setflags(write=False)
+            self._axis_cache[key] = edges
+        return self._axis_cache[key]
+
+    def cylindrical_bin_volumes(self):
+        """
+        Volumes of bins of cylindrical mesh (i.e. CYL scorer), with X axis being radius R,
+        Y axis azimuthal angle PHI (in radians) and Z axis position along the cylinder.
+        Volume of bin spanning from r_i to r_i+1 is 0.5 * dphi * dz * (r_i+1^2 - r_i^2),
+        it depends only on R, so single row of volumes is returned.
+        :return: numpy array of length nx, broadcastable against data shaped (nz, ny, nx)
+        """
+        dphi = (self.ymax - self.ymin) / self.ny
+        dz = (self.zmax - self.zmin) / self.nz
+        return 0.5 * dphi * dz * np.diff(np.square(self.bin_edges(Axis.x)))
 
-    @staticmethod
-    def _linspace(tmin, tmax, tn, ind):
-        dt = (tmax - tmin) / tn
-        return tmin + (ind + 0.5) * dt
+    def radial_integral(self, values=None):
+        """
+        Integral of values scored in cylindrical mesh (see @cylindrical_bin_volumes) over R and PHI,
+        i.e. energy deposited in each Z slice when values hold energy density.
+        Values are not copied, integration is done on a (nz * ny, nx) view of the data buffer.
+        :param values: array with value for each bin, in data storage order (default: detector data)
+        :return: numpy array of length nz, with sum of values multiplied by bin volumes in each Z slice
+        """
+        if values is None:
+            values = self.data
+        values_2d = np.reshape(values, (self.nz * self.ny, self.nx))
+        return np.dot(values_2d, self.cylindrical_bin_volumes()).reshape(self.nz, self.ny).sum(axis=1)
 
     def axis_values(self, axis_no, plotting_order=False):
+        """
+        Coordinates of all bins along given axis, one value per bin in data storage order
+        (X index running fastest, Z slowest). Array is computed once and cached on the detector,
+        it should be treated as read-only.
+        :param axis_no: axis number
+        :param plotting_order: if True, axis number is interpreted in plotting order
+        :return: numpy array of length nx * ny * nz
+        """
         if plotting_order:
             axis_no = self._axes_plotting_order[axis_no]
-        a = self.axis_data(axis_no)
-        for p in range(self.nx * self.ny * self.nz):
-            ind = self._running_indices(axis_no)(p, self.ny, self.nx)
-            yield self._linspace(a.min, a.max, a.n, ind)
+        key = ('values', axis_no, self.nx, self.ny, self.nz) + tuple(self.axis_data(axis_no))
+        if self._axis_cache is None:
+            self._axis_cache = {}
+        if key not in self._axis_cache:
+            # shape of data block is (nz, ny, nx) in C order, broadcast 1-D centers along it
+            shape = [1, 1, 1]
+            shape[2 - axis_no] = -1
+            centers = self.bin_centers(axis_no).reshape(shape)
+            values = np.broadcast_to(centers, (self.nz, self.ny, self.nx)).ravel()
+            values.setflags(write=False)
+            self._axis_cache[key] = values
+        return self._axis_cache[key]
 
     @property
     def x(self):
@@ -290,19 +638,204 @@ def merge_list(input_file_list,
     :param options: list of parsed options
     :return: none
     """
+    # check if all files come from the same estimator before reading any data
+    if len(input_file_list) > 1:
+        check_compatibility(input_file_list, [read_page_headers(filename) for filename in input_file_list])
+
+    _merge_and_save(input_file_list, output_file, options)
+
+
+def _write(writer_class, detector, output_file, options):
+    """
+    Saves detector to output file using single writer.
+    """
+    writer_class(output_file, options).write(detector)
+
+
+def _merge_and_save(input_file_list, output_file, options):
+    """
+    Merges data from input files (see @merge_list method) without checking their compatibility
+    and saves it to output file.
+    """
+    if output_file is None:
+        output_file = input_file_list[0][:-4]
+
+    # bdo converter uses the same extension as SHIELD-HIT12A, i.e. default output name is the first input file
+    if Converters.bdo.name in (getattr(options, 'formats', None) or [options.command]):
+        bdo_file = os.path.abspath(SHBinaryWriter.output_filename(output_file))
+        if bdo_file in (os.path.abspath(filename) for filename in input_file_list):
+            raise IOError("Output file {:s} would overwrite input file, use different output name".format(bdo_file))
+
+    output_dir = os.path.dirname(output_file)
+    if output_dir:  # output directory has been found, output_file is not a plain file in current dir
+        if not os.path.exists(output_dir):  # directory doesn't exists
+            os.makedirs(output_dir)  # let us create it
+
+    first = merge_data(input_file_list, output_file, options)
+    first.save(output_file, options)
+
+
+def merge_data(input_file_list, output_file, options):
+    """
+    Reads and averages input files (without checking their compatibility) and calculates requested
+    error estimate, as done by @merge_list method, but returns merged detector instead of saving it.
+    :param input_file_list: list of input files
+    :param output_file: name of output file, used to locate checkpoint file
+    :param options: list of parsed options
+    :return: detector holding averaged data
+    """
+    if options.checkpoint:
+        first = _merge_with_checkpoint(input_file_list, output_file + ".checkpoint", options)
+    else:
+        first = _merge_files(input_file_list, options)
+
+    # up to now first.error stores standard deviation
+    # if user requested standard error then we calculate it as:
+    # S = stderr = stddev / sqrt(n), or in other words,
+    # S = s/sqrt(N) where S is the corrected standard deviation of the mean.
+    # when averaging ignoring NaNs, N is the number of valid samples in each bin
+    # in weighted mode errors are taken from input files and already describe the mean
+    if first.counter > 1 and options.error == ErrorEstimate.stderr and not options.weighted:
+        if options.nan:
+            first.error /= np.sqrt(first._bin_counter)
+        else:
+            first.error /= np.sqrt(first.counter)  # np.sqrt() always returns np.float64
+
+    return first
+
+
+def _merge_files(input_file_list, options):
+    """
+    Reads and averages all input files, serially or in parallel chunks.
+    :param input_file_list: list of input files
+    :param options: list of parsed options
+    :return: detector holding averaged data and partial state of running average
+    """
+    if options.weighted:
+        return _merge_weighted(input_file_list, options)
+    if options.chunk_size > 0 and len(input_file_list) > options.chunk_size:
+        return _merge_in_chunks(input_file_list, options)
+    return _merge_chunk(input_file_list, options)
+
+
+def _merge_weighted(input_file_list, options):
+    """
+    Statistically weighted version of @_merge_chunk method, for files which are already sums of many runs.
+    Results are weighted by number of primaries, errors stored in input files are propagated.
+    Number of files merged into each input file (if saved in it) is added up.
+    :param input_file_list: list of input files
+    :param options: list of parsed options
+    :return: detector
+    """
     first = Detector()
-    first.read(input_file_list[0], options.nscale)
+    first.read(input_file_list[0], options.nscale, options.mmap)
+    first.counter = first.merged_files
+    for file in input_file_list[1:]:
+        next_one = Detector()
+        next_one.read(file, options.nscale, options.mmap)
+        next_one.counter = next_one.merged_files
+        first.combine_weighted(other_detector=next_one)
+
+    if options.error == ErrorEstimate.none:
+        first.error = None
+    elif first.error is None:
+        logger.warning("Some of input files do not contain statistical errors, errors are not saved")
+    return first
 
-    other_detectors = []
+
+def _merge_with_checkpoint(input_file_list, checkpoint_file, options):
+    """
+    Incremental version of @_merge_files method. State of running average (data, M2 accumulator, counters)
+    and list of already merged files are loaded from checkpoint file, if it exists.
+    Only new input files are read and averaged, their partial state is combined with the loaded one.
+    Checkpoint is discarded if any of already merged files has been modified or removed,
+    or is no longer on the list of input files.
+    Updated state is saved back to checkpoint file.
+    :param input_file_list: list of input files
+    :param checkpoint_file: name of checkpoint file
+    :param options: list of parsed options
+    :return: detector holding averaged data and partial state of running average
+    """
+    # checkpoint can be reused only if averaging was done in the same way
+    settings = (bool(options.nan), int(options.error), float(options.nscale), bool(options.weighted))
+
+    first = None
+    merged_files = []
+    if os.path.exists(checkpoint_file):
+        logger.info("Reading: " + checkpoint_file)
+        with open(checkpoint_file, 'rb') as f:
+            state = pickle.load(f)
+        if state['settings'] != settings:
+            logger.warning("Checkpoint {:s} was saved with different options, ignoring it".format(checkpoint_file))
+        elif any(_file_signature(name) != signature for name, signature in state['files']):
+            logger.warning("Files merged into checkpoint {:s} have changed, ignoring it".format(checkpoint_file))
+        elif not set(name for name, _ in state['files']) <= set(os.path.abspath(name) for name in input_file_list):
+            logger.warning("Checkpoint {:s} contains files which are not on the input list, ignoring it".format(
+                checkpoint_file))
+        else:
+            first = state['detector']
+            merged_files = state['files']
+
+    already_merged = set(name for name, _ in merged_files)
+    new_files = [name for name in input_file_list if os.path.abspath(name) not in already_merged]
+    logger.info("{:d} files already merged, {:d} new files".format(len(merged_files), len(new_files)))
+
+    if new_files:
+        partial = _merge_files(new_files, options)
+        if first is None:
+            first = partial
+        elif options.weighted:
+            first.combine_weighted(other_detector=partial)
+        else:
+            first.combine_with_other(other_detector=partial, error_estimate=options.error)
+        merged_files += [(os.path.abspath(name), _file_signature(name)) for name in new_files]
+
+        logger.info("Writing: " + checkpoint_file)
+        with open(checkpoint_file, 'wb') as f:
+            pickle.dump({'settings': settings, 'files': merged_files, 'detector': first}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+
+    return first
+
+
+def _file_signature(filename):
+    """
+    Modification time and size of the file, used to detect files changed since they were merged.
+    :return: (mtime, size) tuple or None if file doesn't exist
+    """
+    if not os.path.exists(filename):
+        return None
+    stat = os.stat(filename)
+    return stat.st_mtime, stat.st_size
+
+
+def _merge_chunk(input_file_list, options):
+    """
+    Reads all input files and averages them, as first step of @merge_list method.
+    Returned detector holds data averaged over input files, together with partial state
+    of running average (M2 accumulator and number of samples).
+    :param input_file_list: list of input files
+    :param options: list of parsed options
+    :return: detector
+    """
+    first = Detector()
+    first.read(input_file_list[0], options.nscale, options.mmap)
+
+    # data of first detector serves as accumulator, it needs to be writable (memory-mapped data is read-only)
+    if not first.data.flags.writeable:
+        first.data = np.array(first.data)
 
     # allocate memory for accumulator needed in standard deviation calculation
     # not needed if:
-    #  - averaging is done ignoring NaNs (then numpy nanvar function is used)
     #  - processing only one file
     #  - user requested not to include errors
-    if not options.nan and len(input_file_list) > 1 and options.error != ErrorEstimate.none:
+    if len(input_file_list) > 1 and options.error != ErrorEstimate.none:
         first._M2 = np.zeros_like(first.data)
 
+    # number of valid samples needs to be tracked separately for each bin when averaging ignoring NaNs
+    if options.nan:
+        first._bin_counter = np.logical_not(np.isnan(first.data)).astype(np.int64)
+
     # set errors to zero also if reading single file
     if options.error != ErrorEstimate.none:
         first.error = np.zeros_like(first.data)
@@ -310,31 +843,56 @@ def merge_list(input_file_list,
     # loop over second and next files, if present
     for file in input_file_list[1:]:
         next_one = Detector()
-        next_one.read(file, options.nscale)
+        next_one.read(file, options.nscale, options.mmap)
         if options.nan:
-            other_detectors.append(next_one)  # read all detector files into memory
+            first.average_with_nan(other_detector=next_one, error_estimate=options.error)
         else:
             first.average_with_other(other_detector=next_one, error_estimate=options.error)
 
-    # user requested averaging ignoring nan and more than one file are present
-    if other_detectors and options.nan:
-        first.average_with_nan(other_detectors, error_estimate=options.error)
+    return first
 
-    # up to now first.error stores standard deviation
-    # if user requested standard error then we calculate it as:
-    # S = stderr = stddev / sqrt(n), or in other words,
-    # S = s/sqrt(N) where S is the corrected standard deviation of the mean.
-    if len(input_file_list) > 1 and options.error == ErrorEstimate.stderr:
-        first.error /= np.sqrt(first.counter)  # np.sqrt() always returns np.float64
 
-    if output_file is None:
-        output_file = input_file_list[0][:-4]
+def _merge_in_chunks(input_file_list, options):
+    """
+    Parallel version of @_merge_chunk method. Input files are split into chunks of options.chunk_size files,
+    each chunk is averaged in separate worker process. Partial results are then combined pairwise (tree reduction).
+    :param input_file_list: list of input files
+    :param options: list of parsed options
+    :return: detector
+    """
+    chunks = [input_file_list[i:i + options.chunk_size] for i in range(0, len(input_file_list), options.chunk_size)]
+    logger.debug("Merging {:d} files in {:d} chunks".format(len(input_file_list), len(chunks)))
 
-    output_dir = os.path.dirname(output_file)
-    if output_dir:  # output directory has been found, output_file is not a plain file in current dir
-        if not os.path.exists(output_dir):  # directory doesn't exists
-            os.makedirs(output_dir)  # let us create it
-    first.save(output_file, options)
+    try:
+        from joblib import Parallel, delayed
+        partials = Parallel(n_jobs=options.jobs)(delayed(_merge_chunk)(chunk, options) for chunk in chunks)
+    except (ImportError, SyntaxError):
+        # single-cpu implementation, in case joblib library fails (i.e. Python 3.2)
+        partials = [_merge_chunk(chunk, options) for chunk in chunks]
+
+    while len(partials) > 1:
+        for first, second in zip(partials[::2], partials[1::2]):
+            first.combine_with_other(other_detector=second, error_estimate=options.error)
+        partials = partials[::2]
+
+    return partials[0]
+
+
+def get_core_name(filename):
+    """
+    Name of the estimator which produced given file, used to group files from the same estimator.
+    For SHIELD-HIT12A files it is the file name stripped from extension and 4-digit job number,
+    for FLUKA files it is the logical unit number.
+    :param filename: file name
+    :return: core name or None for files of unknown type
+    """
+    if filename.endswith(".bdo"):
+        if filename[-8:-4].isdigit() and len(filename[-8:-4]) == 4:
+            return filename[:-8]
+        return filename[:-4]
+    elif "_fort." in filename:
+        return filename[-2:]
+    return None
 
 
 def _process_one_group(core_name, group_with_same_core, outputdir, options):
@@ -344,7 +902,7 @@ def _process_one_group(core_name, group_with_same_core, outputdir, options):
     else:
         output_file = os.path.join(outputdir, core_basename)
     logger.debug("Setting output core name " + output_file)
-    merge_list(group_with_same_core, output_file, options)
+    _merge_and_save(group_with_same_core, output_file, options)
 
 
 def merge_many(input_file_list,
@@ -364,14 +922,21 @@ def merge_many(input_file_list,
     """
     core_names_dict = defaultdict(list)
     for name in input_file_list:
-        if name.endswith(".bdo"):
-            core_name = name[:-4]
-            if name[-8:-4].isdigit() and len(name[-8:-4]) == 4:
-                core_name = name[:-8]
-            core_names_dict[core_name].append(name)
-        elif "_fort." in name:
-            core_name = name[-2:]
-            core_names_dict[core_name].append(name)
+        name_core = get_core_name(name)
+        if name_core is not None:
+            core_names_dict[name_core].append(name)
+
+    # check if files in each group come from the same estimator before reading any data
+    # headers may be taken from persistent index, to avoid reading them again from unchanged files
+    files_to_check = [name for group in core_names_dict.values() if len(group) > 1 for name in group]
+    if options.index:
+        from pymchelper.index import read_headers
+        headers = read_headers(files_to_check)
+    else:
+        headers = dict((name, read_page_headers(name)) for name in files_to_check)
+    for group_with_same_core in core_names_dict.values():
+        if len(group_with_same_core) > 1:
+            check_compatibility(group_with_same_core, [headers[filename] for filename in group_with_same_core])
 
     # parallel execution of output file generation, using all CPU cores
     # see http://pythonhosted.org/joblib
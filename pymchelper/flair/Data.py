@@ -58,6 +58,9 @@
 import re
 import math
 import struct
+from collections import namedtuple
+
+import numpy as np
 
 import pymchelper.flair.common.fortran as fortran
 import pymchelper.flair.common.bmath as bmath
@@ -159,19 +162,27 @@ class Usrxxx:
         return f
 
     # ----------------------------------------------------------------------
-    # Read detector data
+    # Read a fortran record starting at offset pos
+    # Offsets of detector records are recorded by readHeader:
+    #   det.headerpos: detector header
+    #   det.datapos:   detector data
+    #   det.statpos:   first record of detector statistical data
     # ----------------------------------------------------------------------
-    def readData(self, det):
-        """Read detector det data structure"""
+    def readRecord(self, pos):
+        """Read fortran record starting at file offset pos"""
         f = open(self.file, "rb")
-        fortran.skip(f)  # Skip header
-        for i in range(2 * det):
-            fortran.skip(f)  # Detector Header & Data
-        fortran.skip(f)  # Detector Header
+        f.seek(pos)
         data = fortran.read(f)
         f.close()
         return data
 
+    # ----------------------------------------------------------------------
+    # Read detector data
+    # ----------------------------------------------------------------------
+    def readData(self, det):
+        """Read detector det data structure"""
+        return self.readRecord(self.detector[det].datapos)
+
     # ----------------------------------------------------------------------
     # Read detector statistical data
     # ----------------------------------------------------------------------
@@ -179,13 +190,7 @@ class Usrxxx:
         """Read detector det statistical data"""
         if self.statpos < 0:
             return None
-        f = open(self.file, "rb")
-        f.seek(self.statpos)
-        for _ in range(det):
-            fortran.skip(f)  # Detector Data
-        data = fortran.read(f)
-        f.close()
-        return data
+        return self.readRecord(self.detector[det].statpos)
 
     # ----------------------------------------------------------------------
     def sayHeader(self):
@@ -222,6 +227,7 @@ class Resnuclei(Usrxxx):
 
         for _ in range(1000):
             # Header
+            pos = f.tell()
             data = fortran.read(f)
             if data is None:
                 break
@@ -229,14 +235,20 @@ class Resnuclei(Usrxxx):
             self.irrdt = None
 
             # Statistics are present?
-            if size == 14 and data[:8] == "ISOMERS:":
+            if size == 14 and data[:8] == b"ISOMERS:":
                 self.nisomers = struct.unpack("=10xi", data)[0]
+                self.detector[-1].isopos = pos
                 data = fortran.read(f)
+                pos = f.tell()
                 data = fortran.read(f)
                 size = len(data)
 
-            if size == 14 and data[:10] == "STATISTICS":
+            if size == 14 and data[:10] == b"STATISTICS":
                 self.statpos = f.tell()
+                for det in self.detector:
+                    det.statpos = f.tell()
+                    for j in range(7 if self.nisomers else 6):
+                        fortran.skip(f)  # Detector statistical data
                 break
 
             if size != 38:
@@ -248,6 +260,7 @@ class Resnuclei(Usrxxx):
             header = struct.unpack("=i10siif3i", data)
 
             det = Detector()
+            det.headerpos = pos
             det.nb = header[0]
             det.name = header[1].strip()
             det.type = header[2]
@@ -265,38 +278,13 @@ class Resnuclei(Usrxxx):
             else:
                 self.tdecay = 0.0
 
+            det.datapos = f.tell()
             size = det.zhigh * det.mhigh * 4
             if size != fortran.skip(f):
                 raise IOError("Invalid RESNUCLEi file")
 
         f.close()
 
-    # ----------------------------------------------------------------------
-    # Read detector data
-    # ----------------------------------------------------------------------
-    def readData(self, n):
-        """Read detector det data structure"""
-        f = open(self.file, "rb")
-        fortran.skip(f)
-        if self.evol:
-            fortran.skip(f)
-
-        for _ in range(n):
-            fortran.skip(f)  # Detector Header & Data
-            if self.evol:
-                fortran.skip(f)  # TDecay
-            fortran.skip(f)  # Detector data
-            if self.nisomers:
-                fortran.skip(f)  # Isomers header
-                fortran.skip(f)  # Isomers data
-
-        fortran.skip(f)  # Detector Header & Data
-        if self.evol:
-            fortran.skip(f)  # TDecay
-        data = fortran.read(f)  # Detector data
-        f.close()
-        return data
-
     # ----------------------------------------------------------------------
     # Read detector statistical data
     # ----------------------------------------------------------------------
@@ -305,15 +293,7 @@ class Resnuclei(Usrxxx):
         if self.statpos < 0:
             return None
         f = open(self.file, "rb")
-        f.seek(self.statpos)
-
-        f.seek(self.statpos)
-        if self.nisomers:
-            nskip = 7 * n
-        else:
-            nskip = 6 * n
-        for i in range(nskip):
-            fortran.skip(f)  # Detector Data
+        f.seek(self.detector[n].statpos)
 
         total = fortran.read(f)
         A = fortran.read(f)
@@ -359,6 +339,7 @@ class Usrbdx(Usrxxx):
 
         for _ in range(1000):
             # Header
+            pos = f.tell()
             data = fortran.read(f)
             if data is None:
                 break
@@ -376,6 +357,7 @@ class Usrbdx(Usrxxx):
                 #   7: Double differential data
                 self.statpos = f.tell()
                 for det in self.detector:
+                    det.statpos = f.tell()
                     data = unpackArray(fortran.read(f))
                     det.total = data[0]
                     det.totalerror = data[1]
@@ -391,6 +373,7 @@ class Usrbdx(Usrxxx):
             header = struct.unpack("=i10siiiifiiiffifffif", data)
 
             det = Detector()
+            det.headerpos = pos
             det.nb = header[0]  # mx
             det.name = header[1].strip()  # titusx
             det.type = header[2]  # itusbx
@@ -409,6 +392,8 @@ class Usrbdx(Usrxxx):
             det.ahigh = header[15]  # abxhgh
             det.na = header[16]  # nabxbn
             det.da = header[17]  # dabxbn
+            det.total = 0.0  # filled from statistics, if present
+            det.totalerror = 0.0
 
             self.detector.append(det)
 
@@ -420,31 +405,12 @@ class Usrbdx(Usrxxx):
                 det.ngroup = 0
                 det.egroup = []
 
+            det.datapos = f.tell()
             size = (det.ngroup + det.ne) * det.na * 4
             if size != fortran.skip(f):
                 raise IOError("Invalid USRBDX file")
         f.close()
 
-    # ----------------------------------------------------------------------
-    # Read detector data
-    # ----------------------------------------------------------------------
-    def readData(self, n):
-        """Read detector n data structure"""
-        f = open(self.file, "rb")
-        fortran.skip(f)
-        for i in range(n):
-            fortran.skip(f)  # Detector Header
-            if self.detector[i].lowneu:
-                fortran.skip(f)  # Detector low enetry neutron groups
-            fortran.skip(f)  # Detector data
-
-        fortran.skip(f)  # Detector Header
-        if self.detector[n].lowneu:
-            fortran.skip(f)  # Detector low enetry neutron groups
-        data = fortran.read(f)  # Detector data
-        f.close()
-        return data
-
     # ----------------------------------------------------------------------
     # Read detector statistical data
     # ----------------------------------------------------------------------
@@ -453,11 +419,7 @@ class Usrbdx(Usrxxx):
         if self.statpos < 0:
             return None
         f = open(self.file, "rb")
-        f.seek(self.statpos)
-        for i in range(n):
-            for j in range(7):
-                fortran.skip(f)  # Detector Data
-
+        f.seek(self.detector[n].statpos)
         for j in range(6):
             fortran.skip(f)  # Detector Data
         data = fortran.read(f)
@@ -502,14 +464,18 @@ class Usrbin(Usrxxx):
 
         for _ in range(1000):
             # Header
+            pos = f.tell()
             data = fortran.read(f)
             if data is None:
                 break
             size = len(data)
 
             # Statistics are present?
-            if size == 14 and data[:10] == "STATISTICS":
+            if size == 14 and data[:10] == b"STATISTICS":
                 self.statpos = f.tell()
+                for bin_det in self.detector:
+                    bin_det.statpos = f.tell()
+                    fortran.skip(f)  # Detector statistical data
                 break
             if size != 86:
                 if not f.closed:
@@ -520,6 +486,7 @@ class Usrbin(Usrxxx):
             header = struct.unpack("=i10siiffifffifffififff", data)
 
             bin_det = Detector()
+            bin_det.headerpos = pos
             bin_det.nb = header[0]
             bin_det.name = header[1].strip()
             bin_det.type = header[2]
@@ -560,41 +527,12 @@ class Usrbin(Usrxxx):
 
             self.detector.append(bin_det)
 
+            bin_det.datapos = f.tell()
             size = bin_det.nx * bin_det.ny * bin_det.nz * 4
             if fortran.skip(f) != size:
                 raise IOError("Invalid USRBIN file")
         f.close()
 
-    # ----------------------------------------------------------------------
-    # Read detector data
-    # ----------------------------------------------------------------------
-    def readData(self, n):
-        """Read detector det data structure"""
-        f = open(self.file, "rb")
-        fortran.skip(f)
-        for i in range(n):
-            fortran.skip(f)  # Detector Header
-            fortran.skip(f)  # Detector data
-        fortran.skip(f)  # Detector Header
-        data = fortran.read(f)  # Detector data
-        f.close()
-        return data
-
-    # ----------------------------------------------------------------------
-    # Read detector statistical data
-    # ----------------------------------------------------------------------
-    def readStat(self, n):
-        """Read detector n statistical data"""
-        if self.statpos < 0:
-            return None
-        f = open(self.file, "rb")
-        f.seek(self.statpos)
-        for i in range(n):
-            fortran.skip(f)  # Detector Data
-        data = fortran.read(f)
-        f.close()
-        return data
-
     # ----------------------------------------------------------------------
     def say(self, det=None):
         """print header/detector information"""
@@ -618,6 +556,39 @@ class Usrbin(Usrxxx):
 # ===============================================================================
 # MGDRAW output
 # ===============================================================================
+# Events decoded by Mgdraw.readBatch, split by event type:
+#   tracking:         headers of tracking events, data of event i is
+#                     tracking_data[start[i]:start[i]+3*(ntrack[i]+1)+mtrack[i]+1]
+#   energy:           energy deposition events, header and position (x,y,z,rull)
+#   source:           headers of source events, particles of event i are
+#                     source_particles[start[i]:start[i]+npflka[i]]
+MgdrawBatch = namedtuple('MgdrawBatch', ['tracking', 'tracking_data', 'energy', 'source', 'source_particles'])
+
+_mgdrawHeader = np.dtype([('n', '=i4'), ('m', '=i4'), ('j', '=i4'), ('e', '=f4'), ('w', '=f4')])
+_mgdrawTracking = np.dtype([('ntrack', '=i4'), ('mtrack', '=i4'), ('jtrack', '=i4'),
+                            ('etrack', '=f4'), ('wtrack', '=f4'), ('start', '=i8')])
+_mgdrawEnergy = np.dtype([('icode', '=i4'), ('jtrack', '=i4'), ('etrack', '=f4'), ('wtrack', '=f4'),
+                          ('x', '=f4'), ('y', '=f4'), ('z', '=f4'), ('rull', '=f4')])
+_mgdrawSource = np.dtype([('ncase', '=i4'), ('npflka', '=i4'), ('nstmax', '=i4'),
+                          ('tkesum', '=f4'), ('weipri', '=f4'), ('start', '=i8')])
+_mgdrawParticle = np.dtype([('iloflk', '=i4'), ('etot', '=f4'), ('wtflk', '=f4'),
+                            ('xflk', '=f4'), ('yflk', '=f4'), ('zflk', '=f4'),
+                            ('txflk', '=f4'), ('tyflk', '=f4'), ('tzflk', '=f4')])
+
+
+# -------------------------------------------------------------------------------
+# Gather records of given lengths starting at given offsets into one array
+# -------------------------------------------------------------------------------
+def _gatherRecords(buf, pos, length, dtype):
+    length = np.asarray(length, dtype=np.int64)
+    total = int(length.sum())
+    if total == 0:
+        return np.empty(0, dtype=dtype)
+    start = np.cumsum(length) - length
+    index = np.repeat(np.asarray(pos, dtype=np.int64) - start, length) + np.arange(total)
+    return buf[index].view(dtype)
+
+
 class Mgdraw:
     def __init__(self, filename=None):
         """Initialize a MGDRAW structure"""
@@ -633,6 +604,7 @@ class Mgdraw:
         self.hnd = None
         self.nevent = 0
         self.data = None
+        self.buffer = b""
 
     # ----------------------------------------------------------------------
     # Open file and return handle
@@ -686,6 +658,93 @@ class Mgdraw:
                 fortran.skip(self.hnd)
             return 2
 
+    # ----------------------------------------------------------------------
+    # Read all complete events from next block of the file
+    # Memory usage is bounded by the block size, events are decoded into
+    # structured numpy arrays split by event type (see MgdrawBatch)
+    # Should not be mixed with readEvent calls on the same file
+    # @return MgdrawBatch or None at the end of file
+    # ----------------------------------------------------------------------
+    def readBatch(self, blocksize=16 * 1024 * 1024):
+        """Read and decode all events from next block of blocksize bytes"""
+        buf = self.buffer + self.hnd.read(blocksize)
+        size = len(buf)
+        headerpos = []
+        datapos = []
+        datalen = []
+        pos = 0
+        while True:
+            # event: header record (20 bytes) followed by data record
+            if pos + 32 > size:
+                break
+            (hlen,) = struct.unpack_from("=i", buf, pos)
+            if hlen != 20:
+                raise IOError("Invalid MGREAD file")
+            (dlen,) = struct.unpack_from("=i", buf, pos + 28)
+            end = pos + 36 + dlen
+            if end > size:
+                break
+            headerpos.append(pos + 4)
+            datapos.append(pos + 32)
+            datalen.append(dlen)
+            pos = end
+
+        if not headerpos:
+            if size > 0 and len(buf) > len(self.buffer):
+                # single event larger than block, read more
+                self.buffer = buf
+                return self.readBatch(blocksize)
+            if size > 0:
+                raise IOError("Truncated MGREAD file")
+            return None
+        self.buffer = buf[pos:]
+        self.nevent += len(headerpos)
+
+        raw = np.frombuffer(buf, dtype=np.uint8)
+        headerpos = np.array(headerpos, dtype=np.int64)
+        datapos = np.array(datapos, dtype=np.int64)
+        datalen = np.array(datalen, dtype=np.int64)
+        header = _gatherRecords(raw, headerpos, np.full(len(headerpos), 20), _mgdrawHeader)
+
+        # tracking events
+        sel = header['n'] > 0
+        tracking = np.empty(int(sel.sum()), dtype=_mgdrawTracking)
+        for name, field in zip(('ntrack', 'mtrack', 'jtrack', 'etrack', 'wtrack'), _mgdrawHeader.names):
+            tracking[name] = header[field][sel]
+        tracking['start'] = (np.cumsum(datalen[sel]) - datalen[sel]) // 4
+        tracking_data = _gatherRecords(raw, datapos[sel], datalen[sel], np.dtype('=f4'))
+
+        # energy deposition events
+        sel = header['n'] == 0
+        energy = np.empty(int(sel.sum()), dtype=_mgdrawEnergy)
+        for name, field in zip(('icode', 'jtrack', 'etrack', 'wtrack'), _mgdrawHeader.names[1:]):
+            energy[name] = header[field][sel]
+        position = _gatherRecords(raw, datapos[sel], datalen[sel], np.dtype('=f4')).reshape(-1, 4)
+        for i, name in enumerate(('x', 'y', 'z', 'rull')):
+            energy[name] = position[:, i]
+
+        # source events
+        sel = header['n'] < 0
+        source = np.empty(int(sel.sum()), dtype=_mgdrawSource)
+        for name, field in zip(('ncase', 'npflka', 'nstmax', 'tkesum', 'weipri'), _mgdrawHeader.names):
+            source[name] = header[field][sel]
+        source['ncase'] *= -1
+        source['start'] = (np.cumsum(datalen[sel]) - datalen[sel]) // _mgdrawParticle.itemsize
+        source_particles = _gatherRecords(raw, datapos[sel], datalen[sel], _mgdrawParticle)
+
+        return MgdrawBatch(tracking, tracking_data, energy, source, source_particles)
+
+    # ----------------------------------------------------------------------
+    # Iterate over batches of events until the end of file
+    # ----------------------------------------------------------------------
+    def batches(self, blocksize=16 * 1024 * 1024):
+        """Generator of MgdrawBatch objects, each holding events from one block of the file"""
+        while True:
+            batch = self.readBatch(blocksize)
+            if batch is None:
+                return
+            yield batch
+
     # ----------------------------------------------------------------------
     def readTracking(self, ntrack, mtrack, jtrack, etrack, wtrack):
         self.ntrack = ntrack
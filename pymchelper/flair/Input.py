@@ -99,6 +99,7 @@ import math
 import struct
 import string
 
+import numpy as np
 
 import pymchelper.flair.common.fortran as fortran
 import pymchelper.flair.common.bmath as bmath
@@ -1268,6 +1269,8 @@ class Voxel:
         self.dy = 0.0
         self.dz = 0.0
         self.kreg = None
+        self.dataPos = None  # offset of voxel data in file
+        self._data = None
         self.roiN = 0
         self.roiName = {}  # roi structure names
         self.roiColor = {}  # colors of rois
@@ -1281,6 +1284,9 @@ class Voxel:
     # ----------------------------------------------------------------------
     def read(self, filename):
         self.filename = filename
+        # forget voxel data of previously read file
+        self.dataPos = None
+        self._data = None
         try:
             f = open(filename, "rb")
         except:
@@ -1330,12 +1336,14 @@ class Voxel:
             return False
         self.dx, self.dy, self.dz = struct.unpack("=3d", record)
 
-        # Voxel data (skip)
+        # Voxel data (skip, remember offset for lazy access)
+        dataPos = f.tell() + 4
         skip = fortran.skip(f)
         if skip != self.nx * self.ny * self.nz * 2:
             say("Invalid voxel file. Data size do not match")
             f.close()
             return False
+        self.dataPos = dataPos
 
         # kreg
         record = fortran.read(f)
@@ -1343,7 +1351,7 @@ class Voxel:
             say("Invalid voxel file. Wrong kreg array")
             f.close()
             return False
-        self.kreg = struct.unpack("=%dH" % (len(record) / 2), record)
+        self.kreg = np.frombuffer(record, dtype="=u2")
 
         # roiStruct
         if self.roiN > 0:
@@ -1401,6 +1409,18 @@ class Voxel:
         f.close()
         return True
 
+    # ----------------------------------------------------------------------
+    # Voxel data, organ index of each voxel, as read-only memory mapped array
+    # of shape (nx,ny,nz) in fortran order, mapped on first access
+    # ----------------------------------------------------------------------
+    @property
+    def data(self):
+        if self._data is None and self.dataPos is not None:
+            self._data = np.memmap(self.filename, dtype="=u2", mode="r",
+                                   offset=self.dataPos,
+                                   shape=(self.nx, self.ny, self.nz), order="F")
+        return self._data
+
     def __str__(self):
         return "Voxel\n" \
                "File:\t%s\n" \
@@ -1,3 +1,5 @@
+import numpy as np
+
 PROC_MIN_FIELD_WIDTH = 46
 PROC_DECIMAL_CHAR = '.'
 PROC_NO_LEADING_BLANK = False
@@ -338,3 +340,84 @@ def format_e(w, d, val):
     ftype = 'E'
     state = {'blanks_as_zeros': False, 'incl_plus': False, 'position': 0, 'scale': 0, 'halt_if_no_vals': False}
     return _compose_float_string(w, e, d, state, val, ftype)
+
+
+def format_d_array(w, d, values):
+    """
+    Vectorized version of @format_d, formats all elements of an array at once
+    :param w:
+    :param d:
+    :param values: array of numbers
+    :return: array of byte strings, each of length w
+    """
+    return _format_float_array(w, d, values, 'D')
+
+
+def format_e_array(w, d, values):
+    """
+    Vectorized version of @format_e, formats all elements of an array at once
+    :param w:
+    :param d:
+    :param values: array of numbers
+    :return: array of byte strings, each of length w
+    """
+    return _format_float_array(w, d, values, 'E')
+
+
+def _format_float_array(w, d, values, ftype):
+    """
+    Produces the same output as @_compose_float_string with scale factor 0 and no exponent width,
+    but digits of all values are obtained from single sprintf-like call and the output is
+    composed column by column in an array of characters.
+    """
+    values = np.asarray(values, dtype=np.float64).ravel()
+    n = values.size
+    if d < 2 or w < d + 7:
+        # no room for sign and leading zero, use scalar version which handles all layouts
+        scalar_format = format_e if ftype == 'E' else format_d
+        return np.array([scalar_format(w, d, float(v)).encode('ascii') for v in values], dtype='S{:d}'.format(w))
+    if n == 0:
+        return np.empty(0, dtype='S{:d}'.format(w))
+
+    finite = np.isfinite(values)
+    tmp = np.where(finite, np.abs(values), 0.0)
+    zero_flag = (tmp == 0.0)
+
+    # d significant digits, as in d.ddde+XX (exponent may have two or three digits)
+    buff = (('%.{:d}e\n'.format(d - 1) * n) % tuple(tmp.tolist())).encode('ascii')
+    buff = np.array(buff.split(b'\n')[:-1])
+    buff = buff.view(np.uint8).reshape(n, buff.itemsize)
+
+    # read in the exponent, shorter strings are padded with zeros
+    ex = np.zeros(n, dtype=np.int64)
+    for col in range(d + 3, buff.shape[1]):
+        digit = buff[:, col].astype(np.int64)
+        ex = np.where(digit != 0, ex * 10 + digit - ord('0'), ex)
+    ex = np.where(buff[:, d + 2] == ord('-'), -ex, ex) + 1
+    ex[zero_flag] = 0
+    abs_ex = np.abs(ex)
+    ex_sign = np.where(ex < 0, ord('-'), ord('+'))
+
+    # output is: blanks, sign, leading zero, decimal point, d digits and 4 characters of exponent
+    out = np.full((n, w), ord(' '), dtype=np.uint8)
+    pos = w - (d + 6)  # position of the leading zero
+    out[:, pos - 1] = np.where(np.signbit(values) & ~zero_flag, ord('-'), ord(' '))
+    out[:, pos] = ord('0')
+    out[:, pos + 1] = ord(PROC_DECIMAL_CHAR)
+    out[:, pos + 2] = buff[:, 0]
+    out[:, pos + 3:pos + d + 2] = buff[:, 2:d + 1]
+
+    # exponent character followed by two digits, or three digits without exponent character
+    exp3 = abs_ex > 99
+    out[:, w - 4] = np.where(exp3, ex_sign, ord(ftype))
+    out[:, w - 3] = np.where(exp3, ord('0') + abs_ex // 100, ex_sign)
+    out[:, w - 2] = ord('0') + (abs_ex // 10) % 10
+    out[:, w - 1] = ord('0') + abs_ex % 10
+
+    # handle the nan and inf cases
+    if not finite.all():
+        out[np.isnan(values)] = np.frombuffer(_compose_nan_string(w, ftype).encode('ascii'), dtype=np.uint8)
+        out[values == np.inf] = np.frombuffer(_compose_inf_string(w, ftype, False).encode('ascii'), dtype=np.uint8)
+        out[values == -np.inf] = np.frombuffer(_compose_inf_string(w, ftype, True).encode('ascii'), dtype=np.uint8)
+
+    return out.view('S{:d}'.format(w)).ravel()
@@ -0,0 +1,114 @@
+import os
+import logging
+import sqlite3
+
+from pymchelper.detector import HeaderInfo, read_page_headers
+from pymchelper.shieldhit.detector.detector_type import SHDetType
+from pymchelper.shieldhit.detector.estimator_type import SHGeoType
+
+logger = logging.getLogger(__name__)
+
+
+class HeaderIndex:
+    """
+    Persistent index of header information of binary files located in single directory
+    (one row for each page of multi-page estimators).
+    Index is stored in SQLite database file placed in the same directory.
+    Header of a file is read again only if file is not yet present in the index, or its size
+    or modification time has changed since it was indexed.
+    """
+    index_filename = '.pymchelper_index.sqlite'
+
+    _columns = ('name', 'page', 'mtime', 'size') + HeaderInfo._fields
+
+    _create_table = """CREATE TABLE IF NOT EXISTS page_headers (
+    name TEXT, page INTEGER,
+    mtime REAL, size INTEGER,
+    geotyp INTEGER, dettyp INTEGER, nstat INTEGER,
+    nx INTEGER, ny INTEGER, nz INTEGER,
+    xmin REAL, xmax REAL, ymin REAL, ymax REAL, zmin REAL, zmax REAL,
+    PRIMARY KEY (name, page))"""
+
+    def __init__(self, dirname):
+        self.dirname = dirname
+        self.filename = os.path.join(dirname, self.index_filename)
+        self.connection = sqlite3.connect(self.filename)
+        columns = tuple(row[1] for row in self.connection.execute("PRAGMA table_info(page_headers)"))
+        if columns and columns != self._columns:  # index written by other version of pymchelper, rebuild it
+            self.connection.execute("DROP TABLE page_headers")
+        self.connection.execute(self._create_table)
+        cursor = self.connection.execute("SELECT {:s} FROM page_headers ORDER BY name, page".format(
+            ", ".join(self._columns)))
+        self._rows = {}
+        for row in cursor:
+            self._rows.setdefault(row[0], []).append(row)
+        logger.debug("Loaded {:d} entries from {:s}".format(len(self._rows), self.filename))
+
+    def header(self, filename):
+        """
+        Header information of all pages of the file, taken from the index if file hasn't changed since
+        it was indexed. Otherwise headers are read from the file and index is updated.
+        :param filename: binary file name, located in indexed directory
+        :return: tuple of HeaderInfo records, one for each page
+        """
+        name = os.path.basename(filename)
+        stat = os.stat(filename)
+        rows = self._rows.get(name)
+        if rows is not None and rows[0][2] == stat.st_mtime and rows[0][3] == stat.st_size:
+            return tuple(self._header_from_row(row) for row in rows)
+
+        logger.debug("Indexing " + filename)
+        headers = read_page_headers(filename)
+        rows = [(name, page_no, stat.st_mtime, stat.st_size,
+                 int(header.geotyp), int(header.dettyp), int(header.nstat),
+                 int(header.nx), int(header.ny), int(header.nz),
+                 float(header.xmin), float(header.xmax), float(header.ymin), float(header.ymax),
+                 float(header.zmin), float(header.zmax))
+                for page_no, header in enumerate(headers)]
+        self.connection.execute("DELETE FROM page_headers WHERE name = ?", (name,))
+        self.connection.executemany("INSERT INTO page_headers VALUES ({:s})".format(", ".join("?" * len(rows[0]))),
+                                    rows)
+        self._rows[name] = rows
+        return headers
+
+    def close(self):
+        """
+        Remove entries of files which no longer exist, save changes and close the index.
+        """
+        removed = [(name,) for name in self._rows if not os.path.exists(os.path.join(self.dirname, name))]
+        self.connection.executemany("DELETE FROM page_headers WHERE name = ?", removed)
+        self.connection.commit()
+        self.connection.close()
+
+    @staticmethod
+    def _header_from_row(row):
+        header = HeaderInfo(*row[4:])
+        # SQLite stores NaN as NULL, ranges which were not defined come back as None
+        ranges = dict((name, float('nan') if value is None else value)
+                      for name, value in header._asdict().items() if name.endswith(('min', 'max')))
+        return header._replace(geotyp=SHGeoType(header.geotyp), dettyp=SHDetType(header.dettyp), **ranges)
+
+
+def read_headers(input_file_list):
+    """
+    Reads headers of many files, using persistent index in each directory containing input files.
+    If index cannot be created (i.e. directory is read-only), headers are read directly from files.
+    :param input_file_list: list of input files
+    :return: dictionary mapping file names to tuples of HeaderInfo records (one for each page)
+    """
+    files_in_dir = {}
+    for filename in input_file_list:
+        files_in_dir.setdefault(os.path.dirname(filename), []).append(filename)
+
+    result = {}
+    for dirname, filenames in files_in_dir.items():
+        try:
+            index = HeaderIndex(dirname or os.curdir)
+            try:
+                result.update((filename, index.header(filename)) for filename in filenames)
+            finally:
+                index.close()
+        except sqlite3.Error as e:
+            logger.warning("Cannot use header index in directory {:s}: {:s}".format(dirname or os.curdir, str(e)))
+            result.update((filename, read_page_headers(filename)) for filename in filenames if filename not in result)
+    return result
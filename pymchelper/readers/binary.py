@@ -0,0 +1,74 @@
+import logging
+
+import numpy as np
+
+from pymchelper.shieldhit.detector.detector_type import SHDetType
+from pymchelper.shieldhit.detector.estimator_type import SHGeoType
+from pymchelper.writers.binary import header_fields
+
+logger = logging.getLogger(__name__)
+
+
+def _fill_header(detector, header, edges):
+    """
+    Fills detector header from saved header fields and bin edges.
+    :param header: mapping of header field names to saved values, plus units and title
+    :param edges: sequence of X, Y and Z bin edges
+    """
+    for name in header_fields:
+        # saved data may come from many merged files, still it is a single sample when files are averaged
+        setattr(detector, 'merged_files' if name == 'counter' else name, int(header[name]))
+    detector.geotyp = SHGeoType(detector.geotyp)
+    detector.dettyp = SHDetType(detector.dettyp)
+    for axis, axis_edges in zip('xyz', edges):
+        setattr(detector, 'n' + axis, len(axis_edges) - 1)
+        setattr(detector, axis + 'min', float(axis_edges[0]))
+        setattr(detector, axis + 'max', float(axis_edges[-1]))
+    detector.units = [unit.decode('utf-8') for unit in np.ravel(header['units'])]
+    detector.title = bytes(np.asarray(header['title']).item()).decode('utf-8')
+
+
+def _fill_data(detector, data, error, nscale):
+    detector.data = np.ravel(data)
+    detector.error = None if error is None else np.ravel(error)
+    if nscale != 1:
+        detector.data = detector.data * nscale
+        if detector.error is not None:
+            detector.error = detector.error * nscale
+
+
+class NpzReader:
+    """
+    Reads files saved by NpzWriter. Arrays are decompressed only when needed,
+    reading the header doesn't touch data and error arrays.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+
+    def read_header(self, detector):
+        with np.load(self.filename) as f:
+            _fill_header(detector, f, [f['x_edges'], f['y_edges'], f['z_edges']])
+
+    def read(self, detector, nscale=1):
+        with np.load(self.filename) as f:
+            _fill_header(detector, f, [f['x_edges'], f['y_edges'], f['z_edges']])
+            _fill_data(detector, f['data'], f['error'] if 'error' in f.files else None, nscale)
+
+
+class HdfReader:
+    """
+    Reads files saved by HdfWriter (needs h5py package).
+    """
+    def __init__(self, filename):
+        self.filename = filename
+
+    def read_header(self, detector):
+        import h5py
+        with h5py.File(self.filename, "r") as f:
+            _fill_header(detector, f.attrs, [f['x_edges'][()], f['y_edges'][()], f['z_edges'][()]])
+
+    def read(self, detector, nscale=1):
+        import h5py
+        with h5py.File(self.filename, "r") as f:
+            _fill_header(detector, f.attrs, [f['x_edges'][()], f['y_edges'][()], f['z_edges'][()]])
+            _fill_data(detector, f['data'][()], f['error'][()] if 'error' in f else None, nscale)
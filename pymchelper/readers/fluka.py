@@ -1,28 +1,135 @@
 import logging
+import struct
 
 import numpy as np
 
+import pymchelper.flair.common.fortran as fortran
 from pymchelper.shieldhit.detector.detector_type import SHDetType
 from pymchelper.shieldhit.detector.estimator_type import SHGeoType
-from pymchelper.flair.Data import Usrbin, unpackArray
+from pymchelper.flair.Data import Usrbin, Usrbdx, Resnuclei
 
 logger = logging.getLogger(__name__)
 
 
 class FlukaBinaryReader:
+    """
+    Reads binary output files generated by FLUKA estimators: USRBIN, USRBDX and RESNUCLEi.
+    Type of estimator is discovered from the size of first detector header record.
+    """
     def __init__(self, filename):
         self.filename = filename
 
+    def estimator_reader(self):
+        """
+        Reader of the estimator which produced the file. Raises IOError if file is truncated
+        or produced by estimator which is not supported.
+        """
+        try:
+            with open(self.filename, "rb") as f:
+                file_header = fortran.read(f)
+                size = fortran.skip(f)  # first detector header, or irradiation profile of RESNUCLEi
+        except struct.error:
+            file_header, size = None, 0
+        if not file_header or not size:
+            raise IOError("File {:s} is truncated or is not FLUKA binary file".format(self.filename))
+
+        # negative number of primaries marks RESNUCLEi file with irradiation profile, preceding detector header
+        evolution = len(file_header) >= 120 and struct.unpack_from("=i", file_header, 116)[0] <= 0
+        if size == 86:
+            return _UsrbinReader(self.filename)
+        elif size == 78:
+            return _UsrbdxReader(self.filename)
+        elif size == 38 or (evolution and (size - 4) % 8 == 0):
+            return _ResnucleiReader(self.filename)
+        raise IOError("File {:s} was produced by unsupported FLUKA estimator (detector header of {:d} bytes)".format(
+            self.filename, size))
+
+    def read_header(self, detector):
+        """
+        Reads only header information, data block is skipped without being read.
+        """
+        self.estimator_reader().read_header(detector)
+
     def read(self, detector, nscale=1):
-        usr = Usrbin(self.filename)
+        """
+        Reads all detectors stored in the file. If more than one detector is present,
+        detector is filled as multi-page detector, with one page for each FLUKA detector.
+        """
+        self.estimator_reader().read(detector, nscale)
+
+
+class _FlukaEstimatorReader:
+    """
+    Common part of FLUKA readers, estimator specific classes provide flair class used to parse
+    the header, and methods filling detector header and decoding data and statistical errors.
+    """
+    usr_class = None
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def read_header(self, detector):
+        usr = self.usr_class(self.filename)
+        pages = []
+        for det_no, _ in enumerate(usr.detector):
+            page = type(detector)()
+            self._fill_common_header(usr, page)
+            self._fill_header(usr, page, det_no)
+            pages.append(page)
+        self._fill_pages(detector, pages)
+
+    def read(self, detector, nscale=1):
+        usr = self.usr_class(self.filename)
         usr.say()  # file,title,time,weight,ncase,nbatch
-        for i, _ in enumerate(usr.detector):
-            logger.debug("-" * 20 + (" Detector number %i " % i) + "-" * 20)
-            usr.say(i)  # details for each detector
-        data = usr.readData(0)
-        fdata = unpackArray(data)
+        pages = []
+        with open(self.filename, "rb") as f:
+            for det_no, _ in enumerate(usr.detector):
+                logger.debug("-" * 20 + (" Detector number %i " % det_no) + "-" * 20)
+                usr.say(det_no)  # details for each detector
 
-        # TODO read detector type
+                page = type(detector)()
+                self._fill_common_header(usr, page)
+                self._fill_header(usr, page, det_no)
+
+                page.data = self._read_data(f, usr, det_no)
+                page.error = self._read_error(usr, det_no, page.data)
+                self._scale(page, nscale)
+
+                pages.append(page)
+        self._fill_pages(detector, pages)
+
+    @staticmethod
+    def _fill_pages(detector, pages):
+        """
+        Copies single detector into detector structure, or makes it a container of many pages.
+        """
+        if len(pages) > 1:
+            detector.set_pages(pages)
+        elif pages:
+            vars(detector).update(vars(pages[0]))
+
+    @staticmethod
+    def _read_record_array(f, pos, count):
+        """
+        Reads fortran record holding single precision floats directly into numpy array.
+        :param f: file opened for binary reading
+        :param pos: offset of the record, as recorded while reading the header
+        :param count: number of values
+        :return: array of double precision numbers
+        """
+        f.seek(pos + 4)  # skip length of fortran record
+        data = np.fromfile(f, dtype=np.float32, count=count)
+        return data.astype(np.float64)
+
+    @staticmethod
+    def _record_array(record):
+        """
+        Decodes fortran record (as read by flair routines) holding single precision floats.
+        """
+        return np.frombuffer(record, dtype=np.float32).astype(np.float64)
+
+    @staticmethod
+    def _fill_common_header(usr, detector):
         detector.det = "FLUKA"
 
         # TODO read particle type
@@ -34,29 +141,164 @@ class FlukaBinaryReader:
         # TODO cross-check statistics
         detector.nstat = usr.ncase
 
-        # TODO figure out when more detectors are used
-        detector.nx = usr.detector[0].nx
-        detector.ny = usr.detector[0].ny
-        detector.nz = usr.detector[0].nz
-
-        detector.xmin = usr.detector[0].xlow
-        detector.ymin = usr.detector[0].ylow
-        detector.zmin = usr.detector[0].zlow
-
-        detector.xmax = usr.detector[0].xhigh
-        detector.ymax = usr.detector[0].yhigh
-        detector.zmax = usr.detector[0].zhigh
-
         # TODO read detector type
         detector.dettyp = SHDetType.unknown
 
-        detector.data = np.array(fdata)
+        # set units : detector.units are [x,y,z,v,data,detector_title,x_name,y_name,z_name]
+        detector.units = [""] * 9
+
+        detector.title = usr.title.decode('ascii')
+
+    @staticmethod
+    def _scale(detector, nscale):
         if nscale != 1:
             detector.data *= nscale
+            if detector.error is not None:
+                detector.error *= nscale
+
+    def _fill_header(self, usr, detector, det_no):
+        raise NotImplementedError
+
+    def _read_data(self, f, usr, det_no):
+        raise NotImplementedError
+
+    def _read_error(self, usr, det_no, data):
+        """
+        Absolute statistical errors, calculated from relative errors stored in STATISTICS records.
+        :return: array of errors or None if statistical information is not present
+        """
+        return None
+
+
+class _UsrbinReader(_FlukaEstimatorReader):
+    """
+    USRBIN estimator, binning in X, Y and Z (or R, PHI and Z) is mapped directly to detector axes.
+    """
+    usr_class = Usrbin
+
+    def _fill_header(self, usr, detector, det_no):
+        bin_det = usr.detector[det_no]
+
+        detector.nx = bin_det.nx
+        detector.ny = bin_det.ny
+        detector.nz = bin_det.nz
+
+        detector.xmin = bin_det.xlow
+        detector.ymin = bin_det.ylow
+        detector.zmin = bin_det.zlow
+
+        detector.xmax = bin_det.xhigh
+        detector.ymax = bin_det.yhigh
+        detector.zmax = bin_det.zhigh
+
+    def _read_data(self, f, usr, det_no):
+        bin_det = usr.detector[det_no]
+        return self._read_record_array(f, bin_det.datapos, bin_det.nx * bin_det.ny * bin_det.nz)
+
+    def _read_error(self, usr, det_no, data):
+        stat = usr.readStat(det_no)
+        if stat is None:
+            return None
+        return self._record_array(stat) * np.abs(data)
+
+    def _scale(self, detector, nscale):
+        _FlukaEstimatorReader._scale(detector, nscale)
+        if nscale != 1:
             # 1 gigaelectron volt / gram = 1.60217662 x 10-7 Gy
             detector.data *= 1.60217662e-7
+            if detector.error is not None:
+                detector.error *= 1.60217662e-7
 
-        # set units : detector.units are [x,y,z,v,data,detector_title]
-        detector.units = [""] * 9
 
-        detector.title = usr.title.decode('ascii')
+class _UsrbdxReader(_FlukaEstimatorReader):
+    """
+    USRBDX estimator, double differential data is mapped to X (energy) and Y (solid angle) axes.
+    Detector axes are linear, so logarithmic binning (negative itusbx for energy, |itusbx| = 2 for angle)
+    is mapped to equal bins of decimal logarithm of energy or solid angle.
+    Data of low energy neutron groups is skipped.
+    """
+    usr_class = Usrbdx
+
+    def _fill_header(self, usr, detector, det_no):
+        bdx_det = usr.detector[det_no]
+
+        detector.nx = bdx_det.ne
+        detector.ny = bdx_det.na
+        detector.nz = 1
+
+        detector.xmin = bdx_det.elow
+        detector.ymin = bdx_det.alow
+        detector.zmin = 0.0
+
+        detector.xmax = bdx_det.ehigh
+        detector.ymax = bdx_det.ahigh
+        detector.zmax = 0.0
+
+        detector.units[0:2] = ("GeV", "sr")
+        detector.units[6:8] = ("Energy", "Solid angle")
+
+        if bdx_det.type < 0:
+            detector.xmin, detector.xmax = np.log10(bdx_det.elow), np.log10(bdx_det.ehigh)
+            detector.units[0] = "log10(GeV)"
+        if abs(bdx_det.type) == 2:
+            detector.ymin, detector.ymax = np.log10(bdx_det.alow), np.log10(bdx_det.ahigh)
+            detector.units[1] = "log10(sr)"
+
+        if bdx_det.ngroup > 0:
+            logger.warning("Data of {:d} low energy neutron groups of USRBDX detector {:d} is skipped".format(
+                bdx_det.ngroup, det_no + 1))
+
+    def _double_differential(self, usr, det_no, values):
+        """ For each angular bin, values for energy bins are followed by low energy neutron groups
+        """
+        bdx_det = usr.detector[det_no]
+        values = values.reshape(bdx_det.na, bdx_det.ngroup + bdx_det.ne)
+        return np.ascontiguousarray(values[:, :bdx_det.ne]).ravel()
+
+    def _read_data(self, f, usr, det_no):
+        bdx_det = usr.detector[det_no]
+        data = self._read_record_array(f, bdx_det.datapos, (bdx_det.ngroup + bdx_det.ne) * bdx_det.na)
+        return self._double_differential(usr, det_no, data)
+
+    def _read_error(self, usr, det_no, data):
+        stat = usr.readStat(det_no)
+        if stat is None:
+            return None
+        return self._double_differential(usr, det_no, self._record_array(stat)) * np.abs(data)
+
+
+class _ResnucleiReader(_FlukaEstimatorReader):
+    """
+    RESNUCLEi estimator, yield of residual nuclei is mapped to X (atomic number Z)
+    and Y (N-Z, difference of neutron and atomic numbers) axes.
+    """
+    usr_class = Resnuclei
+
+    def _fill_header(self, usr, detector, det_no):
+        res_det = usr.detector[det_no]
+
+        detector.nx = res_det.zhigh
+        detector.ny = res_det.mhigh
+        detector.nz = 1
+
+        # bins are centered on integer values, Z = 1 .. zhigh, N-Z = nmzmin + 1 .. nmzmin + mhigh
+        detector.xmin = 0.5
+        detector.ymin = res_det.nmzmin + 0.5
+        detector.zmin = 0.0
+
+        detector.xmax = res_det.zhigh + 0.5
+        detector.ymax = res_det.nmzmin + res_det.mhigh + 0.5
+        detector.zmax = 0.0
+
+        detector.units[6:8] = ("Z", "N-Z")
+
+    def _read_data(self, f, usr, det_no):
+        res_det = usr.detector[det_no]
+        return self._read_record_array(f, res_det.datapos, res_det.zhigh * res_det.mhigh)
+
+    def _read_error(self, usr, det_no, data):
+        stat = usr.readStat(det_no)
+        if stat is None:
+            return None
+        # statistics of each detector: total, A, errA, Z, errZ, data errors and optional isomers
+        return self._record_array(stat[5]) * np.abs(data)
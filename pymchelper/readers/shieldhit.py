@@ -1,4 +1,6 @@
+import copy
 import logging
+import struct
 from collections import namedtuple
 from enum import IntEnum
 import numpy as np
@@ -9,6 +11,23 @@ from pymchelper.shieldhit.detector.estimator_type import SHGeoType
 
 logger = logging.getLogger(__name__)
 
+# types of detectors which data is not normalized by number of primaries
+not_normalized_dettypes = (SHDetType.dlet, SHDetType.tlet,
+                           SHDetType.letflu,
+                           SHDetType.dletg, SHDetType.tletg,
+                           SHDetType.avg_energy, SHDetType.avg_beta,
+                           SHDetType.material)
+
+
+def _update_data(detector, ufunc, value):
+    """ Apply binary numpy function (i.e. np.multiply) to detector data.
+    Operation is done in place, unless data is read-only (i.e. memory mapped payload), then a copy is made.
+    """
+    if detector.data.flags.writeable:
+        ufunc(detector.data, value, out=detector.data)
+    else:
+        detector.data = ufunc(detector.data, value)
+
 
 def _prepare_detector_units(detector, nscale):
     """ Set units depending on detector type. Must be called by several classes.
@@ -41,24 +60,20 @@ def _prepare_detector_units(detector, nscale):
         detector.data = np.asarray([detector.data])
 
     # normalize result if we need that.
-    if detector.dettyp not in (SHDetType.dlet, SHDetType.tlet,
-                               SHDetType.letflu,
-                               SHDetType.dletg, SHDetType.tletg,
-                               SHDetType.avg_energy, SHDetType.avg_beta,
-                               SHDetType.material):
+    if detector.dettyp not in not_normalized_dettypes:
         if detector.nstat != 0:  # geotyp = GEOMAP will have 0 projectiles simulated
-            detector.data /= np.float64(detector.nstat)
+            _update_data(detector, np.divide, np.float64(detector.nstat))
 
     if nscale != 1 and detector.dettyp in (SHDetType.energy, SHDetType.fluence, SHDetType.crossflu,
                                            SHDetType.dose, SHDetType.counter, SHDetType.pet):
-        detector.data *= np.float64(nscale)  # scale with number of particles given by user
+        _update_data(detector, np.multiply, np.float64(nscale))  # scale with number of particles given by user
         if detector.dettyp == SHDetType.dose:
             detector.dettyp = SHDetType.dose_gy
         if detector.dettyp == SHDetType.alanine:
             detector.dettyp = SHDetType.alanine_gy
         if detector.dettyp in (SHDetType.dose_gy, SHDetType.alanine_gy):
             # 1 megaelectron volt / gram = 1.60217662 x 10-10 Gy
-            detector.data *= np.float64(1.60217662e-10)
+            _update_data(detector, np.multiply, np.float64(1.60217662e-10))
             detector.units[0:4] = SHBinaryReader.get_estimator_units(detector.geotyp)
             detector.units[4:6] = SHBinaryReader.get_detector_unit(detector.dettyp, detector.geotyp)
             detector.title = detector.units[5]
@@ -133,25 +148,74 @@ class SHBDOTagID(IntEnum):
     rt_time = 0xAA01         # [usignend long int] optional runtime in seconds
 
 
-# for future use
-# mapping = {SHBDOTagID.shversion: "mc_code_version",
-#           SHBDOTagID.filedate: "filedate",
-#           SHBDOTagID.user: "user",
-#           SHBDOTagID.host: "host",
-#           SHBDOTagID.rt_nstat: "nstat",
-#           SHBDOTagID.det_dtype: "dettyp",
-#           SHBDOTagID.est_geotyp: "geotyp",
-#           SHBDOTagID.det_xyz_start: ("xmin", "ymin", "zmin"),
-#           SHBDOTagID.det_xyz_stop: ("xmax", "ymax", "zmax"),
-#           SHBDOTagID.det_nbin: ("nx", "ny", "nz")}
+def _set_attributes(*names):
+    """ Setter assigning consecutive payload elements to detector attributes with given names.
+    """
+    def setter(detector, pl):
+        for name, value in zip(names, pl):
+            setattr(detector, name, value)
+    return setter
+
+
+def _set_differential(name):
+    """ Setter of differential scoring attribute, used only for differential estimators.
+    Partial support for differential scoring (only linear binning)
+    TODO add some support for DMSH, DCYL and DZONE
+    TODO add support for logarithmic binning
+    """
+    def setter(detector, pl):
+        if detector.geotyp in (SHGeoType.dplane, SHGeoType.dmsh, SHGeoType.dcyl, SHGeoType.dzone):
+            setattr(detector, name, pl[0])
+    return setter
+
+
+def _set_value(name, value):
+    """ Setter assigning constant value to detector attribute, payload is ignored.
+    """
+    def setter(detector, pl):
+        setattr(detector, name, value)
+    return setter
+
+
+# mapping of tag IDs to functions filling detector structure with token payload
+# tokens with IDs not present here are skipped without decoding payload
+_token_setters = {
+    SHBDOTagID.shversion: _set_attributes("mc_code_version"),
+    SHBDOTagID.filedate: _set_attributes("filedate"),
+    SHBDOTagID.user: _set_attributes("user"),
+    SHBDOTagID.host: _set_attributes("host"),
+    SHBDOTagID.rt_nstat: _set_attributes("nstat"),
+    SHBDOTagID.est_geotyp: lambda detector, pl: setattr(detector, "geotyp", SHGeoType[pl[0].lower()]),
+    SHBDOTagID.ext_ptvdose: _set_value("tripdose", 0.0),
+    SHBDOTagID.ext_nproj: _set_value("tripntot", -1),
+    SHBDOTagID.est_pages: _set_attributes("pages"),  # declared number, set again from pages read
+    SHBDOTagID.det_dtype: lambda detector, pl: setattr(detector, "dettyp", SHDetType(pl[0])),
+    SHBDOTagID.det_part: _set_attributes("particle"),
+    SHBDOTagID.det_partz: _set_attributes("particle_z"),
+    SHBDOTagID.det_parta: _set_attributes("particle_a"),
+    SHBDOTagID.det_nbin: _set_attributes("nx", "ny", "nz"),
+    SHBDOTagID.det_xyz_start: _set_attributes("xmin", "ymin", "zmin"),
+    SHBDOTagID.det_xyz_stop: _set_attributes("xmax", "ymax", "zmax"),
+    SHBDOTagID.det_dif_start: _set_differential("dif_min"),
+    SHBDOTagID.det_dif_stop: _set_differential("dif_max"),
+    SHBDOTagID.det_nbine: _set_differential("dif_n"),
+    SHBDOTagID.det_difftype: _set_differential("dif_type"),
+    SHBDOTagID.det_zonestart: _set_attributes("zone_start"),
+}
+
+# tokens describing single page of an estimator, all other tokens describe whole file or estimator
+_page_tags = frozenset(tag for tag in _token_setters if tag.name.startswith("det_"))
 
 
 class SHBinaryReader:
     """
     Reads binary output files generated by SHIELD-HIT12A code.
+    If mmap is True, data block is not read into memory, but memory-mapped (as read-only array)
+    directly from the file. It is copied only if normalization or scaling needs to modify it.
     """
-    def __init__(self, filename):
+    def __init__(self, filename, mmap=False):
         self.filename = filename
+        self.mmap = mmap
 
     def test_version_0p6(self):
         sh_bdo_magic_number = b'xSH12A'
@@ -168,12 +232,23 @@ class SHBinaryReader:
             else:
                 return False
 
+    def read_header(self, detector):
+        """
+        Reads only header information (estimator and detector type, binning, ranges, nstat).
+        Data block is skipped without being read.
+        """
+        if self.test_version_0p6():
+            reader = _SHBinaryReader0p6(self.filename, self.mmap)
+        else:
+            reader = _SHBinaryReader0p1(self.filename, self.mmap)
+        reader.read_header(detector)
+
     def read(self, detector, nscale=1):
         if self.test_version_0p6():
-            reader = _SHBinaryReader0p6(self.filename)
+            reader = _SHBinaryReader0p6(self.filename, self.mmap)
             reader.read(detector, nscale)
         else:
-            reader = _SHBinaryReader0p1(self.filename)
+            reader = _SHBinaryReader0p1(self.filename, self.mmap)
             reader.read_header(detector)
             reader.read_payload(detector, nscale)
 
@@ -264,197 +339,180 @@ class _SHBinaryReader0p6:
     """
     Binary format reader from version >= 0.6
     """
-    def __init__(self, filename):
+    def __init__(self, filename, mmap=False):
         self.filename = filename
+        self.mmap = mmap
+
+    def read_header(self, detector):
+        logger.info("Reading header: " + self.filename)
+        pages = self._read_tokens(detector, read_data=False)
+        self._fill_pages(detector, pages)
 
     def read(self, detector, nscale=1):
         logger.info("Reading: " + self.filename)
-        with open(self.filename, "rb") as f:
-            d1 = np.dtype([('magic', 'S6'),
-                           ('end', 'S2'),
-                           ('vstr', 'S16')])
+        pages = self._read_tokens(detector, read_data=True)
+        for page in pages:
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Detector data : " + str(page.data))
+            _prepare_detector_units(page, nscale)
+        self._fill_pages(detector, pages)
+        detector.counter = 1
 
-            _x = np.fromfile(f, dtype=d1, count=1)  # read the data into numpy
-            logger.debug("Magic : " + _x['magic'][0].decode('ASCII'))
-            logger.debug("Endian: " + _x['end'][0].decode('ASCII'))
-            logger.debug("VerStr: " + _x['vstr'][0].decode('ASCII'))
+    @staticmethod
+    def _fill_pages(detector, pages):
+        """
+        Copies single page into detector structure, or makes it a container of many pages.
+        """
+        if len(pages) > 1:
+            detector.set_pages(pages)
+        elif pages:
+            vars(detector).update(vars(pages[0]))
 
-            while f:
-                token = self.get_token(f)
-                if token is None:
-                    break
+    def _read_tokens(self, detector, read_data=True):
+        """
+        Walks over all tokens in the file and fills detector structure.
+        Each data block closes a page, page is saved as a copy of detector structure.
+        Following det_* tokens describe next page, they are applied to estimator-level state
+        (as it was before det_* tokens of previous page), so attributes of one page don't leak to the next one.
+        If read_data is False, data block is skipped without being read.
+        :return: list of pages
+        """
+        # whole file is read in single call, or memory-mapped if only header
+        # is needed or data should not be loaded into memory
+        if read_data and not self.mmap:
+            buf = np.fromfile(self.filename, dtype=np.uint8)
+        else:
+            buf = np.memmap(self.filename, dtype=np.uint8, mode='r')
+
+        pages = []
+        estimator_state = None  # detector attributes before first det_* token of current page
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            magic, end, vstr = self._magic.unpack_from(buf, 0)
+            logger.debug("Magic : " + magic.decode('ASCII'))
+            logger.debug("Endian: " + end.decode('ASCII'))
+            logger.debug("VerStr: " + vstr.decode('ASCII'))
+
+        for pl_id, pl_type, pl_len, pl_offset in self.tokens(buf):
+            if debug:
+                logger.debug("Read token {:s} 0x{:02x}".format(pl_type.decode('ASCII'), pl_id))
+
+            if pl_id == SHBDOTagID.det_data:
+                page = copy.copy(detector)
+                if read_data:
+                    page.data = self._data_payload(buf, pl_type, pl_len, pl_offset)
+                pages.append(page)
+                if estimator_state is not None:
+                    vars(detector).clear()
+                    vars(detector).update(estimator_state)
+                    estimator_state = None
+                continue
+
+            setter = _token_setters.get(pl_id)
+            if setter is None:
+                continue
+            if pl_id in _page_tags and estimator_state is None:
+                estimator_state = dict(vars(detector))
+
+            pl = np.frombuffer(buf, dtype=np.dtype(pl_type), count=pl_len, offset=pl_offset)
+            if pl.dtype.kind == 'S':
+                # decode all strings at once (currently there will never be more than one per token)
+                pl = np.char.strip(np.char.decode(pl, 'ASCII')).tolist()
+            setter(detector, pl)
+
+        for page in pages:
+            self._fix_page(page)
+
+        if debug:
+            logger.debug("Done reading bdo file.")
+            logger.debug("Detector pages: " + str(len(pages)))
+            for page in pages:
+                logger.debug("Detector nstat: " + str(page.nstat))
+                logger.debug("Detector nx   : " + str(page.nx))
+                logger.debug("Detector ny   : " + str(page.ny))
+                logger.debug("Detector nz   : " + str(page.nz))
 
-                pl_id, _pl_type, _pl_len, _pl = token
+        return pages
+
+    @staticmethod
+    def _fix_page(detector):
+        """
+        Adjusts binning of differential and zone scoring pages.
+        """
+        # differential scoring data replacement
+        if hasattr(detector, 'dif_min') and hasattr(detector, 'dif_max') and hasattr(detector, 'dif_n'):
+            if detector.nz == 1:
+                detector.nz = detector.dif_n
+                detector.zmin = detector.dif_min
+                detector.zmax = detector.dif_max
+                detector.dif_axis = 2
+            elif detector.ny == 1:
+                detector.ny = detector.dif_n
+                detector.ymin = detector.dif_min
+                detector.ymax = detector.dif_max
+                detector.dif_axis = 1
+            elif detector.nx == 1:
+                detector.nx = detector.dif_n
+                detector.xmin = detector.dif_min
+                detector.xmax = detector.dif_max
+                detector.dif_axis = 0
+
+        # TODO: would be better to not overwrite x,y,z and make proper case for ZONE scoring later.
+        if detector.geotyp in (SHGeoType.zone, SHGeoType.dzone):
+            # special case for zone scoring, x min and max will be zone numbers
+            detector.xmin = detector.zone_start
+            detector.xmax = detector.xmin + detector.nx - 1
+            detector.ymin = 0.0
+            detector.ymax = 0.0
+            detector.zmin = 0.0
+            detector.zmax = 0.0
 
-                pl = [None]*_pl_len
+    # file starts with magic number, endianness and version string
+    _magic = struct.Struct('<6s2s16s')
 
-                # decode all strings (currently there will never be more than one per token)
-                if 'S' in _pl_type.decode('ASCII'):
-                    for i, _j in enumerate(_pl):
-                        pl[i] = _pl[i].decode('ASCII').strip()
-                else:
-                    pl = _pl
-
-                logger.debug("Read token {:s} 0x{:02x}".format(_pl_type.decode('ASCII'), pl_id))
-
-                # TODO: some clever mapping could be done here surely
-                # something like this: however the keymaps are not complete
-                # attr_keys = SHBDOTagID(pl_id)
-                # attributes = mapping[attr_keys]
-                # for i, attr in enumerate(attributes):
-                #     setattr(detector,attr,pl[i])
-                #
-
-                if pl_id == SHBDOTagID.shversion:
-                    detector.mc_code_version = pl[0]
-                    logger.debug("MC code version:" + detector.mc_code_version)
-
-                if pl_id == SHBDOTagID.filedate:
-                    detector.filedate = pl[0]
-
-                if pl_id == SHBDOTagID.user:
-                    detector.user = pl[0]
-
-                if pl_id == SHBDOTagID.host:
-                    detector.host = pl[0]
-
-                if pl_id == SHBDOTagID.rt_nstat:
-                    detector.nstat = pl[0]
-
-                    # estimator block here ---
-                if pl_id == SHBDOTagID.est_geotyp:
-                    detector.geotyp = SHGeoType[pl[0].strip().lower()]
-
-                if pl_id == SHBDOTagID.ext_ptvdose:
-                    detector.tripdose = 0.0
-
-                if pl_id == SHBDOTagID.ext_nproj:
-                    detector.tripntot = -1
-
-                if pl_id == SHBDOTagID.est_pages:
-                    detector.pages = pl[0]
-                    # todo: handling of multiple detectors (SPC)
-
-                # read a single detector
-                if pl_id == SHBDOTagID.det_dtype:
-                    detector.dettyp = SHDetType(pl[0])
-
-                if pl_id == SHBDOTagID.det_part:  # particle to be scored
-                    detector.particle = pl[0]
-                if pl_id == SHBDOTagID.det_partz:  # particle to be scored
-                    detector.particle_z = pl[0]
-                if pl_id == SHBDOTagID.det_parta:  # particle to be scored
-                    detector.particle_a = pl[0]
-
-                if pl_id == SHBDOTagID.det_nbin:
-                    detector.nx = pl[0]
-                    detector.ny = pl[1]
-                    detector.nz = pl[2]
-
-                if pl_id == SHBDOTagID.det_xyz_start:
-                    detector.xmin = pl[0]
-                    detector.ymin = pl[1]
-                    detector.zmin = pl[2]
-
-                if pl_id == SHBDOTagID.det_xyz_stop:
-                    detector.xmax = pl[0]
-                    detector.ymax = pl[1]
-                    detector.zmax = pl[2]
-
-                # partial support for differential scoring (only linear binning)
-                # TODO add some support for DMSH, DCYL and DZONE
-                # TODO add support for logarithmic binning
-                if detector.geotyp in (SHGeoType.dplane, SHGeoType.dmsh, SHGeoType.dcyl, SHGeoType.dzone):
-                    if pl_id == SHBDOTagID.det_dif_start:
-                        detector.dif_min = pl[0]
-
-                    if pl_id == SHBDOTagID.det_dif_stop:
-                        detector.dif_max = pl[0]
-
-                    if pl_id == SHBDOTagID.det_nbine:
-                        detector.dif_n = pl[0]
-
-                    if pl_id == SHBDOTagID.det_difftype:
-                        detector.dif_type = pl[0]
-
-                if pl_id == SHBDOTagID.det_zonestart:
-                    detector.zone_start = pl[0]
-
-                if pl_id == SHBDOTagID.det_data:
-                    detector.data = np.asarray(pl)
-
-            # differential scoring data replacement
-            if hasattr(detector, 'dif_min') and hasattr(detector, 'dif_max') and hasattr(detector, 'dif_n'):
-                if detector.nz == 1:
-                    detector.nz = detector.dif_n
-                    detector.zmin = detector.dif_min
-                    detector.zmax = detector.dif_max
-                    detector.dif_axis = 2
-                elif detector.ny == 1:
-                    detector.ny = detector.dif_n
-                    detector.ymin = detector.dif_min
-                    detector.ymax = detector.dif_max
-                    detector.dif_axis = 1
-                elif detector.nx == 1:
-                    detector.nx = detector.dif_n
-                    detector.xmin = detector.dif_min
-                    detector.xmax = detector.dif_max
-                    detector.dif_axis = 0
-
-            # TODO: would be better to not overwrite x,y,z and make proper case for ZONE scoring later.
-            if detector.geotyp in (SHGeoType.zone, SHGeoType.dzone):
-                # special case for zone scoring, x min and max will be zone numbers
-                detector.xmin = detector.zone_start
-                detector.xmax = detector.xmin + detector.nx - 1
-                detector.ymin = 0.0
-                detector.ymax = 0.0
-                detector.zmin = 0.0
-                detector.zmax = 0.0
+    # each token starts with tag: payload id, payload dtype string and payload number of elements
+    _tag = struct.Struct('<Q8sQ')
 
-            logger.debug("Done reading bdo file.")
-            logger.debug("Detector data : " + str(detector.data))
-            logger.debug("Detector nstat: " + str(detector.nstat))
-            logger.debug("Detector nx   : " + str(detector.nx))
-            logger.debug("Detector ny   : " + str(detector.ny))
-            logger.debug("Detector nz   : " + str(detector.nz))
-            _prepare_detector_units(detector, nscale)
-            detector.counter = 1
-
-    def get_token(self, f):
+    @classmethod
+    def tokens(cls, buf):
         """
-        returns a tuple with 4 elements:
+        Generator walking over all tokens stored in buffer holding content of the file.
+        Yields tuples with 4 elements:
         0: payload id
         1: payload dtype string
         2: payload number of elements
-        3: payload itself
-        f is an open and readable file pointer.
-        returns None if no token was found / EOF
+        3: payload offset in the buffer
+        Payload itself is not read, generator stops at the end of buffer.
         """
+        pos = cls._magic.size
+        size = len(buf)
+        while pos + cls._tag.size <= size:
+            pl_id, pl_type, pl_len = cls._tag.unpack_from(buf, pos)
+            pl_type = pl_type.rstrip(b'\x00 ')
+            pos += cls._tag.size
+            yield pl_id, pl_type, pl_len, pos
+            pos += pl_len * np.dtype(pl_type).itemsize
 
-        tag = np.dtype([('pl_id', '<u8'),
-                        ('pl_type', 'S8'),
-                        ('pl_len', '<u8')])
-
-        x1 = np.fromfile(f, dtype=tag, count=1)  # read the data into numpy
-
-        if not x1:
-            return None
-        else:
-            pl_id = x1['pl_id'][0]
-            pl_type = x1['pl_type'][0]
-            pl_len = x1['pl_len'][0]
-            pl = np.fromfile(f,
-                             dtype=pl_type,
-                             count=pl_len)  # read the data into numpy
-            return(pl_id, pl_type, pl_len, pl)
+    @staticmethod
+    def _data_payload(buf, pl_type, pl_len, pl_offset):
+        """
+        Data block as a view of the buffer. Memory-mapped block stays read-only,
+        block read into memory is copied only if it is not aligned.
+        """
+        dtype = np.dtype(pl_type)
+        pl = buf[pl_offset:pl_offset + pl_len * dtype.itemsize].view(dtype)
+        if not isinstance(pl, np.memmap) and not pl.flags.aligned:
+            pl = pl.copy()
+        return pl
 
 
 class _SHBinaryReader0p1:
     """
     Binary format reader from 0.1 <= version <= 0.6
     """
-    def __init__(self, filename):
+    def __init__(self, filename, mmap=False):
         self.filename = filename
+        self.mmap = mmap
 
     def read_header(self, detector):
         logger.info("Reading header: " + self.filename)
@@ -590,12 +648,20 @@ class _SHBinaryReader0p1:
             return
 
         # next read the data:
-        offset_str = "S" + str(detector.payload_offset)
-        record_dtype = np.dtype([('trash', offset_str),
-                                 ('bin2', '<f8', detector.rec_size)])
-        record = np.fromfile(self.filename, record_dtype, count=-1)
-        # BIN(*)  : a large array holding results. Accessed using pointers.
-        detector.data = record['bin2'][:][0]
+        if self.mmap:
+            # BIN(*)  : a large array holding results, mapped as read-only array
+            detector.data = np.memmap(self.filename,
+                                      dtype='<f8',
+                                      mode='r',
+                                      offset=detector.payload_offset,
+                                      shape=(detector.rec_size,))
+        else:
+            offset_str = "S" + str(detector.payload_offset)
+            record_dtype = np.dtype([('trash', offset_str),
+                                     ('bin2', '<f8', detector.rec_size)])
+            record = np.fromfile(self.filename, record_dtype, count=-1)
+            # BIN(*)  : a large array holding results. Accessed using pointers.
+            detector.data = record['bin2'][:][0]
 
         _prepare_detector_units(detector, nscale)
         detector.counter = 1
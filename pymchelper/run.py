@@ -6,8 +6,9 @@ import sys
 
 import argparse
 
-from pymchelper.detector import merge_list, merge_many, Converters, ErrorEstimate
+from pymchelper.detector import merge_list, merge_many, Converters, ErrorEstimate, IncompatibleFilesError
 from pymchelper.writers.plots import ImageWriter
+from pymchelper.writers.trip98 import TripDddWriter
 
 logger = logging.getLogger(__name__)
 
@@ -27,12 +28,52 @@ def set_logger_level(args):
     logging.basicConfig(level=level)
 
 
-def add_default_options(parser):
-    import pymchelper
-    parser.add_argument('input', help='input filename, file list or pattern', type=str)
-    parser.add_argument('output', help='output filename or directory', nargs='?')
-    parser.add_argument('-j', '--jobs', help='number of parallel jobs to use (-1 means all CPUs)', default=-1, type=int)
-    parser.add_argument('--many', help='automatically merge data from various sources', action="store_true")
+def add_tripddd_options(parser):
+    """
+    Adds options controlling fitting of lateral profiles and diagnostic plots of TRiP98 .ddd files,
+    shared by tripddd converter and dddbatch program.
+    """
+    parser.add_argument("--ngauss",
+                        help='number of Gauss curves to fit (default: 2)',
+                        choices=(0, 1, 2),
+                        default=2,
+                        type=int)
+    parser.add_argument("--fit-jobs",
+                        help='number of parallel jobs fitting lateral profiles (-1 means all CPUs, '
+                             'default: 1, serial fitting)',
+                        default=1,
+                        type=int)
+    parser.add_argument("--warm-start",
+                        help='start lateral fit of each depth slice from parameters found for previous one, '
+                             'with narrowed bounds (fit from scratch is used if that fails)',
+                        action="store_true")
+    parser.add_argument("--plots",
+                        help='diagnostic plots: none, inline (made after writing ddd file) or background '
+                             '(made by background thread while program goes on, best-effort: plotting still '
+                             'shares the interpreter with the main thread) '
+                             '(default: inline if --verbose is given, none otherwise)',
+                        choices=TripDddWriter.plot_modes,
+                        type=str)
+
+
+def add_merging_options(parser):
+    """
+    Adds options controlling reading and averaging of input files, shared by convertmc and dddbatch programs.
+    """
+    parser.add_argument('--weighted',
+                        help='weight input files by number of primaries and propagate errors stored in them '
+                             '(i.e. FLUKA files summed by usbsuw), instead of calculating errors '
+                             'from spread of results (only standard error is available, --nan is not supported)',
+                        action="store_true")
+    parser.add_argument('--checkpoint',
+                        help='save state of averaging next to output file and reuse it in next runs, '
+                             'so that only new input files are read',
+                        action="store_true")
+    parser.add_argument('--chunk-size',
+                        help='merge files of single estimator in parallel, in chunks of given size '
+                             '(default: 0, serial merging)',
+                        default=0,
+                        type=int)
     parser.add_argument('-a', '--nan', help='ignore NaN in averaging', action="store_true")
     parser.add_argument('-e', '--error',
                         help='type of error estimate to add (default: ' + ErrorEstimate.stderr.name + ')',
@@ -40,6 +81,31 @@ def add_default_options(parser):
                         choices=[x.name for x in ErrorEstimate],
                         type=str)
     parser.add_argument('-n', '--nscale', help='scale with number of primaries N.', default=1, type=float)
+    parser.add_argument('--mmap',
+                        help='memory-map data blocks of binary files instead of reading them into memory',
+                        action="store_true")
+
+
+def check_merging_options(args):
+    """
+    Converts error estimate option to ErrorEstimate and checks if merging options can be used together.
+    :param args: parsed options (see @add_merging_options)
+    :return: True if options are consistent, False otherwise (error is logged)
+    """
+    args.error = ErrorEstimate[args.error]
+
+    # weighted merging propagates standard errors of the mean stored in input files, NaNs are not handled
+    if args.weighted and (args.nan or args.error == ErrorEstimate.stddev):
+        logger.error("Option --weighted can't be used with --nan or --error " + ErrorEstimate.stddev.name)
+        return False
+    return True
+
+
+def add_logging_options(parser):
+    """
+    Adds verbosity and version options, shared by convertmc and dddbatch programs.
+    """
+    import pymchelper
     parser.add_argument('-v',
                         '--verbose',
                         action='count',
@@ -49,6 +115,29 @@ def add_default_options(parser):
     parser.add_argument('-V', '--version', action='version', version=pymchelper.__version__)
 
 
+def add_default_options(parser):
+    parser.add_argument('input', help='input filename, file list or pattern', type=str)
+    parser.add_argument('output', help='output filename or directory', nargs='?')
+    parser.add_argument('-j', '--jobs', help='number of parallel jobs to use (-1 means all CPUs)', default=-1, type=int)
+    parser.add_argument('--many', help='automatically merge data from various sources', action="store_true")
+    parser.add_argument('--index',
+                        help='keep index of file headers in each input directory, to avoid reading them again '
+                             'from unchanged files in next runs with --many option (only headers are cached, '
+                             'use --checkpoint to avoid reading data of already merged files)',
+                        action="store_true")
+    parser.add_argument('--formats',
+                        help='comma separated list of converters used to save merged data '
+                             '(i.e. txt,image,plotdata), data is read and merged only once '
+                             '(default: only the chosen converter, tripddd is allowed only with tripddd command)',
+                        type=str)
+    parser.add_argument('--write-jobs',
+                        help='number of parallel jobs saving data with many converters (default: 1, serial)',
+                        default=1,
+                        type=int)
+    add_merging_options(parser)
+    add_logging_options(parser)
+
+
 def main(args=sys.argv[1:]):
     import pymchelper
     import os
@@ -76,6 +165,15 @@ def main(args=sys.argv[1:]):
     parser_excel = subparsers.add_parser(Converters.excel.name, help='converts to MS Excel file')
     add_default_options(parser_excel)
 
+    parser_npz = subparsers.add_parser(Converters.npz.name, help='converts to compressed numpy .npz file')
+    add_default_options(parser_npz)
+
+    parser_hdf = subparsers.add_parser(Converters.hdf.name, help='converts to HDF5 file (requires h5py)')
+    add_default_options(parser_hdf)
+
+    parser_bdo = subparsers.add_parser(Converters.bdo.name, help='converts to SHIELD-HIT12A binary file')
+    add_default_options(parser_bdo)
+
     parser_plotdata = subparsers.add_parser(Converters.plotdata.name, help='converts to gnuplot data')
     add_default_options(parser_plotdata)
 
@@ -90,11 +188,7 @@ def main(args=sys.argv[1:]):
     parser_tripddd.add_argument("--energy",
                                 help='energy of the beam [MeV/amu]',
                                 type=float)
-    parser_tripddd.add_argument("--ngauss",
-                                help='number of Gauss curves to fit (default: 2)',
-                                choices=(0, 1, 2),
-                                default=2,
-                                type=int)
+    add_tripddd_options(parser_tripddd)
 
     parser.add_argument('-V', '--version', action='version', version=pymchelper.__version__)
 
@@ -114,17 +208,40 @@ def main(args=sys.argv[1:]):
         if not files:
             logger.error('File does not exist: ' + parsed_args.input)
 
-        parsed_args.error = ErrorEstimate[parsed_args.error]
+        if not check_merging_options(parsed_args):
+            return 1
+
+        if parsed_args.formats:
+            parsed_args.formats = [name.strip() for name in parsed_args.formats.split(",") if name.strip()]
+            unknown = [name for name in parsed_args.formats if name not in Converters.__members__]
+            if unknown:
+                logger.error("Unknown converter in --formats: " + ", ".join(unknown))
+                return 1
+            if Converters.tripddd.name in parsed_args.formats and parsed_args.command != Converters.tripddd.name:
+                # options of tripddd converter (i.e. --energy) are defined only for tripddd command
+                logger.error("Converter tripddd in --formats can be used only with tripddd command")
+                return 1
+        else:
+            parsed_args.formats = [parsed_args.command]
+
+        # bdo files are normalized when read, so scaling would be applied twice
+        if Converters.bdo.name in parsed_args.formats and parsed_args.nscale != 1:
+            logger.error("Option --nscale can't be used with bdo converter")
+            return 1
 
         # check required options for tripddd parser
-        if parsed_args.command == Converters.tripddd.name and not parsed_args.energy:
+        if Converters.tripddd.name in parsed_args.formats and not getattr(parsed_args, 'energy', None):
             logger.error("Option --energy is required, provide an energy value")
             return 1
 
-        if parsed_args.many:
-            merge_many(files, parsed_args.output, parsed_args, parsed_args.jobs)
-        else:
-            merge_list(files, parsed_args.output, parsed_args)
+        try:
+            if parsed_args.many:
+                merge_many(files, parsed_args.output, parsed_args, parsed_args.jobs)
+            else:
+                merge_list(files, parsed_args.output, parsed_args)
+        except IncompatibleFilesError as e:
+            logger.error(str(e))
+            return 1
 
     return 0
 
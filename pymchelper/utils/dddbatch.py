@@ -0,0 +1,169 @@
+"""
+Generates TRiP98 depth-dose (.ddd) files for many beam energies at once, i.e. for a whole beam model.
+Energy table maps each energy to a pattern of SHIELD-HIT12A DDD scorer files, simulated for that energy.
+All energies are merged and fitted in a single pool of worker processes.
+"""
+import copy
+import glob
+import logging
+import os
+import sys
+import argparse
+
+from pymchelper.detector import IncompatibleFilesError, check_compatibility, merge_data, read_page_headers
+from pymchelper.shieldhit.detector.detector_type import SHDetType
+
+logger = logging.getLogger(__name__)
+
+_summary_header = "# energy[MeV/amu] files primaries slices zmax[cm] peak[cm] ddd_file\n"
+
+
+def read_energy_table(filename):
+    """
+    Reads table mapping beam energies to input files. Each line holds energy in MeV/amu followed by
+    input file name or pattern (i.e. ``150.0 run150/ddd_*.bdo``). Empty lines and lines starting with # are skipped.
+    :param filename: name of file with energy table
+    :return: list of (energy, pattern) tuples
+    """
+    table = []
+    with open(filename) as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            items = line.split(None, 1)
+            if len(items) != 2:
+                raise ValueError("Line {:d} of {:s} should contain energy and input files".format(line_no, filename))
+            table.append((float(items[0]), items[1].strip()))
+    return table
+
+
+def ddd_output_file(outputdir, energy_MeV):
+    """
+    Name of .ddd file generated for given energy, without extension.
+    """
+    return os.path.join(outputdir, "ddd_{:g}MeV".format(energy_MeV))
+
+
+def process_energy(energy_MeV, pattern, outputdir, options):
+    """
+    Merges input files simulated for single beam energy and writes .ddd file with fitted lateral profiles.
+    :param energy_MeV: beam energy in MeV/amu
+    :param pattern: input file name or pattern
+    :param outputdir: output directory
+    :param options: parsed options, as for tripddd converter
+    :return: summary row (energy, number of files, primaries, depth slices, maximum depth, Bragg peak position,
+             name of .ddd file) or None if .ddd file couldn't be generated
+    """
+    from pymchelper.writers.trip98 import TripDddWriter
+
+    files = sorted(glob.glob(pattern))
+    if not files:
+        logger.error("No input files for energy {:g} MeV/amu: {:s}".format(energy_MeV, pattern))
+        return None
+    if len(files) > 1:
+        try:
+            check_compatibility(files, [read_page_headers(filename) for filename in files])
+        except IncompatibleFilesError as e:
+            logger.error(str(e))
+            return None
+
+    output_file = ddd_output_file(outputdir, energy_MeV)
+    detector = merge_data(files, output_file, options)
+    if detector.dettyp != SHDetType.ddd:
+        logger.error("Files for energy {:g} MeV/amu do not contain DDD scorer: {:s}".format(energy_MeV, pattern))
+        return None
+
+    writer_options = copy.copy(options)
+    writer_options.energy = energy_MeV
+    writer = TripDddWriter(output_file, writer_options)
+    try:
+        writer.write(detector)
+    except (RuntimeError, ValueError) as e:  # i.e. lateral profile fit not converging
+        logger.error("Fitting failed for energy {:g} MeV/amu: {:s}".format(energy_MeV, str(e)))
+        return None
+    summary = writer.fit_summary
+    if writer.plot_thread is not None:
+        # worker may be reused for next energy or shut down only once plots are saved
+        writer.plot_thread.join()
+    return (energy_MeV, len(files), detector.nstat, summary.nslices, summary.zmax_cm, summary.peak_cm,
+            writer.ddd_filename)
+
+
+def process_table(table, outputdir, options, jobs):
+    """
+    Generates .ddd files for all energies from the table, in parallel (one energy per worker).
+    :param table: list of (energy, pattern) tuples, as returned by @read_energy_table
+    :param outputdir: output directory
+    :param options: parsed options, as for tripddd converter
+    :param jobs: number of CPU cores to use (-1 means all)
+    :return: list of summary rows (see @process_energy), ordered as the table
+    """
+    try:
+        from joblib import Parallel, delayed
+        return Parallel(n_jobs=jobs)(delayed(process_energy)(energy_MeV, pattern, outputdir, options)
+                                     for energy_MeV, pattern in table)
+    except (ImportError, SyntaxError):
+        # single-cpu implementation, in case joblib library fails (i.e. Python 3.2)
+        return [process_energy(energy_MeV, pattern, outputdir, options) for energy_MeV, pattern in table]
+
+
+def write_summary(filename, rows):
+    """
+    Saves summary table, one line for each generated .ddd file.
+    """
+    logger.info("Writing: " + filename)
+    with open(filename, 'w') as f:
+        f.write(_summary_header)
+        for energy_MeV, nfiles, nstat, nslices, zmax_cm, peak_cm, ddd_filename in rows:
+            f.write("{:g} {:d} {:d} {:d} {:g} {:g} {:s}\n".format(
+                energy_MeV, nfiles, nstat, nslices, zmax_cm, peak_cm, os.path.basename(ddd_filename)))
+
+
+def main(args=sys.argv[1:]):
+    """ Main function of the dddbatch script.
+    """
+    from pymchelper.run import (set_logger_level, add_tripddd_options, add_merging_options, add_logging_options,
+                                check_merging_options)
+
+    parser = argparse.ArgumentParser(description='Generates TRiP98 .ddd files for many beam energies at once.')
+    parser.add_argument('table',
+                        help='text file with beam energies [MeV/amu] and corresponding input file patterns, '
+                             'one energy per line',
+                        type=str)
+    parser.add_argument('outputdir', help='output directory (default: current directory)', nargs='?', default='.')
+    parser.add_argument('-j', '--jobs', help='number of parallel jobs to use (-1 means all CPUs)', default=-1, type=int)
+    add_tripddd_options(parser)
+    parser.add_argument("--summary",
+                        help='name of summary table, saved in output directory (default: ddd_summary.txt)',
+                        default='ddd_summary.txt',
+                        type=str)
+    add_merging_options(parser)
+    add_logging_options(parser)
+    parsed_args = parser.parse_args(args)
+
+    set_logger_level(parsed_args)
+
+    if not check_merging_options(parsed_args):
+        return 1
+
+    table = read_energy_table(parsed_args.table)
+    if not table:
+        logger.error("No energies found in " + parsed_args.table)
+        return 1
+
+    if not os.path.exists(parsed_args.outputdir):
+        os.makedirs(parsed_args.outputdir)
+
+    results = process_table(table, parsed_args.outputdir, parsed_args, parsed_args.jobs)
+    rows = [row for row in results if row is not None]
+    write_summary(os.path.join(parsed_args.outputdir, parsed_args.summary), rows)
+
+    if len(rows) < len(table):
+        logger.error("{:d} of {:d} .ddd files couldn't be generated".format(len(table) - len(rows), len(table)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,102 @@
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# header information saved together with data, as scalars
+header_fields = ('nstat', 'counter', 'geotyp', 'dettyp', 'particle')
+
+
+def axis_edges(detector):
+    """
+    Bin edges along X, Y and Z axes of the detector.
+    :param detector: detector to inspect
+    :return: list of three arrays, holding n+1 edges each
+    """
+    return [np.linspace(detector.xmin, detector.xmax, detector.nx + 1),
+            np.linspace(detector.ymin, detector.ymax, detector.ny + 1),
+            np.linspace(detector.zmin, detector.zmax, detector.nz + 1)]
+
+
+def _detector_arrays(detector):
+    """
+    Data and error arrays shaped as 3-D mesh (nz, ny, nx), X being fastest changing index.
+    Arrays are reshaped without copying.
+    """
+    shape = (detector.nz, detector.ny, detector.nx)
+    arrays = {'data': np.reshape(detector.data, shape)}
+    if detector.error is not None:
+        arrays['error'] = np.reshape(detector.error, shape)
+    return arrays
+
+
+def _units(detector):
+    return np.array([str(unit).encode('utf-8') for unit in getattr(detector, 'units', [])], dtype=bytes)
+
+
+def _title(detector):
+    return str(getattr(detector, 'title', '')).encode('utf-8')
+
+
+class NpzWriter:
+    """
+    Saves data, error, bin edges, units and header information in compressed numpy .npz file.
+    No additional dependencies are needed, see HdfWriter for chunked HDF5 output.
+    """
+    def __init__(self, filename, options):
+        self.filename = filename
+        if not self.filename.endswith(".npz"):
+            self.filename += ".npz"
+
+    def write(self, detector):
+        arrays = _detector_arrays(detector)
+        for name, edges in zip(('x_edges', 'y_edges', 'z_edges'), axis_edges(detector)):
+            arrays[name] = edges
+        for name in header_fields:
+            arrays[name] = np.array(int(getattr(detector, name)))
+        arrays['units'] = _units(detector)
+        arrays['title'] = np.array(_title(detector))
+
+        logger.info("Writing: " + self.filename)
+        np.savez_compressed(self.filename, **arrays)
+
+
+class HdfWriter:
+    """
+    Saves data, error, bin edges, units and header information in HDF5 file (needs h5py package).
+    Data and error are stored as chunked, compressed datasets of shape (nz, ny, nx),
+    written slab by slab along Z axis.
+    """
+    compression = "gzip"
+    chunk_bytes = 1024 * 1024  # approximate size of single chunk
+
+    def __init__(self, filename, options):
+        self.filename = filename
+        if not self.filename.endswith(".h5"):
+            self.filename += ".h5"
+
+    def write(self, detector):
+        try:
+            import h5py
+        except ImportError as e:
+            logger.error("Generating HDF5 files requires h5py package, use npz converter instead.")
+            raise e
+
+        arrays = _detector_arrays(detector)
+        nz, ny, nx = arrays['data'].shape
+        slab = max(1, min(nz, self.chunk_bytes // (8 * nx * ny)))
+
+        logger.info("Writing: " + self.filename)
+        with h5py.File(self.filename, "w") as f:
+            for name, array in arrays.items():
+                dset = f.create_dataset(name, shape=array.shape, dtype=array.dtype,
+                                        chunks=(slab, ny, nx), compression=self.compression, shuffle=True)
+                for z in range(0, nz, slab):
+                    dset[z:z + slab] = array[z:z + slab]
+            for name, edges in zip(('x_edges', 'y_edges', 'z_edges'), axis_edges(detector)):
+                f.create_dataset(name, data=edges)
+            for name in header_fields:
+                f.attrs[name] = int(getattr(detector, name))
+            f.attrs['units'] = _units(detector)
+            f.attrs['title'] = np.bytes_(_title(detector))
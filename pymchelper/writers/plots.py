@@ -25,7 +25,7 @@ class PlotDataWriter:
             if np.any(error):
                 error *= np.float64(0.1)  # 1 MeV / cm = 0.1 keV / um
 
-        axis_data_column = [list(detector.axis_values(i, plotting_order=True)) for i in range(detector.dimension)]
+        axis_data_column = [detector.axis_values(i, plotting_order=True) for i in range(detector.dimension)]
 
         fmt = "%g" + " %g" * detector.dimension
         data_to_save = axis_data_column + [data.ravel()]  # ravel needed to change arrays like [[1]] to [1]
@@ -123,7 +123,7 @@ class ImageWriter:
         self.plot_filename = filename
         if not self.plot_filename.endswith(".png"):
             self.plot_filename += ".png"
-        self.colormap = options.colormap
+        self.colormap = getattr(options, 'colormap', self.default_colormap)
 
     default_colormap = 'gnuplot2'
 
@@ -168,7 +168,7 @@ class ImageWriter:
         x_axis_number = detector.axis_data(0, plotting_order=True).number
         x_axis_name = detector.units[6+x_axis_number]
         plt.xlabel(self._make_label(detector.units[x_axis_number], x_axis_name))
-        xlist = list(detector.axis_values(0, plotting_order=True))  # make list of values from generator
+        xlist = detector.axis_values(0, plotting_order=True)
 
         # 1-D plotting
         if detector.dimension == 1:
@@ -182,14 +182,14 @@ class ImageWriter:
             plt.ylabel(self._make_label(detector.units[4], detector.title))
             plt.plot(xlist, data)
         elif detector.dimension == 2:
-            ylist = list(detector.axis_values(1, plotting_order=True))   # make list of values from generator
+            ylist = detector.axis_values(1, plotting_order=True)
 
             xn = detector.axis_data(0, plotting_order=True).n
             yn = detector.axis_data(1, plotting_order=True).n
 
             shape_tuple = (yn, xn)
-            xlist = np.asarray(xlist).reshape(shape_tuple)
-            ylist = np.asarray(ylist).reshape(shape_tuple)
+            xlist = xlist.reshape(shape_tuple)
+            ylist = ylist.reshape(shape_tuple)
             zlist = data.reshape(shape_tuple)
 
             # add error plot if error data present
@@ -1,7 +1,10 @@
 import logging
+import struct
+from email.utils import formatdate
 
 import numpy as np
 
+from pymchelper.readers.shieldhit import SHBDOTagID, not_normalized_dettypes
 from pymchelper.shieldhit.detector.detector_type import SHDetType
 from pymchelper.shieldhit.detector.estimator_type import SHGeoType
 
@@ -9,12 +12,92 @@ logger = logging.getLogger(__name__)
 
 
 class SHBinaryWriter:
+    """
+    Writes binary file in SHIELD-HIT12A 0.6 format (stream of tokens), readable by SHBinaryReader.
+    All pages of multi-page detector are saved in single file.
+    Data is saved as in files produced by SHIELD-HIT12A, that is not normalized by number of primaries,
+    so that it is normalized again when file is read. Errors and number of merged files are not saved,
+    format has no place for them. Data scaled by user (nscale option) can't be saved, as the scaling
+    changes detector type and units, and would be applied again when file is read.
+    """
+    pages_supported = True
+
+    # file starts with magic number, endianness and version string
+    _magic = struct.Struct('<6s2s16s')
+
+    # each token starts with tag: payload id, payload dtype string and payload number of elements
+    _tag = struct.Struct('<Q8sQ')
+
     def __init__(self, filename, options):
-        self.filename = filename
+        if getattr(options, 'nscale', 1) != 1:
+            raise ValueError("Data scaled with number of primaries (nscale option) can't be saved in .bdo file")
+        self.filename = self.output_filename(filename)
+
+    @staticmethod
+    def output_filename(filename):
+        """
+        Name of file saved by the writer, ``.bdo`` extension is added if missing.
+        """
+        if not filename.endswith(".bdo"):
+            filename += ".bdo"
+        return filename
 
     def write(self, detector):
-        # TODO
-        pass
+        if detector.counter > 1 or (detector.error is not None and np.any(detector.error)):
+            logger.warning("Errors and number of merged files are not saved in {:s}, "
+                           "use --weighted option when merging it again with other files".format(self.filename))
+        logger.info("Writing: " + self.filename)
+        with open(self.filename, "wb") as f:
+            f.write(self._magic.pack(b'xSH12A', b'II', b'0.6'))
+
+            self._write_string(f, SHBDOTagID.shversion, getattr(detector, 'mc_code_version', ''))
+            self._write_string(f, SHBDOTagID.filedate, formatdate(localtime=True))
+            self._write_token(f, SHBDOTagID.rt_nstat, '<i8', [detector.nstat])
+            self._write_string(f, SHBDOTagID.est_geotyp, detector.geotyp.name.upper())
+            self._write_token(f, SHBDOTagID.est_pages, '<i4', [detector.pages])
+
+            for page_no in range(detector.pages):
+                self._write_page(f, detector.page(page_no))
+
+    def _write_page(self, f, page):
+        nbin = [page.nx, page.ny, page.nz]
+        start = [page.xmin, page.ymin, page.zmin]
+        stop = [page.xmax, page.ymax, page.zmax]
+
+        self._write_token(f, SHBDOTagID.det_dtype, '<i4', [int(page.dettyp)])
+        self._write_token(f, SHBDOTagID.det_part, '<i4', [page.particle])
+
+        # reader puts differential binning on one of X, Y or Z axes, here it is moved back to det_dif_* tags
+        if hasattr(page, 'dif_axis'):
+            self._write_token(f, SHBDOTagID.det_nbine, '<i4', [nbin[page.dif_axis]])
+            self._write_token(f, SHBDOTagID.det_dif_start, '<f8', [start[page.dif_axis]])
+            self._write_token(f, SHBDOTagID.det_dif_stop, '<f8', [stop[page.dif_axis]])
+            self._write_token(f, SHBDOTagID.det_difftype, '<i4', [getattr(page, 'dif_type', 0)])
+            nbin[page.dif_axis] = 1
+
+        if page.geotyp in (SHGeoType.zone, SHGeoType.dzone):
+            self._write_token(f, SHBDOTagID.det_zonestart, '<i4', [int(page.xmin)])
+
+        self._write_token(f, SHBDOTagID.det_nbin, '<i4', nbin)
+        self._write_token(f, SHBDOTagID.det_xyz_start, '<f8', start)
+        self._write_token(f, SHBDOTagID.det_xyz_stop, '<f8', stop)
+
+        data = np.ravel(page.data)
+        if page.dettyp not in not_normalized_dettypes and page.nstat != 0:
+            data = data * np.float64(page.nstat)
+        self._write_token(f, SHBDOTagID.det_data, '<f8', data)
+
+    def _write_token(self, f, pl_id, pl_type, payload):
+        """
+        Writes tag and payload, numpy array payload is written directly from its buffer.
+        """
+        payload = np.ascontiguousarray(payload, dtype=pl_type)
+        f.write(self._tag.pack(int(pl_id), pl_type.encode('ASCII'), payload.size))
+        payload.tofile(f)
+
+    def _write_string(self, f, pl_id, value):
+        value = value.encode('ASCII')
+        self._write_token(f, pl_id, 'S{:d}'.format(max(len(value), 1)), [value])
 
 
 class TxtWriter:
@@ -103,8 +186,11 @@ class TxtWriter:
 
         return header
 
+    # number of lines formatted and written at once
+    chunk_size = 100000
+
     def write(self, det):
-        from pymchelper.fortranformatter import format_e
+        from pymchelper.fortranformatter import format_e_array
 
         self.ax = self._axis_name(det.geotyp, 0)
         self.ay = self._axis_name(det.geotyp, 1)
@@ -123,29 +209,29 @@ class TxtWriter:
                 det.dettyp in (SHDetType.fluence, SHDetType.avg_energy, SHDetType.avg_beta, SHDetType.energy):
             header = ""
 
+        data = np.ravel(det.data)
+        if det.geotyp in (SHGeoType.zone, SHGeoType.dzone):
+            x = np.zeros_like(det.x)
+        else:
+            x = det.x
+        columns = [(x, 14, 7), (det.y, 14, 7), (det.z, 14, 7), (data, 23, 16)]
+        if det.error is not None:
+            columns.append((np.ravel(det.error), 23, 16))
+
         # dump data
         with open(self.filename, 'w') as fout:
             logger.info("Writing: " + self.filename)
             fout.write(header)
 
-            det_error = det.error
-            if det_error is None:
-                det_error = [None] * len(det.data)
-            for x, y, z, v, e in zip(det.x, det.y, det.z, det.data, det_error):
-                if det.geotyp in (SHGeoType.zone, SHGeoType.dzone):
-                    x = 0.0
-                else:
-                    x = float('nan') if np.isnan(x) else x
-                y = float('nan') if np.isnan(y) else y
-                z = float('nan') if np.isnan(z) else z
-                v = float('nan') if np.isnan(v) else v
-                tmp = format_e(14, 7, x) + " " + format_e(14, 7, y) + " " + \
-                    format_e(14, 7, z) + " " + format_e(23, 16, v)
-
-                if e is not None:
-                    e = float('nan') if np.isnan(e) else e
-                    tmp += " " + format_e(23, 16, e)
-
-                tmp += "\n"
-
-                fout.write(tmp)
+            for start in range(0, data.size, self.chunk_size):
+                stop = min(start + self.chunk_size, data.size)
+
+                # each line is composed of formatted columns separated by spaces, as array of characters
+                line_parts = []
+                for values, w, d in columns:
+                    formatted = format_e_array(w, d, values[start:stop])
+                    line_parts.append(formatted.view(np.uint8).reshape(stop - start, w))
+                    line_parts.append(np.full((stop - start, 1), ord(' '), dtype=np.uint8))
+                line_parts[-1] = np.full((stop - start, 1), ord('\n'), dtype=np.uint8)
+
+                fout.write(np.hstack(line_parts).tobytes().decode('ascii'))
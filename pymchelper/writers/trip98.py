@@ -1,10 +1,20 @@
 import time
 import logging
 import os
+import threading
+from collections import namedtuple
+
 import numpy as np
 
 logger = logging.getLogger(__name__)
 
+# pyplot keeps global state, plots of many writers (i.e. rendered in background threads) are made one at a time
+_plot_lock = threading.Lock()
+
+
+# summary of .ddd file: number of depth slices, depth of last slice and Bragg peak position
+DddFitSummary = namedtuple('DddFitSummary', ['nslices', 'zmax_cm', 'peak_cm'])
+
 
 class TripCubeWriter:
     def __init__(self, filename, options):
@@ -110,14 +120,26 @@ class TripDddWriter(object):
 !ddd
 """
 
-    def __init__(self, filename, options):
+    # diagnostic plots modes: not made, made after writing .ddd file or made by background thread.
+    # Background mode is a best-effort overlap of plotting with the rest of the program: pyplot is not thread-safe,
+    # so plots of all writers are serialized by a lock and rendering still competes with the main thread for the GIL
+    plot_modes = ('none', 'inline', 'background')
 
-        import matplotlib
-        matplotlib.use('Agg')
+    def __init__(self, filename, options):
         self.ddd_filename = filename
         self.energy_MeV = options.energy
         self.ngauss = options.ngauss
         self.verbosity = options.verbose
+        # by default plots are made only in verbose mode
+        self.plots = getattr(options, 'plots', None) or ('inline' if self.verbosity > 0 else 'none')
+        if self.plots not in self.plot_modes:
+            raise ValueError("Unknown plots mode: {:s}, expected one of: {:s}".format(
+                self.plots, ", ".join(self.plot_modes)))
+        self.plot_thread = None
+        # set by write method to DddFitSummary of generated .ddd file
+        self.fit_summary = None
+        self.fit_jobs = getattr(options, 'fit_jobs', 1)
+        self.warm_start = getattr(options, 'warm_start', False)
         if not self.ddd_filename.endswith(".ddd"):
             self.ddd_filename += ".ddd"
         self.outputdir = os.path.abspath(os.path.dirname(self.ddd_filename))
@@ -139,20 +161,9 @@ class TripDddWriter(object):
             thr_ind = cum_dose_left.size - np.searchsorted(cum_dose_left[::-1], threshold) - 1
             z_fitting_cm_1d = self.z_data_cm_1d[:thr_ind]
             dose_fitting_MeV_g_1d = self.dose_data_MeV_g_1d[:thr_ind]
-
-            r_fitting_cm_2d, z_fitting_cm_2d = np.meshgrid(self.r_data_cm_1d, z_fitting_cm_1d)
-            dose_fitting_MeV_g_2d = self.dose_data_MeV_g_2d[0:thr_ind]
-
-            logger.info("Plotting 1..")
-            if self.verbosity > 0:
-                self._pre_fitting_plots(
-                    cum_dose_left=cum_dose_left,
-                    z_fitting_cm_1d=z_fitting_cm_1d,
-                    dose_fitting_MeV_g_1d=dose_fitting_MeV_g_1d,
-                    threshold=threshold,
-                    zmax_cm=z_fitting_cm_1d[-1])
-
-                self._plot_2d_map(z_fitting_cm_2d, r_fitting_cm_2d, dose_fitting_MeV_g_2d, z_fitting_cm_1d)
+            self.fit_summary = DddFitSummary(nslices=z_fitting_cm_1d.size,
+                                             zmax_cm=z_fitting_cm_1d[-1],
+                                             peak_cm=z_fitting_cm_1d[np.argmax(dose_fitting_MeV_g_1d)])
 
             logger.info("Fitting...")
             fwhm1_cm_data = np.zeros_like(z_fitting_cm_1d)
@@ -165,20 +176,7 @@ class TripDddWriter(object):
             dz0_MeV_cm_g_error_data = np.zeros_like(z_fitting_cm_1d)
             if self.ngauss in (1, 2):
                 # for each depth fit a lateral beam with gaussian models
-                for ind, z_cm in enumerate(z_fitting_cm_1d):
-
-                    dose_at_z = self.dose_data_MeV_g_2d[ind]
-
-                    # take into account only this position in r for which dose is positive
-                    r_fitting_cm = self.r_data_cm_1d[dose_at_z > 0]
-                    dose_fitting_1d_positive_MeV_g = dose_at_z[dose_at_z > 0]
-
-                    # perform the fit
-                    params, params_error = self._lateral_fit(r_fitting_cm,
-                                                             dose_fitting_1d_positive_MeV_g,
-                                                             z_cm,
-                                                             self.energy_MeV,
-                                                             self.ngauss)
+                for ind, (params, params_error) in enumerate(self._lateral_fits(z_fitting_cm_1d)):
 
                     fwhm1_cm, factor, fwhm2_cm, dz0_MeV_cm_g = params
                     fwhm1_cm_error, factor_error, fwhm2_cm_error, dz0_MeV_cm_g_error = params_error
@@ -192,29 +190,6 @@ class TripDddWriter(object):
                         fwhm2_cm_error_data[ind] = fwhm2_cm_error
                         weight_error_data[ind] = factor_error
 
-            logger.info("Plotting 2...")
-            if self.verbosity > 0 and self.ngauss in (1, 2):
-                self._post_fitting_plots(z_fitting_cm_1d,
-                                         dose_fitting_MeV_g_1d,
-                                         dz0_MeV_cm_g_data,
-                                         fwhm1_cm_data,
-                                         fwhm2_cm_data,
-                                         weight_data,
-                                         dz0_MeV_cm_g_error_data,
-                                         fwhm1_cm_error_data,
-                                         weight_error_data,
-                                         fwhm2_cm_error_data)
-                self._plot_2d_map(
-                    z_fitting_cm_2d,
-                    r_fitting_cm_2d,
-                    dose_fitting_MeV_g_2d,
-                    z_fitting_cm_1d,
-                    fwhm1_cm_data,
-                    fwhm2_cm_data,
-                    weight_data,
-                    dz0_MeV_cm_g_data,
-                    suffix='_fwhm')
-
             logger.info("Writing " + self.ddd_filename)
 
             # prepare header of DDD file
@@ -242,35 +217,113 @@ class TripDddWriter(object):
                     for z_cm, dose in zip(z_fitting_cm_1d, dose_fitting_MeV_g_1d):
                         ddd_file.write('{:g} {:g}\n'.format(z_cm, dose))
 
-    def _extract_data(self, detector):
-        # 2D arrays of r,z and dose
-        self.r_data_cm_2d = np.array(list(detector.x)).reshape(detector.nz, detector.nx)
-        self.z_data_cm_2d = np.array(list(detector.z)).reshape(detector.nz, detector.nx)
-        self.dose_data_MeV_g_2d = np.array(detector.v).reshape(detector.nz, detector.nx)
+            # plots are made once .ddd file is ready, fitting itself doesn't need matplotlib
+            plot_args = (cum_dose_left, threshold, z_fitting_cm_1d, dose_fitting_MeV_g_1d,
+                         (dz0_MeV_cm_g_data, fwhm1_cm_data, fwhm2_cm_data, weight_data),
+                         (dz0_MeV_cm_g_error_data, fwhm1_cm_error_data, weight_error_data, fwhm2_cm_error_data))
+            if self.plots == 'inline':
+                self._plots(*plot_args)
+            elif self.plots == 'background':
+                # non-daemon thread, program waits for the plots to be saved before exiting
+                # plotting is best-effort concurrent only (see plot_modes), worker processes can't be used here
+                # as the writer may itself run in a joblib worker (i.e. in dddbatch)
+                self.plot_thread = threading.Thread(target=self._plots, args=plot_args)
+                self.plot_thread.start()
+
+    def _plots(self, cum_dose_left, threshold, z_fitting_cm_1d, dose_fitting_MeV_g_1d, fit_data, fit_error):
+        """
+        Saves diagnostic plots: cumulative dose, depth-dose profile, 2D dose map and fitted parameters.
+        :param fit_data: tuple of arrays with dz0, fwhm1, fwhm2 and weight for each depth
+        :param fit_error: tuple of arrays with errors of dz0, fwhm1, weight and fwhm2
+        """
+        nslices = z_fitting_cm_1d.size
+        r_fitting_cm_2d, z_fitting_cm_2d = np.meshgrid(self.r_data_cm_1d, z_fitting_cm_1d)
+        dose_fitting_MeV_g_2d = self.dose_data_MeV_g_2d[:nslices]
+        dz0_MeV_cm_g_data, fwhm1_cm_data, fwhm2_cm_data, weight_data = fit_data
+
+        with _plot_lock:
+            # non-interactive backend, plots are only saved to files (also from threads other than main one)
+            import matplotlib
+            matplotlib.use('Agg')
+
+            logger.info("Plotting 1..")
+            self._pre_fitting_plots(
+                cum_dose_left=cum_dose_left,
+                z_fitting_cm_1d=z_fitting_cm_1d,
+                dose_fitting_MeV_g_1d=dose_fitting_MeV_g_1d,
+                threshold=threshold,
+                zmax_cm=z_fitting_cm_1d[-1])
 
-        self.dose_error_MeV_g_2d = np.array(detector.error).reshape(detector.nz, detector.nx)
+            self._plot_2d_map(z_fitting_cm_2d, r_fitting_cm_2d, dose_fitting_MeV_g_2d, z_fitting_cm_1d)
+
+            logger.info("Plotting 2...")
+            if self.ngauss in (1, 2):
+                self._post_fitting_plots(z_fitting_cm_1d, dose_fitting_MeV_g_1d, *(fit_data + fit_error))
+                self._plot_2d_map(
+                    z_fitting_cm_2d,
+                    r_fitting_cm_2d,
+                    dose_fitting_MeV_g_2d,
+                    z_fitting_cm_1d,
+                    fwhm1_cm_data,
+                    fwhm2_cm_data,
+                    weight_data,
+                    dz0_MeV_cm_g_data,
+                    suffix='_fwhm')
 
-        # 1D arrays of r,z and dose in the very central bin
-        self.r_data_cm_1d = self.r_data_cm_2d[0]  # middle points of the bins
-        self.z_data_cm_1d = np.asarray(list(detector.z)[0:detector.nz * detector.nx:detector.nx])
+    def _lateral_fits(self, z_fitting_cm_1d):
+        """
+        Fits lateral profiles at all depths, serially or in parallel if self.fit_jobs is not 1.
+        In parallel mode depth range is split into contiguous blocks of slices, each fitted in separate worker.
+        With warm start, first slice of each block is fitted from scratch and following ones are seeded
+        with the result of the previous slice. Blocks have then fixed length (self.warm_chain_length),
+        both in serial and parallel mode, so results don't depend on number of jobs.
+        :return: list of (params, params_error) tuples, ordered by depth
+        """
+        nslices = z_fitting_cm_1d.size
+        dose_fitting_MeV_g_2d = self.dose_data_MeV_g_2d[:nslices]
+        if self.warm_start:
+            blocks = [(start, min(start + self.warm_chain_length, nslices))
+                      for start in range(0, nslices, self.warm_chain_length)]
+        else:
+            blocks = [(0, nslices)]
+
+        def fit_block(block, fit_function=_fit_slices):
+            start, stop = block
+            return fit_function(self.r_data_cm_1d, dose_fitting_MeV_g_2d[start:stop], z_fitting_cm_1d[start:stop],
+                                self.energy_MeV, self.ngauss, self.warm_start)
+
+        if self.fit_jobs == 1 or nslices < 2:
+            return [result for block in blocks for result in fit_block(block)]
+
+        try:
+            from joblib import Parallel, delayed, effective_n_jobs
+            if not self.warm_start:
+                # few blocks per worker, to balance the load
+                splits = np.array_split(np.arange(nslices), min(nslices, 4 * effective_n_jobs(self.fit_jobs)))
+                blocks = [(split[0], split[-1] + 1) for split in splits]
+            logger.debug("Fitting {:d} slices in {:d} blocks".format(nslices, len(blocks)))
+            partials = Parallel(n_jobs=self.fit_jobs)(fit_block(block, delayed(_fit_slices)) for block in blocks)
+        except (ImportError, SyntaxError):
+            # single-cpu implementation, in case joblib library fails (i.e. Python 3.2)
+            partials = [fit_block(block) for block in blocks]
+        return [result for partial in partials for result in partial]
 
-        # np.savez("data", r2d=self.r_data_cm_2d, z2d=self.z_data_cm_2d, d2d=self.dose_data_MeV_g_2d,
-        #          r1d=self.r_data_cm_1d, z1d=self.z_data_cm_1d, e2d=self.dose_error_MeV_g_2d)
+    def _extract_data(self, detector):
+        # 2D views of dose and its error, shaped (z, r), data buffer is not copied
+        self.dose_data_MeV_g_2d = np.reshape(detector.data, (detector.nz, detector.nx))
+        if detector.error is not None:
+            self.dose_error_MeV_g_2d = np.reshape(detector.error, (detector.nz, detector.nx))
 
-        bin_depth_z_cm = self.z_data_cm_1d[1] - self.z_data_cm_1d[0]
-        r_step_cm = self.r_data_cm_1d[1] - self.r_data_cm_1d[0]
+        # 1D arrays of r,z (middle points of the bins)
+        self.r_data_cm_1d = detector.bin_centers(0)
+        self.z_data_cm_1d = detector.bin_centers(2)
 
-        # i-th bin volume = dz * pi * (r_i_max^2 - r_i_min^2  )
-        #   r_i_max = r_i + dr / 2
-        #   r_i_min = r_i - dr / 2
-        #  r_i_max^2 - r_i_min^2 = (r_i_max - r_i_min)*(r_i_max + r_i_min) = dr * 2 * r_i    thus
-        # i-th bin volume = 2 * pi * dr * r_i * dz
-        bin_volume_data_cm3_1d = 2.0 * np.pi * r_step_cm * self.r_data_cm_1d * bin_depth_z_cm
+        # energy deposited in each depth slice divided by its mass gives depth-dose profile
+        # i-th bin volume = dz * pi * (r_i_max^2 - r_i_min^2), see Detector.cylindrical_bin_volumes
         # we assume density of 1 g/c3
         density_g_cm3 = 1.0
-        total_bin_mass_g = density_g_cm3 * bin_depth_z_cm * np.pi * (self.r_data_cm_1d[-1] + r_step_cm/2.0)**2
-        energy_in_bin_MeV_2d = self.dose_data_MeV_g_2d * bin_volume_data_cm3_1d * density_g_cm3
-        total_energy_at_depth_MeV_1d = np.sum(energy_in_bin_MeV_2d, axis=1)
+        total_bin_mass_g = density_g_cm3 * detector.ny * np.sum(detector.cylindrical_bin_volumes())
+        total_energy_at_depth_MeV_1d = density_g_cm3 * detector.radial_integral()
         self.dose_data_MeV_g_1d = total_energy_at_depth_MeV_1d / total_bin_mass_g
 
     def _cumulative_dose(self):
@@ -294,8 +347,6 @@ class TripDddWriter(object):
                      weight=None,
                      dz0_MeV_cm_g_data=None,
                      suffix=''):
-        import matplotlib
-        matplotlib.use('Agg')
         import matplotlib.pyplot as plt
         from matplotlib.colors import LogNorm
 
@@ -334,9 +385,9 @@ class TripDddWriter(object):
             sigma1_cm = fwhm1_cm / 2.354820045
             sigma2_cm = fwhm2_cm / 2.354820045
             gauss_amplitude_MeV_g = dz0_MeV_cm_g_data
-            for z_cm, sigma1_at_z_cm, sigma2_at_z_cm, factor, amplitude_MeV_g in \
-                    zip(z_fitting_cm_1d, sigma1_cm, sigma2_cm, weight, gauss_amplitude_MeV_g):
-                dose_mc_MeV_g = self.dose_data_MeV_g_2d[self.z_data_cm_2d == z_cm]
+            for ind, (z_cm, sigma1_at_z_cm, sigma2_at_z_cm, factor, amplitude_MeV_g) in \
+                    enumerate(zip(z_fitting_cm_1d, sigma1_cm, sigma2_cm, weight, gauss_amplitude_MeV_g)):
+                dose_mc_MeV_g = self.dose_data_MeV_g_2d[ind]
                 title = "Z = {:4.3f} cm,  sigma1 = {:4.3f} cm".format(z_cm, sigma1_at_z_cm)
                 plt.plot(self.r_data_cm_1d, dose_mc_MeV_g, 'k.', label="data")
                 if self.ngauss == 1:
@@ -397,8 +448,6 @@ class TripDddWriter(object):
                 plt.close()
 
     def _pre_fitting_plots(self, cum_dose_left, z_fitting_cm_1d, dose_fitting_MeV_g_1d, threshold, zmax_cm):
-        import matplotlib
-        matplotlib.use('Agg')
         import matplotlib.pyplot as plt
         prefix = os.path.join(self.outputdir, 'ddd_{:3.1f}MeV_'.format(self.energy_MeV))
 
@@ -633,7 +682,12 @@ class TripDddWriter(object):
         return cls.gauss2_MeV_g(x_cm, amp_MeV_cm_g, sigma1_cm, weight, sigma2_add_cm) * x_cm
 
     @classmethod
-    def _lateral_fit(cls, r_cm, dose_MeV_g, z_cm, energy_MeV, ngauss=2):
+    def _cold_start(cls, r_cm, dose_MeV_g, ngauss=2):
+        """
+        Starting point and bounds of the fit, derived from weighted variance of the lateral profile.
+        :return: starting parameters (amplitude, sigma and for 2 gauss model weight and sigma2 addition)
+                 and tuple of lower and upper bounds
+        """
         variance = np.average(r_cm ** 2, weights=dose_MeV_g)
 
         starting_amp_MeV_g = dose_MeV_g.max()
@@ -645,18 +699,75 @@ class TripDddWriter(object):
         max_amp_MeV_g = 2.0 * dose_MeV_g.max()
         max_sigma_cm = 1e4 * starting_sigma_cm
 
+        if ngauss == 1:
+            return [starting_amp_MeV_g, starting_sigma_cm], \
+                ([min_amp_MeV_g, min_sigma_cm], [max_amp_MeV_g, max_sigma_cm])
+
+        starting_weigth = 0.99
+        starting_sigma2_add_cm = 0.1
+
+        min_weigth = 0.55
+        min_sigma2_add_cm = 1e-1
+
+        max_weigth = 1.0 - 1e-12
+        max_sigma2_add_cm = 20.0
+
+        return [starting_amp_MeV_g, starting_sigma_cm, starting_weigth, starting_sigma2_add_cm], \
+            ([min_amp_MeV_g, min_sigma_cm, min_weigth, min_sigma2_add_cm],
+             [max_amp_MeV_g, max_sigma_cm, max_weigth, max_sigma2_add_cm])
+
+    # warm started fit looks for amplitude and sigmas within this factor from values found in neighbouring slice
+    warm_scale_range = 1.5
+    # and for weight within this distance
+    warm_weight_range = 0.05
+    # number of consecutive slices fitted with warm start, first slice of each chain is fitted from scratch
+    warm_chain_length = 16
+
+    @classmethod
+    def _warm_start(cls, seed, cold_bounds):
+        """
+        Starting point and bounds of the fit, taken from optimal parameters of neighbouring slice.
+        Bounds are narrowed around the seed, but never extend beyond cold start bounds
+        (seed itself is moved inside them, i.e. amplitude bounds depend on dose maximum in the slice).
+        :return: starting parameters and bounds, or None if narrowed bounds are empty
+        """
+        cold_lower, cold_upper = np.asarray(cold_bounds[0]), np.asarray(cold_bounds[1])
+        seed = np.clip(np.asarray(seed, dtype=np.float64), cold_lower, cold_upper)
+        lower = seed / cls.warm_scale_range
+        upper = seed * cls.warm_scale_range
+        if seed.size == 4:
+            lower[2] = seed[2] - cls.warm_weight_range
+            upper[2] = seed[2] + cls.warm_weight_range
+        lower = np.maximum(lower, cold_lower)
+        upper = np.minimum(upper, cold_upper)
+        if np.any(lower >= upper):
+            return None
+        return seed, (lower, upper)
+
+    @classmethod
+    def _curve_fit(cls, r_cm, dose_MeV_g, ngauss, p0, bounds):
+        """
+        Fits gaussian model (single or double) to lateral profile, starting from p0 within given bounds
+        :return: optimal parameters and their covariance, as returned by scipy curve_fit
+        """
         from scipy.optimize import curve_fit
 
-        if ngauss == 1:
-            popt, pcov = curve_fit(f=cls.gauss_r_MeV_cm_g,
-                                   xdata=r_cm,
-                                   ydata=dose_MeV_g * r_cm,
-                                   p0=[starting_amp_MeV_g, starting_sigma_cm],
-                                   bounds=([[min_amp_MeV_g, min_sigma_cm], [max_amp_MeV_g, max_sigma_cm]]),
-                                   sigma=None)
-            # TODO return also parameter errors
-            perr = np.sqrt(np.diag(pcov))
+        model = cls.gauss_r_MeV_cm_g if ngauss == 1 else cls.gauss2_r_MeV_cm_g
+        return curve_fit(f=model,
+                         xdata=r_cm,
+                         ydata=dose_MeV_g * r_cm,
+                         p0=p0,
+                         bounds=bounds,
+                         sigma=None)
 
+    @classmethod
+    def _fit_results(cls, popt, pcov, ngauss=2):
+        """
+        Converts optimal parameters of the model and their covariance into FWHMs, weight and amplitude.
+        """
+        # TODO return also parameter errors
+        perr = np.sqrt(np.diag(pcov))
+        if ngauss == 1:
             dz0_MeV_cm_g, sigma_cm = popt
             dz0_MeV_cm_g_error, sigma_cm_error = perr
             factor = 0.0
@@ -665,24 +776,6 @@ class TripDddWriter(object):
             fwhm2_cm_error = 0.0
 
         elif ngauss == 2:
-            starting_weigth = 0.99
-            starting_sigma2_add_cm = 0.1
-
-            min_weigth = 0.55
-            min_sigma2_add_cm = 1e-1
-
-            max_weigth = 1.0 - 1e-12
-            max_sigma2_add_cm = 20.0
-
-            popt, pcov = curve_fit(f=cls.gauss2_r_MeV_cm_g,
-                                   xdata=r_cm,
-                                   ydata=dose_MeV_g * r_cm,
-                                   p0=[starting_amp_MeV_g, starting_sigma_cm, starting_weigth, starting_sigma2_add_cm],
-                                   bounds=([min_amp_MeV_g, min_sigma_cm, min_weigth, min_sigma2_add_cm],
-                                           [max_amp_MeV_g, max_sigma_cm, max_weigth, max_sigma2_add_cm]),
-                                   sigma=None)
-            # TODO return also parameter errors
-            perr = np.sqrt(np.diag(pcov))
             dz0_MeV_cm_g_error, sigma_cm_error, factor_error, sigma2_add_cm_error = perr
 
             dz0_MeV_cm_g, sigma_cm, factor, sigma2_add_cm = popt
@@ -699,3 +792,58 @@ class TripDddWriter(object):
         params_error = fwhm1_cm_error, factor_error, fwhm2_cm_error, dz0_MeV_cm_g_error
 
         return params, params_error
+
+    @classmethod
+    def _lateral_fit(cls, r_cm, dose_MeV_g, z_cm, energy_MeV, ngauss=2):
+        p0, bounds = cls._cold_start(r_cm, dose_MeV_g, ngauss)
+        popt, pcov = cls._curve_fit(r_cm, dose_MeV_g, ngauss, p0, bounds)
+        return cls._fit_results(popt, pcov, ngauss)
+
+    @classmethod
+    def _warm_lateral_fit(cls, r_cm, dose_MeV_g, z_cm, energy_MeV, ngauss=2, seed=None):
+        """
+        Lateral fit starting from optimal parameters of neighbouring slice (seed), with bounds narrowed around them.
+        If there is no seed, or seeded fit fails or ends on one of narrowed bounds (optimum lies outside of them),
+        fit is started from scratch as in _lateral_fit.
+        :return: params, params_error (as in _lateral_fit) and optimal parameters, to be used as next seed
+        """
+        p0, bounds = cls._cold_start(r_cm, dose_MeV_g, ngauss)
+        warm = None if seed is None else cls._warm_start(seed, bounds)
+        if warm is not None:
+            try:
+                popt, pcov = cls._curve_fit(r_cm, dose_MeV_g, ngauss, *warm)
+                lower, upper = warm[1]
+                on_narrowed_bound = (np.isclose(popt, lower, rtol=1e-6) & (lower > bounds[0])) | \
+                                    (np.isclose(popt, upper, rtol=1e-6) & (upper < bounds[1]))
+                if np.all(np.isfinite(popt)) and not np.any(on_narrowed_bound):
+                    return cls._fit_results(popt, pcov, ngauss) + (popt,)
+            except (RuntimeError, ValueError):
+                pass
+            logger.debug("Warm started fit at z = {:g} cm failed, starting from scratch".format(z_cm))
+        popt, pcov = cls._curve_fit(r_cm, dose_MeV_g, ngauss, p0, bounds)
+        return cls._fit_results(popt, pcov, ngauss) + (popt,)
+
+
+def _fit_slices(r_cm_1d, dose_MeV_g_2d, z_cm_1d, energy_MeV, ngauss, warm_start=False):
+    """
+    Fits lateral profiles of consecutive depth slices.
+    Defined on module level, to be usable by worker processes.
+    :param r_cm_1d: middle points of radial bins
+    :param dose_MeV_g_2d: dose, one row for each slice
+    :param z_cm_1d: depth of each slice
+    :param warm_start: if True, fit of each slice starts from optimum found for previous one
+    :return: list of (params, params_error) tuples, as returned by TripDddWriter._lateral_fit
+    """
+    results = []
+    seed = None
+    for dose_at_z, z_cm in zip(dose_MeV_g_2d, z_cm_1d):
+        # take into account only this position in r for which dose is positive
+        positive = dose_at_z > 0
+        if warm_start:
+            params, params_error, seed = TripDddWriter._warm_lateral_fit(r_cm_1d[positive], dose_at_z[positive],
+                                                                         z_cm, energy_MeV, ngauss, seed)
+            results.append((params, params_error))
+        else:
+            results.append(TripDddWriter._lateral_fit(r_cm_1d[positive], dose_at_z[positive], z_cm, energy_MeV,
+                                                      ngauss))
+    return results
@@ -150,6 +150,7 @@ setuptools.setup(
             'convertmc=' + \
             'pymchelper.run:main',
             'pld2sobp=pymchelper.utils.pld2sobp:main',
+            'dddbatch=pymchelper.utils.dddbatch:main',
         ],
     },
     install_requires=[
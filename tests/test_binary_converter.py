@@ -0,0 +1,89 @@
+import glob
+import os
+import shutil
+import tempfile
+import unittest
+import logging
+
+import numpy as np
+
+from pymchelper import run
+from pymchelper.detector import Detector
+
+logger = logging.getLogger(__name__)
+
+try:
+    import h5py  # noqa: F401
+    has_h5py = True
+except ImportError:
+    has_h5py = False
+
+
+class TestBinaryConverter(unittest.TestCase):
+    single_dir = os.path.join("tests", "res", "shieldhit", "single")
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def _check_roundtrip(self, converter, extension):
+        for name in sorted(os.listdir(self.single_dir)):
+            if not name.endswith(".bdo"):
+                continue
+            input_file = os.path.join(self.single_dir, name)
+            outfile = os.path.join(self.workdir, name[:-4])
+            run.main([converter, input_file, outfile, "--error", "none"])
+
+            expected = Detector()
+            expected.read(input_file)
+            det = Detector()
+            det.read(outfile + extension)
+            self.assertEqual(det.header, expected.header)
+            self.assertEqual(det.units, expected.units)
+            np.testing.assert_array_equal(det.data, np.ravel(expected.data))
+            self.assertIsNone(det.error)
+
+            header = Detector()
+            header.read_header(outfile + extension)
+            self.assertEqual(header.header, expected.header)
+            self.assertIsNone(header.data)
+
+    def test_npz(self):
+        self._check_roundtrip("npz", ".npz")
+
+    @unittest.skipUnless(has_h5py, "h5py not installed")
+    def test_hdf(self):
+        self._check_roundtrip("hdf", ".h5")
+
+    def test_error(self):
+        outfile = os.path.join(self.workdir, "merged")
+        run.main(["npz", os.path.join("tests", "res", "shieldhit", "generated", "many", "msh", "en_xyz_al000*.bdo"),
+                  outfile])
+        det = Detector()
+        det.read(outfile + ".npz")
+        self.assertIsNotNone(det.error)
+        self.assertEqual(det.error.shape, det.data.shape)
+
+    def test_counter(self):
+        # groups of 1 and 2 files, merged again with --weighted, result comes from 3 files
+        input_files = sorted(glob.glob(os.path.join("tests", "res", "shieldhit", "generated", "many", "msh",
+                                                    "en_xyz_al000*.bdo")))
+        self.assertEqual(len(input_files), 3)
+        for group, files in (("group1", input_files[:1]), ("group2", input_files[1:])):
+            for filename in files:
+                shutil.copy(filename, os.path.join(self.workdir, group + "_" + os.path.basename(filename)))
+            run.main(["npz", os.path.join(self.workdir, group + "_*.bdo"), os.path.join(self.workdir, group)])
+        outfile = os.path.join(self.workdir, "merged")
+        run.main(["npz", "--weighted", os.path.join(self.workdir, "group?.npz"), outfile])
+        with np.load(outfile + ".npz") as f:
+            self.assertEqual(int(f['counter']), 3)
+
+        det = Detector()
+        det.read(outfile + ".npz")
+        self.assertEqual((det.counter, det.merged_files), (1, 3))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -53,6 +53,26 @@ class TestCallMain(unittest.TestCase):
         self.assertGreater(len(files), 4)
         self.assertEqual(len(png_files), len(bdo_files))
 
+    def test_many_formats(self):
+        for write_jobs in ("1", "2"):
+            run.main(["txt", "--many", "tests/res/shieldhit/single/*.bdo", "--formats", "txt,plotdata,image",
+                      "--write-jobs", write_jobs])
+            files = os.listdir(os.path.join("tests", "res", "shieldhit", "single"))
+            bdo_files = [f for f in files if f.endswith(".bdo")]
+            for extension in (".txt", ".dat", ".png"):
+                self.assertEqual(len([f for f in files if f.endswith(extension)]), len(bdo_files))
+            for f in files:
+                if not f.endswith(".bdo"):
+                    os.remove(os.path.join("tests", "res", "shieldhit", "single", f))
+
+    def test_unknown_format(self):
+        self.assertEqual(run.main(["txt", "tests/res/shieldhit/single/ex_cyl.bdo", "--formats", "txt,foo"]), 1)
+
+    def test_tripddd_format(self):
+        # tripddd options are available only with tripddd command
+        self.assertEqual(run.main(["txt", "tests/res/shieldhit/single/ex_cyl.bdo", "--formats", "txt,tripddd"]), 1)
+        self.assertFalse(os.path.exists("tests/res/shieldhit/single/ex_cyl.txt"))
+
 
 class TestCallExample(unittest.TestCase):
     def test_shieldhit(self):
@@ -0,0 +1,96 @@
+import argparse
+import os
+import shutil
+import tempfile
+import unittest
+import logging
+
+import numpy as np
+
+from pymchelper.utils import dddbatch
+from pymchelper.writers.shieldhit import SHBinaryWriter
+from pymchelper.writers.trip98 import TripDddWriter
+from tests.test_trip98 import _ddd_detector, _ddd_content
+
+logger = logging.getLogger(__name__)
+
+
+class TestDddBatch(unittest.TestCase):
+    energies = (100.0, 150.0)
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.table = os.path.join(self.workdir, "energies.txt")
+        with open(self.table, "w") as f:
+            f.write("# energy  input files\n\n")
+            for energy in self.energies:
+                rundir = os.path.join(self.workdir, "run{:g}".format(energy))
+                os.mkdir(rundir)
+                for job in (1, 2):
+                    SHBinaryWriter(os.path.join(rundir, "ddd_{:04d}.bdo".format(job)),
+                                   argparse.Namespace()).write(_ddd_detector(zmax_cm=energy / 10.0))
+                f.write("{:g} {:s}\n".format(energy, os.path.join(rundir, "ddd_*.bdo")))
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def test_read_energy_table(self):
+        table = dddbatch.read_energy_table(self.table)
+        self.assertEqual([energy for energy, _ in table], list(self.energies))
+
+    def test_batch(self):
+        outdir = os.path.join(self.workdir, "output")
+        self.assertEqual(dddbatch.main([self.table, outdir, "--jobs", "2"]), 0)
+
+        summary = np.loadtxt(os.path.join(outdir, "ddd_summary.txt"), usecols=range(6))
+        np.testing.assert_array_equal(summary[:, 0], self.energies)
+        np.testing.assert_array_equal(summary[:, 1], [2, 2])
+        for energy in self.energies:
+            ddd_file = dddbatch.ddd_output_file(outdir, energy) + ".ddd"
+            self.assertTrue(os.path.isfile(ddd_file))
+            self.assertIn("!energy {:f}\n".format(energy), _ddd_content(ddd_file))
+        self.assertFalse([name for name in os.listdir(outdir) if name.endswith(".png")])
+
+    def test_missing_files(self):
+        with open(self.table, "a") as f:
+            f.write("200 " + os.path.join(self.workdir, "run200", "*.bdo") + "\n")
+        outdir = os.path.join(self.workdir, "output")
+        self.assertEqual(dddbatch.main([self.table, outdir, "--jobs", "1"]), 1)
+        summary = np.loadtxt(os.path.join(outdir, "ddd_summary.txt"), usecols=range(6))
+        self.assertEqual(summary.shape[0], len(self.energies))
+
+    def test_incompatible_files(self):
+        SHBinaryWriter(os.path.join(self.workdir, "run100", "ddd_0003.bdo"),
+                       argparse.Namespace()).write(_ddd_detector(nz=20))
+        outdir = os.path.join(self.workdir, "output")
+        self.assertEqual(dddbatch.main([self.table, outdir, "--jobs", "1"]), 1)
+        summary = np.loadtxt(os.path.join(outdir, "ddd_summary.txt"), usecols=range(6), ndmin=2)
+        np.testing.assert_array_equal(summary[:, 0], [150.0])
+
+    def test_failed_fit(self):
+        # fit failing for one of energies doesn't stop the batch
+        lateral_fits = TripDddWriter._lateral_fits
+
+        def failing_lateral_fits(writer, z_fitting_cm_1d):
+            if writer.energy_MeV == self.energies[0]:
+                raise RuntimeError("Optimal parameters not found")
+            return lateral_fits(writer, z_fitting_cm_1d)
+
+        TripDddWriter._lateral_fits = failing_lateral_fits
+        try:
+            outdir = os.path.join(self.workdir, "output")
+            self.assertEqual(dddbatch.main([self.table, outdir, "--jobs", "1"]), 1)
+        finally:
+            TripDddWriter._lateral_fits = lateral_fits
+        summary = np.loadtxt(os.path.join(outdir, "ddd_summary.txt"), usecols=range(6), ndmin=2)
+        np.testing.assert_array_equal(summary[:, 0], self.energies[1:])
+        self.assertFalse(os.path.exists(dddbatch.ddd_output_file(outdir, self.energies[0]) + ".ddd"))
+
+    def test_weighted_options(self):
+        outdir = os.path.join(self.workdir, "output")
+        self.assertEqual(dddbatch.main([self.table, outdir, "--weighted", "--nan"]), 1)
+        self.assertEqual(dddbatch.main([self.table, outdir, "--jobs", "1", "--error", "none"]), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
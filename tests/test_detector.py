@@ -0,0 +1,111 @@
+import unittest
+import logging
+import warnings
+
+import numpy as np
+
+from pymchelper.detector import Detector, Axis
+
+logger = logging.getLogger(__name__)
+
+
+def _make_detector(nx=3, ny=4, nz=5):
+    det = Detector()
+    det.nx, det.ny, det.nz = nx, ny, nz
+    det.xmin, det.xmax = -1.0, 2.0
+    det.ymin, det.ymax = 0.0, 8.0
+    det.zmin, det.zmax = 10.0, 20.0
+    det.nstat = 1
+    det.data = np.arange(nx * ny * nz, dtype=np.float64)
+    return det
+
+
+class TestAxisValues(unittest.TestCase):
+    def test_bin_centers(self):
+        det = _make_detector()
+        np.testing.assert_allclose(det.bin_centers(Axis.x), [-0.5, 0.5, 1.5])
+        np.testing.assert_allclose(det.bin_centers(Axis.y), [1.0, 3.0, 5.0, 7.0])
+        np.testing.assert_allclose(det.bin_centers(Axis.z), [11.0, 13.0, 15.0, 17.0, 19.0])
+
+    def test_storage_order(self):
+        det = _make_detector()
+        for p in range(det.nx * det.ny * det.nz):
+            i = p % det.nx
+            j = (p // det.nx) % det.ny
+            k = p // (det.nx * det.ny)
+            self.assertEqual(det.x[p], det.bin_centers(Axis.x)[i])
+            self.assertEqual(det.y[p], det.bin_centers(Axis.y)[j])
+            self.assertEqual(det.z[p], det.bin_centers(Axis.z)[k])
+
+    def test_cached(self):
+        det = _make_detector()
+        self.assertIs(det.axis_values(Axis.z), det.axis_values(Axis.z))
+        self.assertFalse(det.axis_values(Axis.z).flags.writeable)
+
+        # changing binning invalidates cached arrays
+        det.nz = 2
+        self.assertEqual(det.axis_values(Axis.z).size, det.nx * det.ny * det.nz)
+
+    def test_plotting_order(self):
+        det = _make_detector(nx=1, ny=4, nz=1)
+        self.assertEqual(det.dimension, 1)
+        np.testing.assert_array_equal(det.axis_values(0, plotting_order=True), det.y)
+
+
+class TestRadialIntegral(unittest.TestCase):
+    def _cyl_detector(self, nr=4, nphi=3, nz=5):
+        det = _make_detector(nx=nr, ny=nphi, nz=nz)
+        det.xmin, det.xmax = 1.0, 3.0
+        det.ymin, det.ymax = 0.0, 2.0 * np.pi
+        det.zmin, det.zmax = 0.0, 10.0
+        return det
+
+    def test_bin_volumes(self):
+        det = self._cyl_detector()
+        np.testing.assert_allclose(det.bin_edges(Axis.x), [1.0, 1.5, 2.0, 2.5, 3.0])
+        volumes = det.cylindrical_bin_volumes()
+        self.assertEqual(volumes.shape, (det.nx,))
+        # slices of cylindrical shell fill it completely
+        shell_volume = np.pi * (det.xmax**2 - det.xmin**2) * (det.zmax - det.zmin)
+        self.assertAlmostEqual(det.nz * det.ny * volumes.sum(), shell_volume)
+
+    def test_integral(self):
+        det = self._cyl_detector()
+        det.data = np.arange(det.nx * det.ny * det.nz, dtype=np.float64)
+        volumes = det.cylindrical_bin_volumes()
+
+        expected = [sum(det.data[p] * volumes[p % det.nx] for p in range(det.nx * det.ny * det.nz)
+                        if p // (det.nx * det.ny) == k) for k in range(det.nz)]
+        np.testing.assert_allclose(det.radial_integral(), expected)
+        np.testing.assert_allclose(det.radial_integral(np.ones_like(det.data)), det.ny * volumes.sum())
+
+
+class TestAverageWithNan(unittest.TestCase):
+    def test_streaming_matches_nan_functions(self):
+        rng = np.random.RandomState(1)
+        samples = rng.normal(size=(6, 3 * 4 * 5))
+        samples[rng.uniform(size=samples.shape) < 0.3] = np.nan
+        samples[:, 0] = np.nan  # no valid samples in first bin
+        samples[1:, 1] = np.nan  # single valid sample in second bin
+
+        first = _make_detector()
+        first.data = samples[0].copy()
+        first.counter = 1
+        first._M2 = np.zeros_like(first.data)
+        for sample in samples[1:]:
+            other = _make_detector()
+            other.data = sample.copy()
+            first.average_with_nan(other)
+
+        self.assertEqual(first.counter, samples.shape[0])
+        np.testing.assert_array_equal(first._bin_counter, np.sum(~np.isnan(samples), axis=0))
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)  # mean of empty slice
+            ref_mean = np.nanmean(samples, axis=0)
+            ref_std = np.nanstd(samples, axis=0, ddof=1)
+        np.testing.assert_allclose(first.data, ref_mean)
+        np.testing.assert_allclose(first.error, ref_std)
+
+
+if __name__ == '__main__':
+    unittest.main()
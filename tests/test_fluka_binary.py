@@ -0,0 +1,231 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import logging
+
+import numpy as np
+
+import pymchelper.flair.common.fortran as fortran
+from pymchelper import run
+from pymchelper.detector import Detector
+from pymchelper.flair.Data import Usrbin, unpackArray
+
+logger = logging.getLogger(__name__)
+
+
+def _write_usrbin(filename, detectors, ncase=1000, rel_errors=None):
+    """ Writes USRBIN binary file with cartesian detectors, given as list of (name, nbins, data) tuples
+    If list of relative errors is given, statistics of each detector is saved, as done by usbsuw
+    """
+    with open(filename, "wb") as f:
+        fortran.write(f, struct.pack("=80s32sfii", b"test", b"today", 1.0, ncase, 1))
+        for det_no, (name, nbins, data) in enumerate(detectors):
+            nx, ny, nz = nbins
+            header = struct.pack("=i10siiffifffifffififff",
+                                 det_no + 1, name, 10, 201,
+                                 -1.0, 1.0, nx, 2.0 / nx,
+                                 -2.0, 2.0, ny, 4.0 / ny,
+                                 0.0, 10.0, nz, 10.0 / nz,
+                                 0, 0.0, 0.0, 0.0)
+            fortran.write(f, header)
+            fortran.write(f, np.asarray(data, dtype=np.float32).tobytes())
+        if rel_errors is not None:
+            fortran.write(f, b"STATISTICS".ljust(14))
+            for rel_error in rel_errors:
+                fortran.write(f, np.asarray(rel_error, dtype=np.float32).tobytes())
+
+
+def _write_usrbdx(filename, ne, na, data, rel_error, ncase=1000, bdx_type=1, elow=0.0):
+    """ Writes USRBDX binary file with single detector and its statistics
+    """
+    with open(filename, "wb") as f:
+        fortran.write(f, struct.pack("=80s32sfii", b"test", b"today", 1.0, ncase, 1))
+        fortran.write(f, struct.pack("=i10siiiifiiiffifffif",
+                                     1, b"bdx", bdx_type, 201, 2, 3, 1.0, 0, 1, 0,
+                                     elow, 1.0, ne, 1.0 / ne, 0.0, 4.0 * np.pi, na, 4.0 * np.pi / na))
+        fortran.write(f, np.asarray(data, dtype=np.float32).tobytes())
+        fortran.write(f, b"STATISTICS".ljust(14))
+        fortran.write(f, np.array([1.0, 0.1], dtype=np.float32).tobytes())  # total and its error
+        for _ in range(5):
+            fortran.write(f, np.zeros(ne, dtype=np.float32).tobytes())
+        fortran.write(f, np.asarray(rel_error, dtype=np.float32).tobytes())
+
+
+def _write_resnuclei(filename, zhigh, mhigh, data, rel_error, ncase=1000):
+    """ Writes RESNUCLEi binary file with single detector and its statistics
+    """
+    with open(filename, "wb") as f:
+        fortran.write(f, struct.pack("=80s32sfii", b"test", b"today", 1.0, ncase, 1))
+        fortran.write(f, struct.pack("=i10siif3i", 1, b"res", 1, 3, 1.0, mhigh, zhigh, -5))
+        fortran.write(f, np.asarray(data, dtype=np.float32).tobytes())
+        fortran.write(f, b"STATISTICS".ljust(14))
+        for _ in range(5):
+            fortran.write(f, np.zeros(zhigh, dtype=np.float32).tobytes())  # totals, A and Z distributions
+        fortran.write(f, np.asarray(rel_error, dtype=np.float32).tobytes())
+
+
+class TestFlukaBinaryReader(unittest.TestCase):
+    detectors = [(b"dose", (3, 2, 4), np.linspace(0.0, 1.0, 24)),
+                 (b"fluence", (1, 1, 5), np.arange(5.0))]
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.workdir, "ex001_fort.21")
+        _write_usrbin(self.filename, self.detectors)
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def test_read(self):
+        det = Detector()
+        det.read(self.filename)
+        self.assertEqual(det.nstat, 1000)
+        self.assertEqual(det.pages, 2)
+        self.assertEqual((det.nx, det.ny, det.nz), (3, 2, 4))
+        self.assertEqual(det.data.dtype, np.float64)
+
+        # same values as read by flair routines
+        usr = Usrbin(self.filename)
+        for det_no, (_, nbins, _) in enumerate(self.detectors):
+            page = det.page(det_no)
+            self.assertEqual((page.nx, page.ny, page.nz), nbins)
+            np.testing.assert_array_equal(page.data, unpackArray(usr.readData(det_no)))
+
+    def test_record_offsets(self):
+        usr = Usrbin(self.filename)
+        for det_no, (name, _, data) in enumerate(self.detectors):
+            header = struct.unpack("=i10s", usr.readRecord(usr.detector[det_no].headerpos)[:14])
+            self.assertEqual(header, (det_no + 1, name.ljust(10, b'\x00')))
+            np.testing.assert_array_equal(np.frombuffer(usr.readData(det_no), dtype=np.float32),
+                                          data.astype(np.float32))
+        self.assertIsNone(usr.readStat(0))
+
+    def test_read_header(self):
+        det = Detector()
+        det.read_header(self.filename)
+        self.assertEqual(det.pages, 2)
+        self.assertEqual(det.page(1).nz, 5)
+
+    def test_merge_many(self):
+        second_file = os.path.join(self.workdir, "ex002_fort.21")
+        _write_usrbin(second_file, [(name, nbins, 3 * data) for name, nbins, data in self.detectors])
+        outdir = os.path.join(self.workdir, "output")
+        run.main(["plotdata", "--many", os.path.join(self.workdir, "*_fort.21"), outdir, "--error", "none"])
+        for det_no, (_, _, data) in enumerate(self.detectors):
+            saved_data = np.loadtxt(os.path.join(outdir, "21_p{:d}.dat".format(det_no + 1)))
+            np.testing.assert_allclose(saved_data[:, -1], 2 * data, rtol=1e-5)
+
+
+class TestFlukaStatistics(unittest.TestCase):
+    nbins = (2, 1, 3)
+    data = np.array([1.0, 2.0, 3.0, 4.0, 5.0, 6.0])
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        # two summed runs with different number of primaries, results and errors
+        _write_usrbin(os.path.join(self.workdir, "sum1_fort.21"), [(b"dose", self.nbins, self.data)],
+                      ncase=1000, rel_errors=[np.full(6, 0.1)])
+        _write_usrbin(os.path.join(self.workdir, "sum2_fort.21"), [(b"dose", self.nbins, 4 * self.data)],
+                      ncase=3000, rel_errors=[np.full(6, 0.2)])
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def test_read_error(self):
+        det = Detector()
+        det.read(os.path.join(self.workdir, "sum1_fort.21"))
+        np.testing.assert_allclose(det.error, 0.1 * self.data, rtol=1e-6)
+
+    def test_weighted_merge(self):
+        outfile = os.path.join(self.workdir, "merged")
+        run.main(["plotdata", os.path.join(self.workdir, "sum*_fort.21"), outfile, "--weighted"])
+        saved_data = np.loadtxt(outfile + ".dat")
+
+        expected_data = 0.25 * self.data + 0.75 * 4 * self.data
+        expected_error = np.hypot(0.25 * 0.1 * self.data, 0.75 * 0.2 * 4 * self.data)
+        np.testing.assert_allclose(saved_data[:, -2], expected_data, rtol=1e-5)
+        np.testing.assert_allclose(saved_data[:, -1], expected_error, rtol=1e-5)
+
+    def test_weighted_unsupported_options(self):
+        outfile = os.path.join(self.workdir, "merged")
+        for options in (["--error", "stddev"], ["--nan"]):
+            self.assertEqual(run.main(["plotdata", os.path.join(self.workdir, "sum*_fort.21"), outfile,
+                                       "--weighted"] + options), 1)
+        self.assertFalse(os.path.exists(outfile + ".dat"))
+
+
+class TestFlukaOtherEstimators(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def test_usrbdx(self):
+        ne, na = 4, 2
+        data = np.arange(1.0, ne * na + 1)
+        rel_error = np.full(ne * na, 0.5)
+        for job in (1, 2):
+            _write_usrbdx(os.path.join(self.workdir, "ex00{:d}_fort.47".format(job)), ne, na, job * data, rel_error)
+
+        det = Detector()
+        det.read(os.path.join(self.workdir, "ex001_fort.47"))
+        self.assertEqual((det.nx, det.ny, det.nz), (ne, na, 1))
+        self.assertEqual((det.xmin, det.xmax), (0.0, 1.0))
+        np.testing.assert_allclose(det.data, data)
+        np.testing.assert_allclose(det.error, 0.5 * data)
+
+        outfile = os.path.join(self.workdir, "bdx")
+        run.main(["plotdata", os.path.join(self.workdir, "*_fort.47"), outfile, "--error", "none"])
+        saved_data = np.loadtxt(outfile + ".dat")
+        np.testing.assert_allclose(saved_data[:, 2], 1.5 * data, rtol=1e-5)
+
+    def test_usrbdx_log_energy(self):
+        ne, na = 3, 2
+        data = np.arange(1.0, ne * na + 1)
+        filename = os.path.join(self.workdir, "ex001_fort.47")
+        _write_usrbdx(filename, ne, na, data, np.zeros(ne * na), bdx_type=-1, elow=1e-3)
+
+        det = Detector()
+        det.read(filename)
+        np.testing.assert_allclose(det.bin_edges(0), [-3, -2, -1, 0], atol=1e-6)
+        self.assertEqual(det.units[0], "log10(GeV)")
+        self.assertEqual((det.ymin, det.ymax), (0.0, np.float32(4.0 * np.pi)))
+        np.testing.assert_allclose(det.data, data)
+
+    def test_resnuclei(self):
+        zhigh, mhigh = 3, 4
+        data = np.arange(zhigh * mhigh, dtype=np.float64)
+        rel_error = np.full(zhigh * mhigh, 0.1)
+        filename = os.path.join(self.workdir, "ex001_fort.55")
+        _write_resnuclei(filename, zhigh, mhigh, data, rel_error)
+
+        det = Detector()
+        det.read(filename)
+        self.assertEqual((det.nx, det.ny, det.nz), (zhigh, mhigh, 1))
+        np.testing.assert_allclose(det.bin_centers(0), [1, 2, 3])
+        np.testing.assert_allclose(det.bin_centers(1), [-4, -3, -2, -1])
+        np.testing.assert_allclose(det.data, data)
+        np.testing.assert_allclose(det.error, 0.1 * data, rtol=1e-6)
+
+    def test_unsupported_estimator(self):
+        # i.e. USRTRACK, detector header of 50 bytes
+        filename = os.path.join(self.workdir, "ex001_fort.48")
+        with open(filename, "wb") as f:
+            fortran.write(f, struct.pack("=80s32sfii", b"test", b"today", 1.0, 1000, 1))
+            fortran.write(f, b"\x00" * 50)
+        with self.assertRaises(IOError):
+            Detector().read(filename)
+
+        truncated = os.path.join(self.workdir, "ex002_fort.55")
+        with open(truncated, "wb") as f:
+            fortran.write(f, struct.pack("=80s32sfii", b"test", b"today", 1.0, 1000, 1))
+            f.write(b"\x26\x00")
+        with self.assertRaises(IOError):
+            Detector().read_header(truncated)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+import unittest
+import logging
+
+import numpy as np
+
+from pymchelper.fortranformatter import format_e, format_d, format_e_array, format_d_array
+
+logger = logging.getLogger(__name__)
+
+
+class TestFormatArray(unittest.TestCase):
+    special_values = [0.0, -0.0, float('nan'), float('inf'), float('-inf'), 1.0, -1.0, 0.5,
+                      9.99999995, -9.99999995, 0.99999999996, 123456789.0,
+                      1e-99, 1e-100, 1e99, 1e100, 5e-324, -1e-310, 1e308]
+
+    def _check(self, scalar_format, array_format, w, d, values):
+        result = array_format(w, d, values)
+        self.assertEqual(len(result), len(values))
+        for value, formatted in zip(values, result):
+            self.assertEqual(formatted.decode('ascii'), scalar_format(w, d, float(value)))
+
+    def test_special_values(self):
+        for w, d in ((14, 7), (23, 16), (10, 3), (8, 3)):
+            self._check(format_e, format_e_array, w, d, self.special_values)
+            self._check(format_d, format_d_array, w, d, self.special_values)
+
+    def test_random_values(self):
+        rng = np.random.RandomState(0)
+        values = rng.normal(size=1000) * 10.0 ** rng.randint(-320, 308, size=1000)
+        self._check(format_e, format_e_array, 14, 7, values)
+        self._check(format_e, format_e_array, 23, 16, values)
+
+    def test_empty(self):
+        self.assertEqual(format_e_array(14, 7, []).size, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
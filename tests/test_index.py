@@ -0,0 +1,87 @@
+import os
+import glob
+import shutil
+import sqlite3
+import tempfile
+import unittest
+import logging
+
+import numpy as np
+
+from pymchelper import run
+from pymchelper.detector import Detector, read_page_headers
+from pymchelper.index import HeaderIndex, read_headers
+from pymchelper.writers.binary import NpzWriter
+
+logger = logging.getLogger(__name__)
+
+
+class TestHeaderIndex(unittest.TestCase):
+    many_dir = os.path.join("tests", "res", "shieldhit", "generated", "many", "msh")
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        for filename in glob.glob(os.path.join(self.many_dir, "en_*.bdo")):
+            shutil.copy(filename, self.workdir)
+        self.input_files = sorted(glob.glob(os.path.join(self.workdir, "*.bdo")))
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def _indexed_names(self):
+        connection = sqlite3.connect(os.path.join(self.workdir, HeaderIndex.index_filename))
+        names = sorted(row[0] for row in connection.execute("SELECT DISTINCT name FROM page_headers"))
+        connection.close()
+        return names
+
+    def test_index(self):
+        headers = read_headers(self.input_files)
+        self.assertEqual(self._indexed_names(), sorted(os.path.basename(f) for f in self.input_files))
+        for filename in self.input_files:
+            self.assertEqual(headers[filename], read_page_headers(filename))
+
+        # second pass takes headers from index
+        headers_from_index = read_headers(self.input_files)
+        self.assertEqual(headers, headers_from_index)
+
+        # removed files disappear from index
+        os.remove(self.input_files[0])
+        read_headers(self.input_files[1:])
+        self.assertEqual(self._indexed_names(), sorted(os.path.basename(f) for f in self.input_files[1:]))
+
+    def test_other_schema(self):
+        # index with different columns is rebuilt
+        connection = sqlite3.connect(os.path.join(self.workdir, HeaderIndex.index_filename))
+        connection.execute("CREATE TABLE page_headers (name TEXT, page INTEGER, core_name TEXT)")
+        connection.execute("INSERT INTO page_headers VALUES ('old.bdo', 0, 'old')")
+        connection.commit()
+        connection.close()
+
+        headers = read_headers(self.input_files)
+        self.assertEqual(self._indexed_names(), sorted(os.path.basename(f) for f in self.input_files))
+        self.assertEqual(headers, read_headers(self.input_files))
+
+    def test_nan_range(self):
+        det = Detector()
+        det.read(self.input_files[0])
+        det.xmin = det.xmax = float('nan')
+        filename = os.path.join(self.workdir, "nan_range.npz")
+        NpzWriter(filename, None).write(det)
+
+        header, = read_headers([filename])[filename]
+        self.assertTrue(np.isnan(header.xmin))
+        header_from_index, = read_headers([filename])[filename]
+        self.assertTrue(np.isnan(header_from_index.xmin) and np.isnan(header_from_index.xmax))
+        self.assertEqual(header_from_index._replace(xmin=0.0, xmax=0.0), header._replace(xmin=0.0, xmax=0.0))
+
+    def test_many_with_index(self):
+        outdir = tempfile.mkdtemp()
+        for _ in range(2):
+            run.main(["plotdata", "--many", "--index", os.path.join(self.workdir, "*.bdo"), outdir])
+        dat_files = [f for f in os.listdir(outdir) if f.endswith(".dat")]
+        self.assertGreater(len(dat_files), 4)
+        shutil.rmtree(outdir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import os
+import struct
+import tempfile
+import unittest
+import logging
+
+import numpy as np
+
+import pymchelper.flair.common.fortran as fortran
+from pymchelper.flair.Data import Mgdraw
+
+logger = logging.getLogger(__name__)
+
+
+def _write_mgdraw(filename, nevents):
+    """ Writes MGDRAW file with sequence of tracking, energy deposition and source events,
+    as produced by default mgdraw.f routine
+    """
+    with open(filename, "wb") as f:
+        for i in range(nevents):
+            kind = i % 3
+            if kind == 0:  # tracking, i % 4 + 1 track segments and no extra values
+                ntrack = i % 4 + 1
+                fortran.write(f, struct.pack("=iiiff", ntrack, 0, 1, 0.1 * i, 1.0))
+                fortran.write(f, np.arange(3 * (ntrack + 1) + 1, dtype=np.float32).tobytes())
+            elif kind == 1:  # energy deposition
+                fortran.write(f, struct.pack("=iiiff", 0, 10, 7, 0.2, 1.0))
+                fortran.write(f, struct.pack("=4f", i, 2.0 * i, 3.0, 0.5 * i))
+            else:  # source with two primaries
+                fortran.write(f, struct.pack("=iiiff", -i, 2, 0, 0.4, 1.0))
+                fortran.write(f, struct.pack("=i8f", 1, 0.2, 1.0, 0, 0, i, 0, 0, 1) * 2)
+
+
+class TestMgdrawBatches(unittest.TestCase):
+    nevents = 301
+
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(suffix=".mgdraw")
+        os.close(fd)
+        _write_mgdraw(self.filename, self.nevents)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test_batches(self):
+        # small blocks, so that events are split between batches
+        for blocksize in (100, 1000, 1 << 20):
+            mgd = Mgdraw(self.filename)
+            batches = list(mgd.batches(blocksize))
+            mgd.close()
+            self.assertEqual(mgd.nevent, self.nevents)
+            if blocksize == 1000:
+                self.assertGreater(len(batches), 1)
+
+            energy = np.concatenate([batch.energy for batch in batches])
+            expected = np.arange(1, self.nevents, 3)
+            np.testing.assert_array_equal(energy['x'], expected)
+            np.testing.assert_array_equal(energy['rull'], 0.5 * expected)
+            self.assertTrue(np.all(energy['icode'] == 10))
+
+            source = np.concatenate([batch.source for batch in batches])
+            np.testing.assert_array_equal(source['ncase'], np.arange(2, self.nevents, 3))
+            for batch in batches:
+                for event in batch.source:
+                    particles = batch.source_particles[event['start']:event['start'] + event['npflka']]
+                    self.assertTrue(np.all(particles['zflk'] == event['ncase']))
+                    self.assertTrue(np.all(particles['iloflk'] == 1))
+
+            ntrack = 0
+            for batch in batches:
+                for event in batch.tracking:
+                    size = 3 * (event['ntrack'] + 1) + event['mtrack'] + 1
+                    values = batch.tracking_data[event['start']:event['start'] + size]
+                    np.testing.assert_array_equal(values, np.arange(size))
+                    ntrack += 1
+            self.assertEqual(ntrack, len(range(0, self.nevents, 3)))
+
+    def test_same_as_read_event(self):
+        mgd = Mgdraw(self.filename)
+        types = []
+        while True:
+            event_type = mgd.readEvent()
+            if event_type is None:
+                break
+            types.append(event_type)
+        mgd.close()
+
+        mgd = Mgdraw(self.filename)
+        batch = mgd.readBatch()
+        mgd.close()
+        self.assertEqual(types.count(0), len(batch.tracking))
+        self.assertEqual(types.count(1), len(batch.energy))
+        self.assertEqual(types.count(2), len(batch.source))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,235 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import logging
+
+import numpy as np
+
+from pymchelper import run
+from pymchelper.detector import Detector, IncompatibleFilesError, check_compatibility, read_page_headers
+from pymchelper.readers.shieldhit import SHBDOTagID
+from pymchelper.shieldhit.detector.detector_type import SHDetType
+from pymchelper.shieldhit.detector.estimator_type import SHGeoType
+
+logger = logging.getLogger(__name__)
+
+
+def _token(pl_id, pl_type, payload):
+    """ Binary representation of single token: tag followed by payload
+    """
+    payload = np.asarray(payload, dtype=pl_type)
+    return struct.pack('<Q8sQ', pl_id, pl_type.encode('ASCII'), payload.size) + payload.tobytes()
+
+
+def _write_bdo0p6(filename, pages, geotyp=b'MSH'):
+    """ Writes file with single estimator (MSH by default), holding one page for each
+    (detector type, number of bins, data) tuple. Optional fourth element of the tuple holds additional page tokens.
+    """
+    tokens = [
+        _token(SHBDOTagID.shversion, 'S12', [b'0.6.0 test  ']),
+        _token(SHBDOTagID.filedate, 'S30', [b'Mon, 01 Jan 2018 00:00:00']),
+        _token(SHBDOTagID.rt_nstat, '<i8', [1000]),
+        _token(SHBDOTagID.est_geotyp, 'S10', [geotyp]),
+        _token(SHBDOTagID.est_pages, '<i4', [len(pages)]),
+        _token(SHBDOTagID.irifimc, '<i4', [1]),  # not used by reader
+    ]
+    for page in pages:
+        dettyp, nbin, data = page[:3]
+        tokens += list(page[3]) if len(page) > 3 else []
+        tokens += [
+            _token(SHBDOTagID.det_dtype, '<i4', [int(dettyp)]),
+            _token(SHBDOTagID.det_nbin, '<i4', nbin),
+            _token(SHBDOTagID.det_xyz_start, '<f8', [0.0, -1.0, -2.0]),
+            _token(SHBDOTagID.det_xyz_stop, '<f8', [3.0, 1.0, 2.0]),
+            _token(SHBDOTagID.det_data, '<f8', data),
+        ]
+    with open(filename, 'wb') as f:
+        f.write(struct.pack('<6s2s16s', b'xSH12A', b'II', b'0.6'))
+        for token in tokens:
+            f.write(token)
+
+
+class TestSHBinaryReader0p6(unittest.TestCase):
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(suffix=".bdo")
+        os.close(fd)
+        self.data = np.arange(6, dtype=np.float64)
+        _write_bdo0p6(self.filename, [(SHDetType.energy, [3, 2, 1], self.data)])
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test_read(self):
+        for mmap in (False, True):
+            det = Detector()
+            det.read(self.filename, mmap=mmap)
+            self.assertEqual(det.mc_code_version, "0.6.0 test")
+            self.assertEqual(det.nstat, 1000)
+            self.assertEqual(det.geotyp, SHGeoType.msh)
+            self.assertEqual(det.dettyp, SHDetType.energy)
+            self.assertEqual((det.nx, det.ny, det.nz), (3, 2, 1))
+            self.assertEqual((det.xmin, det.ymax, det.zmax), (0.0, 1.0, 2.0))
+            np.testing.assert_allclose(det.data, self.data / 1000)
+
+    def test_read_header(self):
+        det = Detector()
+        det.read_header(self.filename)
+        self.assertEqual(det.nstat, 1000)
+        self.assertEqual((det.nx, det.ny, det.nz), (3, 2, 1))
+        self.assertIsNone(det.data)
+
+
+class TestMultiPage(unittest.TestCase):
+    pages = [(SHDetType.energy, [3, 2, 1], np.arange(6, dtype=np.float64)),
+             (SHDetType.fluence, [2, 2, 2], np.arange(8, dtype=np.float64) + 10.0),
+             (SHDetType.counter, [4, 1, 1], np.ones(4))]
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        for job in (1, 2):
+            _write_bdo0p6(os.path.join(self.workdir, "spc_{:04d}.bdo".format(job)), self.pages)
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def test_read(self):
+        det = Detector()
+        det.read(os.path.join(self.workdir, "spc_0001.bdo"))
+        self.assertEqual(det.pages, len(self.pages))
+        self.assertEqual(det.data.size, sum(data.size for _, _, data in self.pages))
+        self.assertTrue(det.data.flags.c_contiguous)
+        for page_no, (dettyp, nbin, data) in enumerate(self.pages):
+            page = det.page(page_no)
+            self.assertEqual(page.dettyp, dettyp)
+            self.assertEqual([page.nx, page.ny, page.nz], nbin)
+            self.assertEqual(page.nstat, 1000)
+            np.testing.assert_allclose(page.data, data / 1000)
+
+        header = Detector()
+        header.read_header(os.path.join(self.workdir, "spc_0001.bdo"))
+        self.assertEqual(header.pages, len(self.pages))
+        self.assertEqual(header.page(1).nx, 2)
+
+    def test_differential_page(self):
+        # differential binning of first page doesn't change binning of following plain page
+        dif_tokens = [_token(SHBDOTagID.det_dif_start, '<f8', [0.0]),
+                      _token(SHBDOTagID.det_dif_stop, '<f8', [100.0]),
+                      _token(SHBDOTagID.det_nbine, '<i4', [4]),
+                      _token(SHBDOTagID.det_difftype, '<i4', [int(SHDetType.energy)])]
+        filename = os.path.join(self.workdir, "dif.bdo")
+        _write_bdo0p6(filename, [(SHDetType.fluence, [3, 2, 1], np.ones(24), dif_tokens),
+                                 (SHDetType.energy, [3, 2, 1], np.ones(6))], geotyp=b'DMSH')
+        for read_data in (True, False):
+            det = Detector()
+            if read_data:
+                det.read(filename)
+            else:
+                det.read_header(filename)
+            self.assertEqual(det.pages, 2)
+            self.assertEqual((det.page(0).nz, det.page(0).zmin, det.page(0).zmax), (4, 0.0, 100.0))
+            self.assertEqual((det.page(1).nz, det.page(1).zmin, det.page(1).zmax), (1, -2.0, 2.0))
+            self.assertFalse(hasattr(det.page(1), 'dif_n'))
+
+    def test_compatibility_of_all_pages(self):
+        other_pages = list(self.pages)
+        other_pages[2] = (SHDetType.counter, [2, 2, 1], np.ones(4))  # same number of bins, different binning
+        other_file = os.path.join(self.workdir, "other.bdo")
+        _write_bdo0p6(other_file, other_pages)
+        first_file = os.path.join(self.workdir, "spc_0001.bdo")
+        check_compatibility([first_file, first_file], [read_page_headers(first_file)] * 2)
+        with self.assertRaises(IncompatibleFilesError):
+            check_compatibility([first_file, other_file], [read_page_headers(first_file),
+                                                           read_page_headers(other_file)])
+
+    def test_merge(self):
+        outfile = os.path.join(self.workdir, "spc")
+        run.main(["plotdata", os.path.join(self.workdir, "spc_*.bdo"), outfile, "--error", "stddev"])
+        for page_no, (dettyp, nbin, data) in enumerate(self.pages):
+            saved_file = "{:s}_p{:d}.dat".format(outfile, page_no + 1)
+            self.assertTrue(os.path.isfile(saved_file))
+            saved_data = np.loadtxt(saved_file)
+            self.assertEqual(saved_data.shape[0], data.size)
+
+
+class TestSHBinaryWriter(unittest.TestCase):
+    single_dir = os.path.join("tests", "res", "shieldhit", "single")
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def test_roundtrip(self):
+        for name in sorted(os.listdir(self.single_dir)):
+            if not name.endswith(".bdo"):
+                continue
+            input_file = os.path.join(self.single_dir, name)
+            outfile = os.path.join(self.workdir, name)
+            run.main(["bdo", input_file, outfile, "--error", "none"])
+
+            expected = Detector()
+            expected.read(input_file)
+            det = Detector()
+            det.read(outfile)
+            self.assertEqual(det.header, expected.header)
+            self.assertEqual(det.units, expected.units)
+            np.testing.assert_allclose(det.data, expected.data, rtol=1e-12)
+
+    def test_multi_page(self):
+        for job in (1, 2):
+            _write_bdo0p6(os.path.join(self.workdir, "spc_{:04d}.bdo".format(job)), TestMultiPage.pages)
+        outfile = os.path.join(self.workdir, "merged.bdo")
+        run.main(["bdo", os.path.join(self.workdir, "spc_*.bdo"), outfile, "--error", "none"])
+
+        det = Detector()
+        det.read(outfile)
+        self.assertEqual(det.nstat, 2000)
+        self.assertEqual(det.pages, len(TestMultiPage.pages))
+        for page_no, (dettyp, nbin, data) in enumerate(TestMultiPage.pages):
+            page = det.page(page_no)
+            self.assertEqual(page.dettyp, dettyp)
+            self.assertEqual([page.nx, page.ny, page.nz], nbin)
+            np.testing.assert_allclose(page.data, data / 1000)
+
+    def test_nscale(self):
+        input_file = os.path.join(self.single_dir, "ex_cyl.bdo")
+        outfile = os.path.join(self.workdir, "scaled.bdo")
+        self.assertEqual(run.main(["bdo", input_file, outfile, "--nscale", "1000"]), 1)
+        self.assertFalse(os.path.exists(outfile))
+
+    def test_overwrite_input(self):
+        input_file = os.path.join(self.workdir, "ex_cyl.bdo")
+        shutil.copy(os.path.join(self.single_dir, "ex_cyl.bdo"), input_file)
+        with open(input_file, "rb") as f:
+            content = f.read()
+        with self.assertRaises(IOError):
+            run.main(["bdo", input_file])
+        with open(input_file, "rb") as f:
+            self.assertEqual(f.read(), content)
+
+    def test_warning(self):
+        input_file = os.path.join(self.single_dir, "ex_cyl.bdo")
+        with self.assertLogs("pymchelper.writers.shieldhit", level="WARNING") as logs:
+            logging.getLogger("pymchelper.writers.shieldhit").warning("marker")
+            run.main(["bdo", input_file, os.path.join(self.workdir, "single")])
+        self.assertEqual(len(logs.output), 1)  # single file, no errors: only marker is logged
+
+    def test_merge_groups(self):
+        # groups of different size, merged again by number of primaries give average of all files
+        data = np.arange(6, dtype=np.float64)
+        for job in (1, 2, 3):
+            group = "group1" if job == 1 else "group2"
+            _write_bdo0p6(os.path.join(self.workdir, "{:s}_{:04d}.bdo".format(group, job)),
+                          [(SHDetType.energy, [3, 2, 1], job * data)])
+        for group in ("group1", "group2"):
+            run.main(["bdo", os.path.join(self.workdir, group + "_*.bdo"), os.path.join(self.workdir, group + ".bdo")])
+        outfile = os.path.join(self.workdir, "result")
+        run.main(["plotdata", "--weighted", os.path.join(self.workdir, "group?.bdo"), outfile])
+        np.testing.assert_allclose(np.loadtxt(outfile + ".dat")[:, -1], 2 * data / 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
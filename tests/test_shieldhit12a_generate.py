@@ -1,12 +1,15 @@
 import os
+import pickle
 import tempfile
 import unittest
 import glob
 import shutil
 import logging
 
+import numpy as np
+
 from pymchelper import run
-from pymchelper.detector import Detector
+from pymchelper.detector import Detector, IncompatibleFilesError, merge_list, read_header
 from pymchelper.shieldhit.detector.detector_type import SHDetType
 from pymchelper.shieldhit.detector.estimator_type import SHGeoType
 from pymchelper.shieldhit.particle import SHParticleType
@@ -37,7 +40,7 @@ class TestSHGenerated(unittest.TestCase):
             logger.info("Estimator: " + est)
             indir = os.path.join(self.many_dir, est)
 
-            for add_options in ([], ["--error", "stderr"], ["--error", "stddev"], ["--error", "none"]):
+            for add_options in ([], ["--error", "stderr"], ["--error", "stddev"], ["--error", "none"], ["--mmap"]):
                 outdir = tempfile.mkdtemp()
                 run_options = ["plotdata", "--many", '' + os.path.join(indir, "*.bdo") + '', outdir]
                 run_options += add_options
@@ -48,6 +51,75 @@ class TestSHGenerated(unittest.TestCase):
                 self.assertGreater(len(dat_files), 4)
                 shutil.rmtree(outdir)
 
+    def test_many_chunks(self):
+        for est in ("cyl", "msh"):
+            logger.info("Estimator: " + est)
+            indir = os.path.join(self.many_dir, est)
+
+            for add_options in (["--error", "stderr"], ["--error", "stddev"], ["--error", "stderr", "--nan"]):
+                serial_outdir = tempfile.mkdtemp()
+                chunks_outdir = tempfile.mkdtemp()
+                run_options = ["plotdata", "--many", '' + os.path.join(indir, "*.bdo") + '', "--jobs", "2"]
+                run_options += add_options
+                logger.info("Run options " + " ".join(run_options))
+                run.main(run_options[:3] + [serial_outdir] + run_options[3:])
+                run.main(run_options[:3] + [chunks_outdir] + run_options[3:] + ["--chunk-size", "1"])
+                dat_files = [f for f in os.listdir(serial_outdir) if f.endswith(".dat")]
+                self.assertGreater(len(dat_files), 4)
+                for dat_file in dat_files:
+                    serial_data = np.loadtxt(os.path.join(serial_outdir, dat_file))
+                    chunks_data = np.loadtxt(os.path.join(chunks_outdir, dat_file))
+                    np.testing.assert_allclose(serial_data, chunks_data, rtol=1e-5)
+                shutil.rmtree(serial_outdir)
+                shutil.rmtree(chunks_outdir)
+
+    def test_checkpoint(self):
+        indir = os.path.join(self.many_dir, "msh")
+        all_files = os.path.join(indir, "aen_0_al000*.bdo")
+        first_files = os.path.join(indir, "aen_0_al000[12].bdo")
+        for add_options in (["--error", "stderr"], ["--error", "stderr", "--nan"]):
+            outdir = tempfile.mkdtemp()
+            full_output = os.path.join(outdir, "full")
+            incremental_output = os.path.join(outdir, "incremental")
+            run.main(["plotdata", all_files, full_output] + add_options)
+
+            # merge first files, then repeat with all files, reusing saved state
+            run.main(["plotdata", first_files, incremental_output, "--checkpoint"] + add_options)
+            self.assertTrue(os.path.isfile(incremental_output + ".checkpoint"))
+            run.main(["plotdata", all_files, incremental_output, "--checkpoint"] + add_options)
+
+            full_data = np.loadtxt(full_output + ".dat")
+            incremental_data = np.loadtxt(incremental_output + ".dat")
+            np.testing.assert_allclose(full_data, incremental_data, rtol=1e-5)
+            shutil.rmtree(outdir)
+
+    def test_checkpoint_changed_file(self):
+        indir = tempfile.mkdtemp()
+        for filename in glob.glob(os.path.join(self.many_dir, "msh", "aen_0_al000[123].bdo")):
+            shutil.copy(filename, indir)
+        input_files = sorted(glob.glob(os.path.join(indir, "*.bdo")))
+        output = os.path.join(indir, "incremental")
+        run.main(["plotdata", os.path.join(indir, "*.bdo"), output, "--checkpoint"])
+
+        with open(output + ".checkpoint", 'rb') as f:
+            state = pickle.load(f)
+        self.assertIsNone(state['detector']._axis_cache)
+
+        # first file is replaced in place by the content of the second one, result has to follow
+        shutil.copy(input_files[1], input_files[0])
+        os.utime(input_files[0], (0, 0))
+        run.main(["plotdata", os.path.join(indir, "*.bdo"), output, "--checkpoint"])
+        run.main(["plotdata", os.path.join(indir, "*.bdo"), os.path.join(indir, "full")])
+        np.testing.assert_allclose(np.loadtxt(output + ".dat"), np.loadtxt(os.path.join(indir, "full.dat")), rtol=1e-5)
+
+        # last file is not on the input list any more, result has to be calculated without it
+        subset = os.path.join(indir, "aen_0_al000[12].bdo")
+        run.main(["plotdata", subset, output, "--checkpoint"])
+        run.main(["plotdata", subset, os.path.join(indir, "subset")])
+        np.testing.assert_allclose(np.loadtxt(output + ".dat"), np.loadtxt(os.path.join(indir, "subset.dat")),
+                                   rtol=1e-5)
+        shutil.rmtree(indir)
+
     def test_standard(self):
         for est in ("cyl", "geomap", "msh", "plane", "zone"):
             logger.info("Estimator: " + est)
@@ -148,6 +220,47 @@ class TestSHGenerated(unittest.TestCase):
                     self.assertEqual(det.nstat, 1000)
                 self.assertGreaterEqual(len(det.data), 1)
 
+    def test_get_object_mmap(self):
+        for est in ("cyl", "geomap", "msh", "plane", "zone"):
+            logger.info("Estimator: " + est)
+            outdir = os.path.join(self.single_dir, est)
+            bdo_files = glob.glob(os.path.join(outdir, "*.bdo"))
+            self.assertGreater(len(bdo_files), 0)
+            for infile in bdo_files:
+                logger.info("Input file: " + infile)
+                det = Detector()
+                det.read(infile)
+                det_mmap = Detector()
+                det_mmap.read(infile, mmap=True)
+                self.assertEqual(det.nstat, det_mmap.nstat)
+                self.assertEqual(det.dettyp, det_mmap.dettyp)
+                np.testing.assert_array_equal(det.data, det_mmap.data)
+
+    def test_read_header(self):
+        for est in ("cyl", "geomap", "msh", "plane", "zone"):
+            logger.info("Estimator: " + est)
+            outdir = os.path.join(self.single_dir, est)
+            bdo_files = glob.glob(os.path.join(outdir, "*.bdo"))
+            self.assertGreater(len(bdo_files), 0)
+            for infile in bdo_files:
+                logger.info("Input file: " + infile)
+                det = Detector()
+                det.read(infile)
+                header = read_header(infile)
+                self.assertEqual(header.geotyp, det.geotyp)
+                self.assertEqual(header.nstat, det.nstat)
+                self.assertEqual((header.nx, header.ny, header.nz), (det.nx, det.ny, det.nz))
+                self.assertEqual((header.xmin, header.xmax), (det.xmin, det.xmax))
+
+    def test_incompatible_files(self):
+        indir = os.path.join(self.many_dir, "msh")
+        outdir = tempfile.mkdtemp()
+        with self.assertRaises(IncompatibleFilesError):
+            merge_list(sorted(glob.glob(os.path.join(indir, "*_p0001.bdo"))), os.path.join(outdir, "out"), None)
+        self.assertEqual(run.main(["plotdata", os.path.join(indir, "*_p0001.bdo"), os.path.join(outdir, "out")]), 1)
+        self.assertEqual(os.listdir(outdir), [])
+        shutil.rmtree(outdir)
+
 
 if __name__ == '__main__':
     unittest.main()
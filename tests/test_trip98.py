@@ -0,0 +1,152 @@
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+import logging
+
+import numpy as np
+
+from pymchelper.detector import Detector
+from pymchelper.shieldhit.detector.detector_type import SHDetType
+from pymchelper.shieldhit.detector.estimator_type import SHGeoType
+from pymchelper.writers.trip98 import TripDddWriter
+
+logger = logging.getLogger(__name__)
+
+
+def _ddd_detector(nr=40, nz=30, rmax_cm=4.0, zmax_cm=15.0):
+    """ Cylindrical DDD detector filled with double gaussian lateral profiles, widening with depth
+    """
+    det = Detector()
+    det.geotyp = SHGeoType.cyl
+    det.dettyp = SHDetType.ddd
+    det.nx, det.ny, det.nz = nr, 1, nz
+    det.xmin, det.xmax = 0.0, rmax_cm
+    det.ymin, det.ymax = 0.0, 2.0 * np.pi
+    det.zmin, det.zmax = 0.0, zmax_cm
+    det.nstat = 1000
+    det.counter = 1
+
+    r_cm = det.bin_centers(0)
+    z_cm = det.bin_centers(2)
+    amplitude = 1.0 + np.exp((z_cm - 0.8 * zmax_cm) / 0.5).clip(max=1e3)  # rough Bragg peak
+    sigma1_cm = 0.3 + 0.02 * z_cm
+    sigma2_add_cm = 0.5 + 0.01 * z_cm
+    dose = TripDddWriter.gauss2_MeV_g(r_cm[None, :], amplitude[:, None], sigma1_cm[:, None],
+                                      0.9, sigma2_add_cm[:, None])
+    det.data = dose.ravel()
+    det.error = np.zeros_like(det.data)
+    return det
+
+
+def _ddd_options(**kwargs):
+    options = argparse.Namespace(energy=150.0, ngauss=2, verbose=0, fit_jobs=1)
+    vars(options).update(kwargs)
+    return options
+
+
+def _ddd_content(filename):
+    """ Lines of DDD file, without file date
+    """
+    with open(filename) as f:
+        return [line for line in f if not line.startswith("!filedate")]
+
+
+class TestTripDddWriter(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.detector = _ddd_detector()
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def _write(self, name, **kwargs):
+        filename = os.path.join(self.workdir, name)
+        TripDddWriter(filename, _ddd_options(**kwargs)).write(self.detector)
+        return filename + ".ddd"
+
+    def test_fit(self):
+        lines = _ddd_content(self._write("serial"))
+        values = np.loadtxt([line for line in lines if not line.startswith(("!", "#"))])
+        self.assertEqual(values.shape[1], 5)
+        fwhm1_cm, weight, fwhm2_cm = values[:, 2], values[:, 3], values[:, 4]
+        self.assertTrue(np.all(np.diff(fwhm1_cm) > 0))  # beam is widening with depth
+        self.assertTrue(np.all(fwhm2_cm > fwhm1_cm))
+        self.assertTrue(np.all((weight >= 0.55) & (weight <= 1.0)))
+
+    def test_fit_summary(self):
+        writer = TripDddWriter(os.path.join(self.workdir, "summary"), _ddd_options())
+        self.assertIsNone(writer.fit_summary)
+        writer.write(self.detector)
+        values = np.loadtxt([line for line in _ddd_content(writer.ddd_filename) if not line.startswith(("!", "#"))])
+        self.assertEqual(writer.fit_summary.nslices, values.shape[0])
+        self.assertAlmostEqual(writer.fit_summary.zmax_cm, values[-1, 0], places=5)
+        self.assertAlmostEqual(writer.fit_summary.peak_cm, values[np.argmax(values[:, 1]), 0], places=5)
+
+    def test_parallel_fit(self):
+        serial = _ddd_content(self._write("serial"))
+        parallel = _ddd_content(self._write("parallel", fit_jobs=2))
+        self.assertEqual(serial, parallel)
+
+    def test_warm_start(self):
+        cold = np.loadtxt([line for line in _ddd_content(self._write("cold")) if not line.startswith(("!", "#"))])
+        warm = np.loadtxt([line for line in _ddd_content(self._write("warm", warm_start=True))
+                           if not line.startswith(("!", "#"))])
+        self.assertEqual(cold.shape, warm.shape)
+        np.testing.assert_allclose(warm[:, :3], cold[:, :3], rtol=1e-2)
+
+    def test_parallel_warm_start(self):
+        self.assertGreater(self.detector.nz, TripDddWriter.warm_chain_length)  # more than one warm start chain
+        serial = _ddd_content(self._write("serial", warm_start=True))
+        parallel = _ddd_content(self._write("parallel", warm_start=True, fit_jobs=2))
+        self.assertEqual(serial, parallel)
+
+    def test_warm_start_fallback(self):
+        r_cm = self.detector.bin_centers(0)
+        dose = self.detector.data.reshape(self.detector.nz, self.detector.nx)[5]
+        expected = TripDddWriter._lateral_fit(r_cm, dose, 0.0, 150.0, ngauss=1)
+
+        # seed with sigma far from optimum, narrowed bounds don't contain it, fit is started from scratch
+        params, params_error, popt = TripDddWriter._warm_lateral_fit(r_cm, dose, 0.0, 150.0, ngauss=1,
+                                                                     seed=[dose.max(), 10.0])
+        self.assertEqual(params, expected[0])
+
+        # seed with exact optimum
+        params, params_error, popt = TripDddWriter._warm_lateral_fit(r_cm, dose, 0.0, 150.0, ngauss=1, seed=popt)
+        np.testing.assert_allclose(params, expected[0], rtol=1e-6)
+
+    def test_plots(self):
+        self.assertFalse([name for name in os.listdir(self.workdir) if name.endswith(".png")])
+        inline = _ddd_content(self._write("inline", plots="inline"))
+        inline_plots = sorted(name for name in os.listdir(self.workdir) if name.endswith(".png"))
+        self.assertTrue(inline_plots)
+        for name in inline_plots:
+            os.remove(os.path.join(self.workdir, name))
+
+        writer = TripDddWriter(os.path.join(self.workdir, "background"), _ddd_options(plots="background"))
+        writer.write(self.detector)
+        self.assertEqual(_ddd_content(writer.ddd_filename), inline)
+        writer.plot_thread.join()
+        self.assertEqual(sorted(name for name in os.listdir(self.workdir) if name.endswith(".png")), inline_plots)
+
+    def test_unknown_plots_mode(self):
+        with self.assertRaises(ValueError):
+            TripDddWriter(os.path.join(self.workdir, "unknown"), _ddd_options(plots="process"))
+
+    def test_no_matplotlib(self):
+        # fitting and writing without plots should not import matplotlib
+        code = "import sys; from tests.test_trip98 import _ddd_detector, _ddd_options; " \
+               "from pymchelper.writers.trip98 import TripDddWriter; " \
+               "TripDddWriter(sys.argv[1], _ddd_options()).write(_ddd_detector()); " \
+               "sys.exit('matplotlib' in sys.modules)"
+        root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        filename = os.path.join(self.workdir, "no_plots")
+        self.assertEqual(subprocess.call([sys.executable, "-c", code, filename], cwd=root_dir), 0)
+        self.assertTrue(os.path.isfile(filename + ".ddd"))
+
+
+if __name__ == '__main__':
+    unittest.main()
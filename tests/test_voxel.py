@@ -0,0 +1,74 @@
+import os
+import struct
+import tempfile
+import unittest
+import logging
+
+import numpy as np
+
+import pymchelper.flair.common.fortran as fortran
+from pymchelper.flair.Input import Voxel
+
+logger = logging.getLogger(__name__)
+
+
+def _write_voxel(filename, organs, kreg, dxyz=(0.1, 0.2, 0.3)):
+    """ Writes voxel file with organ index of each voxel, given as 3D array indexed with (x, y, z)
+    """
+    nx, ny, nz = organs.shape
+    with open(filename, "wb") as f:
+        fortran.write(f, b"phantom".ljust(80))
+        fortran.write(f, struct.pack("=5i", nx, ny, nz, int(organs.max()), len(kreg)))
+        fortran.write(f, struct.pack("=3d", *dxyz))
+        fortran.write(f, organs.astype(np.uint16).tobytes(order="F"))
+        fortran.write(f, np.asarray(kreg, dtype=np.uint16).tobytes())
+
+
+class TestVoxel(unittest.TestCase):
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(suffix=".vxl")
+        os.close(fd)
+        self.organs = np.arange(4 * 3 * 2).reshape(4, 3, 2) % 5
+        self.kreg = np.arange(1, 5)
+        _write_voxel(self.filename, self.organs, self.kreg)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test_read(self):
+        voxel = Voxel(self.filename)
+        self.assertEqual((voxel.nx, voxel.ny, voxel.nz), self.organs.shape)
+        self.assertEqual((voxel.dx, voxel.dy, voxel.dz), (0.1, 0.2, 0.3))
+        self.assertIsInstance(voxel.kreg, np.ndarray)
+        np.testing.assert_array_equal(voxel.kreg, self.kreg)
+
+        self.assertIsNone(voxel._data)  # data is mapped only when needed
+        self.assertIsInstance(voxel.data, np.memmap)
+        np.testing.assert_array_equal(voxel.data, self.organs)
+        self.assertEqual(voxel.data[3, 1, 0], self.organs[3, 1, 0])
+
+    def test_read_again(self):
+        voxel = Voxel(self.filename)
+        np.testing.assert_array_equal(voxel.data, self.organs)
+
+        fd, other_filename = tempfile.mkstemp(suffix=".vxl")
+        os.close(fd)
+        other_organs = self.organs[::-1] + 1
+        _write_voxel(other_filename, other_organs, self.kreg)
+        self.assertTrue(voxel.read(other_filename))
+        np.testing.assert_array_equal(voxel.data, other_organs)
+
+        # data size not matching dimensions
+        with open(other_filename, "wb") as f:
+            fortran.write(f, b"phantom".ljust(80))
+            fortran.write(f, struct.pack("=5i", 4, 3, 2, 4, 4))
+            fortran.write(f, struct.pack("=3d", 0.1, 0.2, 0.3))
+            fortran.write(f, np.zeros(5, dtype=np.uint16).tobytes())
+        self.assertFalse(voxel.read(other_filename))
+        self.assertIsNone(voxel.dataPos)
+        self.assertIsNone(voxel.data)
+        os.remove(other_filename)
+
+
+if __name__ == '__main__':
+    unittest.main()